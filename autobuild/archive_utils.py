@@ -1,4 +1,4 @@
-import multiprocessing
+import os
 import tarfile
 import zipfile
 from typing import Union
@@ -70,7 +70,7 @@ class ZstdTarFile(tarfile.TarFile):
         zstdoption = None
         if mode != 'r' and mode != 'rb':
            zstdoption = {CParameter.compressionLevel : level,
-                         CParameter.nbWorkers : multiprocessing.cpu_count(),
+                         CParameter.nbWorkers : os.cpu_count() or 1,
                          CParameter.checksumFlag : 1}
         self.zstd_file = ZstdFile(name, mode,
                                 level_or_option=zstdoption,
@@ -0,0 +1,342 @@
+"""
+Local cache of build artifacts.
+
+Rebuilding a package from the same source revision, against the same
+installed dependencies, with the same build configuration, commands
+and toolchain environment as an earlier build just produces that build's
+output again. With AUTOBUILD_ARTIFACT_CACHE enabled, 'autobuild build' computes a key from
+exactly those inputs (see build_key()) and 'autobuild package' stores the
+resulting archive and autobuild-package.xml under it. When a later build
+computes a key that is already stored, build restores the recorded
+autobuild-package.xml rather than configuring and building, and package
+restores the recorded archive rather than recreating it.
+
+build tells package which key its output corresponds to with a file in the
+build directory (KEY_FILE), removed whenever a build is not cacheable, and
+marked when build restored rather than built the output. Only an entry
+packaged in the platform's archive format is restored, and package refuses
+to archive a restored build directory in any other format: it holds none
+of the files the build would have produced. Source trees with uncommitted
+changes to tracked files are never cached.
+
+The build id is not part of the key, so CI builds numbered one after
+another share cached output. Restoring rewrites the build id in the
+restored autobuild-package.xml, and so in the name of the restored
+archive; the archive itself is byte for byte the one packaged before,
+including the build id in the autobuild-package.xml inside it. Of the
+environment, only the variables that select or configure the toolchain are
+part of the key (see _key_environment()).
+
+Set AUTOBUILD_ARTIFACT_CACHE=true to use the default cache location, or to
+the path of a directory to use that.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import autobuild.scm.git
+from autobuild import common, configfile
+
+logger = logging.getLogger('autobuild.artifact_cache')
+
+ARTIFACT_CACHE_ENV = "AUTOBUILD_ARTIFACT_CACHE"
+
+# written into the build directory by build, read by package
+KEY_FILE = ".autobuild-artifact-key"
+
+_BUILD_METADATA = "build-" + configfile.PACKAGE_METADATA_FILE
+_PACKAGE_METADATA = "package-" + configfile.PACKAGE_METADATA_FILE
+_ENTRY_FILE = "entry.json"
+
+# Bump if the inputs to the key or the layout of entries change.
+_CACHE_FORMAT = 3
+
+# Environment variables, and prefixes of them, that select or configure the
+# toolchain or the build (compared in upper case, as on Windows)
+_KEY_ENVIRONMENT = frozenset((
+    'AR', 'AS', 'CC', 'CFLAGS', 'CPP', 'CPPFLAGS', 'CXX', 'CXXFLAGS', 'DEVELOPER_DIR',
+    'INCLUDE', 'LD', 'LDFLAGS', 'LIB', 'LIBPATH', 'LIBS', 'MACOSX_DEPLOYMENT_TARGET', 'NM',
+    'OBJC', 'OBJCFLAGS', 'PATH', 'PKG_CONFIG_PATH', 'RANLIB', 'SDKROOT', 'STRIP',
+    'VISUALSTUDIOVERSION',
+))
+_KEY_ENVIRONMENT_PREFIXES = ('AUTOBUILD_', 'CMAKE_', 'LL_', 'VC', 'VS', 'WINDOWSSDK')
+# autobuild's own settings that don't change what is built
+_UNKEYED_ENVIRONMENT = frozenset((
+    'AUTOBUILD_ARTIFACT_CACHE', 'AUTOBUILD_BUILD_ID', 'AUTOBUILD_CONFIG_CACHE', 'AUTOBUILD_CONFIG_FILE',
+    'AUTOBUILD_CPU_COUNT', 'AUTOBUILD_ENVIRONMENT_CACHE', 'AUTOBUILD_GITHUB_TOKEN',
+    'AUTOBUILD_GITLAB_TOKEN', 'AUTOBUILD_INSTALLABLE_CACHE', 'AUTOBUILD_LOGLEVEL', 'AUTOBUILD_SERVER',
+    'AUTOBUILD_TRACE', 'AUTOBUILD_TRACE_ID', 'AUTOBUILD_TRACE_PARENT',
+))
+
+
+def get_cache_dir():
+    """
+    Return the artifact cache directory, or None if the cache is disabled.
+    """
+    setting = os.environ.get(ARTIFACT_CACHE_ENV, "")
+    if not setting or common.is_env_disabled(ARTIFACT_CACHE_ENV):
+        return None
+    if common.is_env_enabled(ARTIFACT_CACHE_ENV):
+        return common.get_temp_dir("artifact.cache")
+    os.makedirs(setting, exist_ok=True)
+    return setting
+
+
+def _entry_dir(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], key)
+
+
+def _installed_dependencies(installed_pathname):
+    if not os.path.exists(installed_pathname):
+        return []
+    installed = configfile.Dependencies(installed_pathname)
+    dependencies = []
+    for name, package in sorted(installed.dependencies.items()):
+        archive = package.get('archive') or {}
+        dependencies.append((name, archive.get('hash_algorithm'), archive.get('hash'),
+                             (package.get('package_description') or {}).get('version')))
+    return dependencies
+
+
+def _key_environment(environment):
+    """
+    Return the sorted (name, value) pairs of environment that are part of
+    the key.
+    """
+    return sorted((name, value) for name, value in environment.items()
+                  if name.upper() not in _UNKEYED_ENVIRONMENT and
+                  (name.upper() in _KEY_ENVIRONMENT or name.upper().startswith(_KEY_ENVIRONMENT_PREFIXES)))
+
+
+def build_key(config, build_configuration, platform, extra_arguments, installed_pathname,
+              environment=None):
+    """
+    Return the cache key for building build_configuration of config (already
+    expanded for platform) with extra_arguments, against the packages
+    recorded in installed_pathname, in environment (by default, os.environ):
+    or None if the cache is disabled or the build cannot be cached.
+    """
+    if get_cache_dir() is None:
+        return None
+    source_directory = os.path.dirname(os.path.abspath(config.path))
+    git = autobuild.scm.git.new_client(source_directory)
+    if not git or not git.repo_dir:
+        logger.info("not caching build: %s is not in a git repository" % source_directory)
+        return None
+    if git.dirty:
+        logger.info("not caching build: %s has uncommitted changes" % git.repo_dir)
+        return None
+    state = dict(
+        format=_CACHE_FORMAT,
+        autobuild=common.AUTOBUILD_VERSION_STRING,
+        revision=git.revision,
+        # where autobuild.xml lives within the repository
+        config=os.path.relpath(os.path.abspath(config.path), str(git.repo_dir)),
+        platform=platform,
+        configuration=build_configuration.name,
+        extra_arguments=list(extra_arguments),
+        environment=_key_environment(os.environ if environment is None else environment),
+        # includes the expanded build configurations and their commands
+        package_description=config.package_description,
+        dependencies=_installed_dependencies(installed_pathname),
+    )
+    return hashlib.blake2b(json.dumps(state, sort_keys=True, default=str).encode('utf-8'),
+                           digest_size=32).hexdigest()
+
+
+def _read_key_file(build_directory):
+    try:
+        with open(os.path.join(build_directory, KEY_FILE)) as f:
+            return f.read().split()
+    except OSError:
+        return []
+
+
+def _read_key(build_directory):
+    words = _read_key_file(build_directory)
+    return words[0] if words else None
+
+
+def was_restored(build_directory):
+    """
+    Return True if build restored the contents of build_directory from the
+    cache rather than building them.
+    """
+    return _read_key_file(build_directory)[1:] == ["restored"]
+
+
+def _read_entry(cache_dir, key):
+    try:
+        with open(os.path.join(_entry_dir(cache_dir, key), _ENTRY_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _copy_atomically(source, destination):
+    directory = os.path.dirname(destination)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(fd)
+    try:
+        shutil.copyfile(source, temp_name)
+        os.replace(temp_name, destination)
+    except BaseException:
+        os.remove(temp_name)
+        raise
+
+
+def _write_entry(entry_dir, entry):
+    fd, temp_name = tempfile.mkstemp(dir=entry_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entry, f)
+        os.replace(temp_name, os.path.join(entry_dir, _ENTRY_FILE))
+    except BaseException:
+        os.remove(temp_name)
+        raise
+
+
+def forget(build_directory):
+    """
+    Record that the contents of build_directory correspond to no cache entry.
+    """
+    try:
+        os.remove(os.path.join(build_directory, KEY_FILE))
+    except FileNotFoundError:
+        pass
+
+
+def _remember(build_directory, key, restored=False):
+    with open(os.path.join(build_directory, KEY_FILE), 'w') as f:
+        f.write(key + (" restored\n" if restored else "\n"))
+
+
+def _restore_metadata(source, build_directory, build_id):
+    """
+    Copy the autobuild-package.xml source into build_directory, as built
+    with build_id.
+    """
+    metadata_path = os.path.join(build_directory, configfile.PACKAGE_METADATA_FILE)
+    _copy_atomically(source, metadata_path)
+    metadata_file = configfile.MetadataDescription(path=metadata_path)
+    metadata_file.build_id = build_id
+    metadata_file.save()
+
+
+def restore_build(key, build_directory, build_id, format):
+    """
+    If the build identified by key has been built and packaged in format
+    before, restore its autobuild-package.xml into build_directory, with
+    build_id in place of the build id it was built with, and return True;
+    otherwise return False.
+    """
+    cache_dir = get_cache_dir()
+    if cache_dir is None or key is None:
+        return False
+    entry = _read_entry(cache_dir, key)
+    entry_dir = _entry_dir(cache_dir, key)
+    if not entry or entry.get('format') != format or \
+       not os.path.exists(os.path.join(entry_dir, entry['archive'])):
+        return False
+    _restore_metadata(os.path.join(entry_dir, _BUILD_METADATA), build_directory, build_id)
+    _remember(build_directory, key, restored=True)
+    logger.warning("restored build %s from artifact cache" % key)
+    return True
+
+
+def store_build(key, build_directory):
+    """
+    Record the autobuild-package.xml just built in build_directory under key.
+    The entry is not usable until package has stored an archive for it.
+    """
+    cache_dir = get_cache_dir()
+    if cache_dir is None or key is None:
+        return
+    try:
+        entry_dir = _entry_dir(cache_dir, key)
+        _copy_atomically(os.path.join(build_directory, configfile.PACKAGE_METADATA_FILE),
+                         os.path.join(entry_dir, _BUILD_METADATA))
+        _remember(build_directory, key)
+    except OSError as err:
+        logger.warning("unable to store build in artifact cache: %s" % err)
+        forget(build_directory)
+
+
+def _package_entry(build_directory, format):
+    cache_dir = get_cache_dir()
+    key = _read_key(build_directory) if cache_dir is not None else None
+    if key is None:
+        return None, None
+    entry = _read_entry(cache_dir, key)
+    entry_dir = _entry_dir(cache_dir, key)
+    if not entry or entry.get('format') != format or \
+       not os.path.exists(os.path.join(entry_dir, entry['archive'])):
+        return None, None
+    return entry, entry_dir
+
+
+def restore_package_metadata(build_directory, format):
+    """
+    If the build in build_directory has been packaged in format before,
+    restore the autobuild-package.xml recorded by packaging it, keeping the
+    build id of the build in build_directory, and return True (the caller
+    then calls restore_package()); otherwise return False.
+    """
+    entry, entry_dir = _package_entry(build_directory, format)
+    if entry is None:
+        return False
+    build_id = configfile.MetadataDescription(
+        path=os.path.join(build_directory, configfile.PACKAGE_METADATA_FILE)).build_id
+    _restore_metadata(os.path.join(entry_dir, _PACKAGE_METADATA), build_directory, build_id)
+    return True
+
+
+def restore_package(build_directory, format, tarfilename, results):
+    """
+    Restore the package recorded for the build in build_directory as
+    tarfilename (plus the archive suffix), filling in results as packaging
+    would have.
+    """
+    entry, entry_dir = _package_entry(build_directory, format)
+    if entry is None:
+        raise common.AutobuildError("artifact cache entry for %s has gone" % build_directory)
+    archive_filename = tarfilename + entry['suffix']
+    _copy_atomically(os.path.join(entry_dir, entry['archive']), archive_filename)
+    results.update(entry['results'])
+    results['autobuild_package_filename'] = archive_filename
+    # printing unconditionally on stdout, as packaging does
+    print("restored %s from artifact cache" % archive_filename)
+
+
+def store_package(build_directory, format, tarfilename, results):
+    """
+    Record the package just created from build_directory, described by
+    results, in the cache entry for that build.
+    """
+    cache_dir = get_cache_dir()
+    key = _read_key(build_directory) if cache_dir is not None else None
+    if key is None or was_restored(build_directory):
+        return
+    entry_dir = _entry_dir(cache_dir, key)
+    archive_filename = results['autobuild_package_filename']
+    try:
+        if not os.path.exists(os.path.join(entry_dir, _BUILD_METADATA)):
+            return
+        _copy_atomically(archive_filename, os.path.join(entry_dir, os.path.basename(archive_filename)))
+        _copy_atomically(os.path.join(build_directory, configfile.PACKAGE_METADATA_FILE),
+                         os.path.join(entry_dir, _PACKAGE_METADATA))
+        _write_entry(entry_dir, dict(
+            format=format,
+            archive=os.path.basename(archive_filename),
+            suffix=archive_filename[len(tarfilename):],
+            # where the archive and metadata are now is up to restore_package()
+            results={name: value for name, value in results.items()
+                     if name not in ('autobuild_package_filename', 'autobuild_package_metadata')}))
+        logger.info("stored package %s in artifact cache" % key)
+    except OSError as err:
+        logger.warning("unable to store package in artifact cache: %s" % err)
@@ -2,13 +2,11 @@
 import argparse
 import glob
 import importlib
-import importlib.util
 import logging
 import os
 import sys
-from pathlib import Path
 
-from autobuild import common
+from autobuild import common, tracing
 from autobuild.common import AutobuildError
 
 ## Environment variable name used for default log level verbosity
@@ -16,11 +14,31 @@ AUTOBUILD_LOGLEVEL = 'AUTOBUILD_LOGLEVEL'
 
 _SCRIPT_DIR = os.path.abspath(os.path.dirname(__file__))
 
+## The tools autobuild provides, as tool name: the description its
+## AutobuildTool.get_details() returns. Listing them here lets autobuild
+## --help describe every tool, and autobuild <tool> find its module, without
+## importing any tool module but the one being run: most of them import
+## configfile, llsd and friends, which is most of autobuild's startup time.
+## (tests/test_autobuild_main.py checks this against the tools themselves.)
+TOOLS = {
+    'build': "Builds platform targets.",
+    'configure': "Configures platform targets.",
+    'edit': "Manage build and package configuration.",
+    'graph': "Graph package dependencies.",
+    'install': "Fetch and install package archives.",
+    'installables': "Manipulate installable package entries in the autobuild configuration.",
+    'manifest': "Manipulate manifest entries to the autobuild configuration.",
+    'package': "Creates an archive of build output.",
+    'print': "Print configuration.",
+    'server': "Serve autobuild commands from a resident process.",
+    'source_environment': "Prints out the shell environment Autobuild-based buildscripts to use (by calling 'eval').",
+    'uninstall': "Uninstall package archives.",
+}
+
 
 class RunHelp(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
-        parser.parent.search_for_and_import_tools(parser.parent.tools_list)
-        parser.parent.register_tools(parser.parent.tools_list)
+        parser.parent.register_tool_summaries()
         print(parser.format_help())
         parser.exit(0)
 
@@ -76,9 +94,18 @@ class Autobuild(object):
         for tool in tools_list:
             self.register_tool(tool)
 
+    def register_tool_summaries(self):
+        """
+        Add a subparser for each tool in TOOLS not already registered, with
+        just its description: enough for the top-level help.
+        """
+        for name, description in TOOLS.items():
+            if name not in self.subparsers.choices:
+                self.subparsers.add_parser(name, help=description)
+
     def search_for_and_import_tools(self, tools_list):
         for file_name in glob.glob(os.path.join(_SCRIPT_DIR, 'autobuild_tool_*.py')):
-            module_name = Path(file_name).stem
+            module_name = os.path.splitext(os.path.basename(file_name))[0]
             possible_tool_module = importlib.import_module('.{}'.format(module_name), package='autobuild')
             if hasattr(possible_tool_module, 'AutobuildTool'):
                 tools_list.append(possible_tool_module)
@@ -174,6 +201,12 @@ class Autobuild(object):
                             default=int(os.environ.get('AUTOBUILD_ADDRSIZE',common.DEFAULT_ADDRSIZE)),
                             dest='addrsize',
                             help='specify address size (modifies platform)')),
+            (('--trace',),
+                dict(default=os.environ.get(tracing.TRACE_ENV) or None,
+                     dest='trace',
+                     metavar='FILE',
+                     help='write a Chrome trace of the time spent in each phase to FILE '
+                          '(defaults to $%s)' % tracing.TRACE_ENV)),
         )
         for args, kwds in argdefs:
             self.parser.add_argument(*args, **kwds)
@@ -203,7 +236,8 @@ class Autobuild(object):
         platform = common.establish_platform(args.platform, addrsize=args.addrsize)
 
         if tool_to_run != -1:
-            tool_to_run.run(args)
+            with tracing.session(args.trace, ' '.join(['autobuild'] + args_in)):
+                tool_to_run.run(args)
         else:
             self.parser.print_help()
             self.parser.error("no command specified")
@@ -221,6 +255,13 @@ def main():
         # Dedup the path after appending script_path in case it's already
         # present in the PATH string.
         os.environ['PATH'] = common.dedup_path(os.pathsep.join((os.environ.get('PATH'), script_path)))
+        # with AUTOBUILD_SERVER (server.SERVER_ENV) set, let a resident
+        # autobuild run the command; otherwise don't even import the client
+        if os.environ.get("AUTOBUILD_SERVER"):
+            from autobuild import server
+            status = server.run_on_server(sys.argv[1:])
+            if status is not None:
+                sys.exit(status)
         sys.exit(Autobuild().main(sys.argv[1:]))
     except KeyboardInterrupt as e:
         sys.exit("Aborted...")
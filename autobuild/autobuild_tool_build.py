@@ -6,10 +6,12 @@ import copy
 import logging
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 
 import autobuild.scm.git
-from autobuild import autobuild_base, common, configfile
+from autobuild import artifact_cache, autobuild_base, common, configfile
 from autobuild.autobuild_tool_configure import _configure_a_configuration
+from autobuild.autobuild_tool_package import _determine_archive_format
 from autobuild.autobuild_tool_source_environment import get_enriched_environment
 from autobuild.build_id import establish_build_id
 from autobuild.common import AutobuildError, is_env_enabled
@@ -35,7 +37,8 @@ class AutobuildTool(autobuild_base.AutobuildBase):
 
     def register(self, parser):
         parser.usage = """%(prog)s [-h] [--no-configure] [--config-file CONFIG_FILE] [-a]
-                       [-c CONFIGURATION] [--dry-run] -- [OPT [OPT ...]]"""
+                       [-c CONFIGURATION] [--parallel-configurations]
+                       [--reconfigure] [--dry-run] -- [OPT [OPT ...]]"""
         parser.description = "build the current package and copy its output artifacts into the build directory for use by the 'autobuild package' command."
         parser.add_argument('--config-file',
                             dest='config_file',
@@ -46,6 +49,12 @@ class AutobuildTool(autobuild_base.AutobuildBase):
                             default=False,
                             action="store_true",
                             help="do not configure before building")
+        parser.add_argument('--reconfigure',
+                            dest='reconfigure',
+                            default=False,
+                            action="store_true",
+                            help="configure before building even if nothing configure depends on "
+                            "has changed since the last time")
         parser.add_argument('build_extra_arguments', nargs="*", metavar='OPT',
                             help="an option to pass to the build command")
         parser.add_argument('--all', '-a', dest='all', default=False, action="store_true",
@@ -55,6 +64,12 @@ class AutobuildTool(autobuild_base.AutobuildBase):
                             metavar='CONFIGURATION',
                             default=self.configurations_from_environment())
         parser.add_argument('--id', '-i', dest='build_id', type=int, help='unique build number')
+        parser.add_argument('--parallel-configurations',
+                            dest='parallel_configurations',
+                            default=False,
+                            action="store_true",
+                            help="configure and build the selected configurations concurrently, "
+                            "dividing $AUTOBUILD_CPU_COUNT among them")
 
         parser.add_argument('--clean-only',
                             action="store_true",
@@ -92,18 +107,17 @@ class AutobuildTool(autobuild_base.AutobuildBase):
                              "did you remember to mark a configuration as default?\n"
                              "autobuild cowardly refuses to do nothing!")
 
+            if args.parallel_configurations and len(build_configurations) > 1 and not args.dry_run \
+               and _build_in_parallel(args, config, build_configurations, platform, build_id, configure_first):
+                return
+
             for build_configuration in build_configurations:
-                # Get enriched environment based on the current configuration
-                environment = get_enriched_environment(build_configuration.name)
-                # then get a copy of the config specific to this build
-                # configuration
-                bconfig = config.copy()
-                # and expand its $variables according to the environment.
-                bconfig.expand_platform_vars(environment)
-                # Re-fetch the build configuration so we have its expansions.
-                build_configuration = bconfig.get_build_configuration(build_configuration.name, platform_name=platform)
-                build_directory = bconfig.make_build_directory(
-                    build_configuration, platform=platform, dry_run=args.dry_run)
+                bconfig, build_configuration, build_directory, environment = \
+                    _prepare_configuration(args, config, build_configuration, platform)
+                restored, cache_key = _restore_from_cache(args, bconfig, build_configuration,
+                                                          build_directory, environment, platform, build_id)
+                if restored:
+                    continue
                 if not args.dry_run:
                     logger.debug("building in %s" % build_directory)
                     os.chdir(build_directory)
@@ -113,7 +127,10 @@ class AutobuildTool(autobuild_base.AutobuildBase):
                 if configure_first:
                     result = _configure_a_configuration(bconfig, build_configuration,
                                                         args.build_extra_arguments, args.dry_run,
-                                                        environment=environment)
+                                                        environment=environment,
+                                                        build_directory=build_directory,
+                                                        installed_pathname=_installed_pathname(args, build_directory),
+                                                        reconfigure=args.reconfigure)
                     if result != 0:
                         raise BuildError("configuring default configuration returned %d" % result)
                 result = _build_a_configuration(bconfig, build_configuration,
@@ -121,96 +138,250 @@ class AutobuildTool(autobuild_base.AutobuildBase):
                                                 extra_arguments=args.build_extra_arguments,
                                                 dry_run=args.dry_run,
                                                 environment=environment)
-                # always make clean copy of the build metadata regardless of result
-                metadata_file_name = configfile.PACKAGE_METADATA_FILE
-                logger.debug("metadata file name: %s" % metadata_file_name)
-                if os.path.exists(metadata_file_name):
-                    if not args.dry_run:
-                        os.unlink(metadata_file_name)
-                    else:
-                        logger.info("would have replaced %s" % metadata_file_name)
-                if result != 0:
-                    raise BuildError("building configuration %s returned %d" %
-                                     (build_configuration, result))
-
-                # Create the metadata record for inclusion in the package
-                metadata_file = configfile.MetadataDescription(path=metadata_file_name, create_quietly=True)
-                # COPY the package description from the configuration: we're
-                # going to convert it to metadata format.
-                metadata_file.package_description = \
-                    configfile.PackageDescription(bconfig.package_description)
-                # A metadata package_description has a version attribute
-                # instead of a version_file attribute.
-                if config.package_description.use_scm_version:
-                    try:
-                        metadata_file.package_description.version = \
-                            metadata_file.package_description.read_scm_version(build_directory)
-                    except LookupError:
-                        raise BuildError(
-                            'use_scm_version specified in autobuild.xml but no version found in source control (git).'
-                        )
-                else:
-                    if 'version_file' not in metadata_file.package_description:
-                        raise BuildError('No version_file specified in autobuild.xml.')
-                    metadata_file.package_description.version = \
-                        metadata_file.package_description.read_version_file(build_directory)
-                    del metadata_file.package_description["version_file"]
-                logger.info("built %s version %s" %
-                            (metadata_file.package_description.name,
-                             metadata_file.package_description.version))
-                metadata_file.package_description.platforms = None  # omit data on platform configurations
-                metadata_file.platform = platform
-                metadata_file.configuration = build_configuration.name
-                metadata_file.build_id = build_id
-
-                if common.is_env_enabled('AUTOBUILD_VCS_INFO'):
-                    git = autobuild.scm.git.new_client(build_directory)
-                    if git:
-                        metadata_file.package_description.vcs_branch = os.environ.get("AUTOBUILD_VCS_BRANCH", git.branch)
-                        metadata_file.package_description.vcs_revision = os.environ.get("AUTOBUILD_VCS_REVISION", git.revision)
-                        metadata_file.package_description.vcs_url = os.environ.get("AUTOBUILD_VCS_URL", git.url)
-                    else:
-                        logger.warning("Unable to initialize git. Repository not found or git CLI not available")
-
-                # get the record of any installed packages
-                logger.debug("installed files in " + args.installed_filename)
-
-                # SL-773: This if/else partly replicates
-                # common.select_directories() because our build_directory
-                # comes from bconfig, which has been $-expanded.
-                # The former select_directories() call produced (e.g.)
-                # build-vc120-$AUTOBUILD_ADDRSIZE, which didn't exist.
-                if args.select_dir:
-                    install_dir = args.select_dir
-                    logger.debug("specified metadata directory: {}"
-                                 .format(install_dir))
-                else:
-                    # packages were written into 'packages' subdir of build directory by default
-                    install_dir = os.path.join(build_directory, "packages")
-                    logger.debug("metadata in build subdirectory: {}"
-                                 .format(install_dir))
-
-                # load the list of already installed packages
-                installed_pathname = os.path.realpath(
-                    os.path.join(install_dir, args.installed_filename))
-                if os.path.exists(installed_pathname):
-                    metadata_file.add_dependencies(installed_pathname)
-                else:
-                    logger.debug("no installed files found (%s)" % installed_pathname)
-                if args.clean_only and metadata_file.dirty:
-                    raise BuildError("Build depends on local or legacy installables\n"
-                               +"  use 'autobuild install --list-dirty' to see problem packages\n"
-                               +"  rerun without --clean-only to allow building anyway")
-                if not args.dry_run:
-                    metadata_file.save()
+                _write_metadata(args, config, bconfig, build_configuration, build_directory,
+                                platform, build_id, result)
+                artifact_cache.store_build(cache_key, build_directory)
         finally:
             os.chdir(current_directory)
 
 
+def _prepare_configuration(args, config, build_configuration, platform, cpu_count=None,
+                           establish_build_dir=True):
+    """
+    Return (bconfig, build_configuration, build_directory, environment) for
+    building build_configuration: the configuration expanded for it, its
+    expanded BuildConfigurationDescription, its build directory (created if
+    need be, and made the current build directory if establish_build_dir)
+    and the environment in which to run its commands.
+    """
+    # Get enriched environment based on the current configuration
+    environment = get_enriched_environment(build_configuration.name)
+    if cpu_count is not None:
+        # this configuration's share of the CPUs, set before expansion so
+        # that $AUTOBUILD_CPU_COUNT in autobuild.xml sees it too
+        environment['AUTOBUILD_CPU_COUNT'] = str(cpu_count)
+    # then get a copy of the config specific to this build
+    # configuration
+    bconfig = config.copy_on_write()
+    # and expand its $variables according to the environment.
+    bconfig.expand_platform_vars(environment, platform=platform)
+    # Re-fetch the build configuration so we have its expansions.
+    build_configuration = bconfig.get_build_configuration(build_configuration.name, platform_name=platform)
+    build_directory = bconfig.make_build_directory(
+        build_configuration, platform=platform, dry_run=args.dry_run, establish=establish_build_dir)
+    return bconfig, build_configuration, build_directory, environment
+
+
+def _restore_from_cache(args, bconfig, build_configuration, build_directory, environment, platform, build_id):
+    """
+    Return (restored, key): whether build_configuration's output was restored
+    from the artifact cache, and if not, the key under which to store it
+    once built (None if it is not to be cached).
+    """
+    if args.dry_run:
+        return False, None
+    key = artifact_cache.build_key(bconfig, build_configuration, platform, args.build_extra_arguments,
+                                   _installed_pathname(args, build_directory), environment)
+    # package archives in the platform's format unless told otherwise
+    format = _determine_archive_format(None, bconfig.get_platform(platform).archive)
+    if artifact_cache.restore_build(key, build_directory, build_id, format):
+        return True, key
+    # whatever the build directory held, it is about to be rebuilt
+    artifact_cache.forget(build_directory)
+    return False, key
+
+
+def _split_cpu_count(total, parts):
+    """
+    Divide total CPUs as evenly as possible into at most parts shares, each
+    of at least one CPU.
+    """
+    parts = max(1, min(parts, total))
+    return [total // parts + (1 if index < total % parts else 0) for index in range(parts)]
+
+
+def _build_in_parallel(args, config, build_configurations, platform, build_id, configure_first):
+    """
+    Configure and build each of build_configurations concurrently, each in
+    its own build directory with its own environment, rather than changing
+    the working directory and building them one after another. Output lines
+    are prefixed with the configuration name. The AUTOBUILD_CPU_COUNT CPUs
+    are divided among the configurations running at once.
+
+    Returns False, having built nothing, if two of the configurations share
+    a build directory: they must be built one after another.
+    """
+    try:
+        total_cpus = int(os.environ.get('AUTOBUILD_CPU_COUNT') or os.cpu_count() or 1)
+    except ValueError:
+        raise BuildError("AUTOBUILD_CPU_COUNT must be a number, not %r" % os.environ['AUTOBUILD_CPU_COUNT'])
+    shares = _split_cpu_count(total_cpus, len(build_configurations))
+    # No one build directory is current while they all build, so none is
+    # established.
+    prepared_configurations = [_prepare_configuration(args, config, build_configuration, platform,
+                                                      cpu_count=shares[index % len(shares)],
+                                                      establish_build_dir=False)
+                               for index, build_configuration in enumerate(build_configurations)]
+    by_directory = {}
+    for bconfig, build_configuration, build_directory, environment in prepared_configurations:
+        by_directory.setdefault(os.path.normcase(os.path.realpath(build_directory)), []) \
+            .append(build_configuration.name)
+    shared = [names for names in by_directory.values() if len(names) > 1]
+    if shared:
+        logger.warning("configurations %s share a build directory; building them one after another" %
+                       "; ".join(", ".join(names) for names in shared))
+        return False
+
+    logger.info("building %d configurations in parallel, %s CPUs each" %
+                (len(build_configurations), "/".join(str(share) for share in shares)))
+    prepared = []
+    cache_keys = []
+    for prepared_configuration in prepared_configurations:
+        restored, cache_key = _restore_from_cache(args, *prepared_configuration, platform, build_id)
+        if not restored:
+            prepared.append(prepared_configuration)
+            cache_keys.append(cache_key)
+
+    def build(prepared_configuration):
+        bconfig, build_configuration, build_directory, environment = prepared_configuration
+        prefix = "[%s] " % build_configuration.name
+        logger.debug("building in %s" % build_directory)
+        if configure_first:
+            result = _configure_a_configuration(bconfig, build_configuration,
+                                                args.build_extra_arguments,
+                                                environment=environment,
+                                                cwd=build_directory, output_prefix=prefix,
+                                                build_directory=build_directory,
+                                                installed_pathname=_installed_pathname(args, build_directory),
+                                                reconfigure=args.reconfigure)
+            if result != 0:
+                raise BuildError("configuring configuration %s returned %d" %
+                                 (build_configuration.name, result))
+        return _build_a_configuration(bconfig, build_configuration,
+                                      platform_name=platform,
+                                      extra_arguments=args.build_extra_arguments,
+                                      environment=environment,
+                                      cwd=build_directory, output_prefix=prefix)
+
+    with ThreadPoolExecutor(max_workers=len(shares)) as executor:
+        futures = [executor.submit(build, prepared_configuration) for prepared_configuration in prepared]
+
+    errors = []
+    for (bconfig, build_configuration, build_directory, environment), future, cache_key in \
+            zip(prepared, futures, cache_keys):
+        try:
+            _write_metadata(args, config, bconfig, build_configuration, build_directory,
+                            platform, build_id, future.result())
+        except AutobuildError as err:
+            errors.append(err)
+        else:
+            artifact_cache.store_build(cache_key, build_directory)
+    if errors:
+        raise BuildError("\n".join(str(error) for error in errors))
+    return True
+
+
+def _write_metadata(args, config, bconfig, build_configuration, build_directory,
+                    platform, build_id, result):
+    """
+    Having built build_configuration in build_directory with the given result
+    code, replace its metadata file: raise BuildError if the build failed.
+    """
+    # always make clean copy of the build metadata regardless of result
+    metadata_file_name = os.path.join(build_directory, configfile.PACKAGE_METADATA_FILE)
+    logger.debug("metadata file name: %s" % metadata_file_name)
+    if os.path.exists(metadata_file_name):
+        if not args.dry_run:
+            os.unlink(metadata_file_name)
+        else:
+            logger.info("would have replaced %s" % metadata_file_name)
+    if result != 0:
+        raise BuildError("building configuration %s returned %d" %
+                         (build_configuration.name, result))
+
+    # Create the metadata record for inclusion in the package
+    metadata_file = configfile.MetadataDescription(path=metadata_file_name, create_quietly=True)
+    # COPY the package description from the configuration: we're
+    # going to convert it to metadata format.
+    metadata_file.package_description = \
+        configfile.PackageDescription(bconfig.package_description)
+    # A metadata package_description has a version attribute
+    # instead of a version_file attribute.
+    if config.package_description.use_scm_version:
+        try:
+            metadata_file.package_description.version = \
+                metadata_file.package_description.read_scm_version(build_directory)
+        except LookupError:
+            raise BuildError(
+                'use_scm_version specified in autobuild.xml but no version found in source control (git).'
+            )
+    else:
+        if 'version_file' not in metadata_file.package_description:
+            raise BuildError('No version_file specified in autobuild.xml.')
+        metadata_file.package_description.version = \
+            metadata_file.package_description.read_version_file(build_directory)
+        del metadata_file.package_description["version_file"]
+    logger.info("built %s version %s" %
+                (metadata_file.package_description.name,
+                 metadata_file.package_description.version))
+    metadata_file.package_description.platforms = None  # omit data on platform configurations
+    metadata_file.platform = platform
+    metadata_file.configuration = build_configuration.name
+    metadata_file.build_id = build_id
+
+    if common.is_env_enabled('AUTOBUILD_VCS_INFO'):
+        git = autobuild.scm.git.new_client(build_directory)
+        if git:
+            metadata_file.package_description.vcs_branch = os.environ.get("AUTOBUILD_VCS_BRANCH", git.branch)
+            metadata_file.package_description.vcs_revision = os.environ.get("AUTOBUILD_VCS_REVISION", git.revision)
+            metadata_file.package_description.vcs_url = os.environ.get("AUTOBUILD_VCS_URL", git.url)
+        else:
+            logger.warning("Unable to initialize git. Repository not found or git CLI not available")
+
+    # get the record of any installed packages
+    logger.debug("installed files in " + args.installed_filename)
+
+    # load the list of already installed packages
+    installed_pathname = _installed_pathname(args, build_directory)
+    if os.path.exists(installed_pathname):
+        metadata_file.add_dependencies(installed_pathname)
+    else:
+        logger.debug("no installed files found (%s)" % installed_pathname)
+    if args.clean_only and metadata_file.dirty:
+        raise BuildError("Build depends on local or legacy installables\n"
+                   +"  use 'autobuild install --list-dirty' to see problem packages\n"
+                   +"  rerun without --clean-only to allow building anyway")
+    if not args.dry_run:
+        metadata_file.save()
+
+
+def _installed_pathname(args, build_directory):
+    """
+    Return the pathname of the installed-packages file for a build in
+    build_directory.
+    """
+    # SL-773: This if/else partly replicates
+    # common.select_directories() because our build_directory
+    # comes from bconfig, which has been $-expanded.
+    # The former select_directories() call produced (e.g.)
+    # build-vc120-$AUTOBUILD_ADDRSIZE, which didn't exist.
+    if args.select_dir:
+        # relative to the build directory, as when building sequentially
+        install_dir = os.path.join(build_directory, args.select_dir)
+        logger.debug("specified metadata directory: {}"
+                     .format(install_dir))
+    else:
+        # packages were written into 'packages' subdir of build directory by default
+        install_dir = os.path.join(build_directory, "packages")
+        logger.debug("metadata in build subdirectory: {}"
+                     .format(install_dir))
+    return os.path.realpath(os.path.join(install_dir, args.installed_filename))
+
+
 def _build_a_configuration(config, build_configuration,
                            platform_name=common.get_current_platform(),
                            extra_arguments=[], dry_run=False,
-                           environment={}):
+                           environment={}, cwd=None, output_prefix=None):
     try:
         common_build_configuration = \
             config.get_build_configuration(build_configuration.name, platform_name=common.PLATFORM_COMMON)
@@ -231,6 +402,7 @@ def _build_a_configuration(config, build_configuration,
         return 0
     logger.info('executing build command:\n  %s', build_executable.__str__(extra_arguments))
     if not dry_run:
-        return build_executable(extra_arguments, environment=environment)
+        return build_executable(extra_arguments, environment=environment,
+                                cwd=cwd, output_prefix=output_prefix)
     else:
         return 0
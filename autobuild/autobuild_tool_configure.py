@@ -3,6 +3,8 @@ Configures source in preparation for building.
 """
 
 import copy
+import hashlib
+import json
 import logging
 import os
 
@@ -18,13 +20,30 @@ class ConfigurationError(AutobuildError):
     pass
 
 
+# Recorded in the build directory after a successful configure: the digest
+# of everything the configure step depends on (see _configure_fingerprint()).
+CONFIGURE_FINGERPRINT_FILE = ".autobuild-configure-%s.fingerprint"
+
+# Environment variables that change from run to run without affecting what
+# configure does. AUTOBUILD_BUILD_ID is not one of them: configure may stamp
+# it into what it generates.
+_VOLATILE_ENVIRONMENT = frozenset((
+    'AUTOBUILD_LOGLEVEL',
+    'AUTOBUILD_TRACE', 'AUTOBUILD_TRACE_ID', 'AUTOBUILD_TRACE_PARENT',
+    'OLDPWD', 'PWD', 'SHLVL', '_',
+))
+
+# Bump if the contents of the fingerprint change.
+_FINGERPRINT_FORMAT = 1
+
+
 class AutobuildTool(autobuild_base.AutobuildBase):
     def get_details(self):
         return dict(name='configure',
                     description="Configures platform targets.")
 
     def register(self, parser):
-        parser.usage = "%(prog)s [-h] [--dry-run] [-c CONFIGURATION][-a][--config-file FILE] [-- OPT [OPT ...]]"
+        parser.usage = "%(prog)s [-h] [--dry-run] [-c CONFIGURATION][-a][--config-file FILE] [--reconfigure] [-- OPT [OPT ...]]"
         parser.description = "configure the build directory to prepare for either the 'autobuild build' command or a manual build. (not all packages will require this step)"
         parser.add_argument('--config-file',
                             dest='config_file',
@@ -37,6 +56,12 @@ class AutobuildTool(autobuild_base.AutobuildBase):
         parser.add_argument('--all', '-a', dest='all', default=False, action="store_true",
                             help="build all configurations")
         parser.add_argument('--id', '-i', dest='build_id', type=int, help='unique build number')
+        parser.add_argument('--reconfigure',
+                            dest='reconfigure',
+                            default=False,
+                            action="store_true",
+                            help="configure even if nothing configure depends on has changed since "
+                            "the last time")
         parser.add_argument('additional_options', nargs="*", metavar='OPT',
                             help="an option to pass to the configuration command")
 
@@ -61,9 +86,9 @@ class AutobuildTool(autobuild_base.AutobuildBase):
                 environment = get_enriched_environment(build_configuration.name)
                 # then get a copy of the config specific to this build
                 # configuration
-                bconfig = config.copy()
+                bconfig = config.copy_on_write()
                 # and expand its $variables according to the environment.
-                bconfig.expand_platform_vars(environment)
+                bconfig.expand_platform_vars(environment, platform=platform)
                 # Re-fetch the build configuration so we have its expansions.
                 build_configuration = bconfig.get_build_configuration(
                     build_configuration.name, platform_name=platform)
@@ -76,7 +101,9 @@ class AutobuildTool(autobuild_base.AutobuildBase):
                     logger.info("configuring in %s" % build_directory)
                 result = _configure_a_configuration(bconfig, build_configuration,
                                                     args.additional_options, args.dry_run,
-                                                    environment=environment)
+                                                    environment=environment,
+                                                    build_directory=build_directory,
+                                                    reconfigure=args.reconfigure)
                 if result != 0:
                     raise ConfigurationError("default configuration returned %d" % result)
         finally:
@@ -84,7 +111,17 @@ class AutobuildTool(autobuild_base.AutobuildBase):
 
 
 def _configure_a_configuration(config: configfile.BuildConfigurationDescription, build_configuration, extra_arguments, dry_run=False,
-                               environment=None):
+                               environment=None, cwd=None, output_prefix=None,
+                               build_directory=None, installed_pathname=None, reconfigure=False):
+    """
+    Run the configure command for build_configuration, returning its exit
+    code. If build_directory is given, configure is skipped (returning 0)
+    when nothing it depends on has changed since it last succeeded there,
+    unless reconfigure is set -- but not when build_directory is just the
+    directory of the configuration file, which would leave fingerprint
+    files in the source tree. installed_pathname is the installed-packages
+    file the build uses (by default, the one in build_directory/packages).
+    """
     try:
         common_build_configuration = \
             config.get_build_configuration(build_configuration.name, platform_name=common.PLATFORM_COMMON)
@@ -109,7 +146,69 @@ def _configure_a_configuration(config: configfile.BuildConfigurationDescription,
         return 0
 
     logger.info('configure command:\n  %s', configure_executable.__str__(extra_arguments))
-    if not dry_run:
-        return configure_executable(extra_arguments, environment=environment)
-    else:
+    if dry_run:
         return 0
+    if build_directory is None or (config.path and os.path.normcase(os.path.abspath(build_directory))
+                                   == os.path.normcase(os.path.dirname(os.path.abspath(config.path)))):
+        return configure_executable(extra_arguments, environment=environment,
+                                    cwd=cwd, output_prefix=output_prefix)
+
+    if installed_pathname is None:
+        installed_pathname = os.path.join(build_directory, "packages", configfile.INSTALLED_CONFIG_FILE)
+    fingerprint = _configure_fingerprint(config, configure_executable._get_all_arguments(extra_arguments),
+                                         environment, installed_pathname)
+    fingerprint_file = os.path.join(build_directory, CONFIGURE_FINGERPRINT_FILE % build_configuration.name)
+    if not reconfigure:
+        try:
+            with open(fingerprint_file) as f:
+                previous = f.read().strip()
+        except OSError:
+            previous = None
+        if previous == fingerprint:
+            logger.info("configuration %s unchanged since it was last configured; "
+                        "skipping configure (use --reconfigure to force it)" % build_configuration.name)
+            return 0
+    # a failed or interrupted configure must not leave a stale fingerprint
+    try:
+        os.remove(fingerprint_file)
+    except FileNotFoundError:
+        pass
+    result = configure_executable(extra_arguments, environment=environment,
+                                  cwd=cwd, output_prefix=output_prefix)
+    if result == 0:
+        try:
+            with open(fingerprint_file, 'w') as f:
+                f.write(fingerprint + "\n")
+        except OSError as err:
+            logger.warning("unable to record configure fingerprint %s: %s" % (fingerprint_file, err))
+    return result
+
+
+def _file_digest(pathname):
+    try:
+        with open(pathname, 'rb') as f:
+            return hashlib.blake2b(f.read(), digest_size=32).hexdigest()
+    except OSError:
+        return None
+
+
+def _configure_fingerprint(config, command, environment, installed_pathname):
+    """
+    Return a digest of what the configure step depends on: the expanded
+    configure command line, the environment (less variables that change
+    from run to run anyway), the installed packages and the configuration
+    file itself.
+    """
+    if environment is None:
+        environment = os.environ
+    state = dict(
+        format=_FINGERPRINT_FORMAT,
+        autobuild=common.AUTOBUILD_VERSION_STRING,
+        command=command,
+        environment=sorted((key, value) for key, value in environment.items()
+                           if key not in _VOLATILE_ENVIRONMENT),
+        installed=_file_digest(installed_pathname),
+        config=_file_digest(config.path) if config.path else None,
+    )
+    return hashlib.blake2b(json.dumps(state, sort_keys=True).encode('utf-8'),
+                           digest_size=32).hexdigest()
@@ -7,12 +7,13 @@ the dependencies of the project.
 
 import logging
 import os
+import sys
 import tempfile
 import webbrowser
 from io import StringIO
 from typing import NamedTuple
 
-from autobuild import autobuild_base, common, configfile
+from autobuild import autobuild_base, common, configfile, package_index
 from autobuild.autobuild_tool_install import get_metadata_from_package
 
 logger = logging.getLogger('autobuild.graph')
@@ -33,6 +34,11 @@ You may either:
 
 The --rebuild-from <package-name> option prints an ordered list of packages that
 must be rebuilt if the specified package is updated.
+
+The --archives [<directory>] option instead graphs every package archive in the
+directory (by default, the install cache), recording the graph in an index file
+(see --index) that later runs reuse. With --dependents-of or --newest, it answers
+that query from the index rather than printing the whole graph.
 """
 
 class MermaidBracket(NamedTuple):
@@ -47,6 +53,121 @@ class MermaidBrackets:
     Box = MermaidBracket('[', ']')
 
 
+def _name(pkg):
+    return pkg['package_description']['name']
+
+
+def _version(pkg):
+    # can't use the dict .get to supply an empty string default for these,
+    # because the value in the dict is None.
+    return pkg['package_description']['version'] or ""
+
+
+def _build_id(pkg):
+    return pkg['build_id'] or ""
+
+
+def _is_dirty(pkg):
+    return pkg.get('dirty', False) in ('True', True)
+
+
+class DependencyIndex(object):
+    """
+    The packages in a metadata tree, each visited once however many packages
+    depend on it.
+
+    Attributes:
+        root          name of the package the metadata describes
+        packages      name: package metadata, in the order first found
+        dependencies  name: names of the packages it depends on
+        dependents    name: names of the packages that depend on it
+    """
+    def __init__(self, metadata):
+        self.root = _name(metadata)
+        self.packages = {}
+        self.dependencies = {}
+        self.dependents = {}
+        stack = [metadata]
+        while stack:
+            pkg = stack.pop()
+            name = _name(pkg)
+            if name in self.packages:
+                continue
+            self.packages[name] = pkg
+            self.dependents.setdefault(name, [])
+            depends = list((pkg.get('dependencies') or {}).values())
+            self.dependencies[name] = [_name(dep_pkg) for dep_pkg in depends]
+            for dep_name in self.dependencies[name]:
+                self.dependents.setdefault(dep_name, []).append(name)
+            # reversed, so that dependencies are found in the order listed
+            stack.extend(reversed(depends))
+
+    def rebuild_levels(self, name):
+        """
+        Return the packages to rebuild when package name is updated -- every
+        package that depends on it, directly or not -- as a list of levels,
+        each a sorted list of names. Each level depends only on the updated
+        package and earlier levels, so the packages within a level can be
+        rebuilt in parallel.
+        """
+        if name not in self.packages:
+            raise GraphError("%s is not a dependency of %s" % (name, self.root))
+        affected = set()
+        pending = [name]
+        while pending:
+            for dependent in self.dependents[pending.pop()]:
+                if dependent not in affected:
+                    affected.add(dependent)
+                    pending.append(dependent)
+        # Kahn's algorithm, over the affected packages: count the
+        # dependencies of each that still have to be rebuilt first
+        waiting = {dependent: sum(1 for dep_name in self.dependencies[dependent] if dep_name in affected)
+                   for dependent in affected}
+        levels = []
+        level = sorted(dependent for dependent, count in waiting.items() if not count)
+        while level:
+            levels.append(level)
+            next_level = []
+            for rebuilt in level:
+                for dependent in self.dependents[rebuilt]:
+                    if dependent in waiting:
+                        waiting[dependent] -= 1
+                        if not waiting[dependent]:
+                            next_level.append(dependent)
+            level = sorted(next_level)
+        if sum(len(level) for level in levels) < len(affected):
+            raise GraphError("dependency cycle among %s" %
+                             ", ".join(sorted(dependent for dependent, count in waiting.items() if count)))
+        return levels
+
+
+def mermaid_graph(index):
+    """
+    Return a mermaid flowchart of the packages in DependencyIndex index.
+    """
+    sb = StringIO()
+    sb.write('graph TB')
+    for name, pkg in index.packages.items():
+        id = hash(name)
+        if _is_dirty(pkg):
+            bracket = MermaidBrackets.Stadium
+        elif name == index.root:
+            bracket = MermaidBrackets.Hexagon
+        else:
+            bracket = MermaidBrackets.Box
+        sb.write(f'\n    {id}{bracket.start}"{name}<br />{_version(pkg)}<br />{_build_id(pkg)}"{bracket.end}')
+        archive = pkg.get('archive')
+        if archive:
+            # Link to the archive URL
+            sb.write(f'\n    click {id} "{archive["url"]}"')
+    for name in index.packages:
+        for dep_name in index.dependencies[name]:
+            # Draw dirty connections with dotted line
+            arrow = '-.->' if _is_dirty(index.packages[dep_name]) else '-->'
+            sb.write(f'\n    {hash(dep_name)}{arrow}{hash(name)}')
+    return sb.getvalue()
+
+
 # define the entry point to this autobuild tool
 class AutobuildTool(autobuild_base.AutobuildBase):
     def get_details(self):
@@ -90,7 +211,30 @@ class AutobuildTool(autobuild_base.AutobuildBase):
         parser.add_argument('--dot-file', '-D',
                             dest='dot_file', default=None,
                             help='save the dot input file in the specified file')
+        parser.add_argument('--rebuild-from',
+                            dest='rebuild_from', default=None, metavar='PACKAGE',
+                            help='instead of a graph, print the packages that must be rebuilt if PACKAGE is updated, '
+                                 'one line per level: packages on the same level can be rebuilt in parallel')
+        parser.add_argument('--archives',
+                            dest='archives', nargs='?', const=common.get_install_cache_dir, default=None,
+                            metavar='DIRECTORY',
+                            help='graph every package archive in DIRECTORY (default: the install cache), '
+                                 'updating its index file; prints mermaid with --type mermaid, dot otherwise')
+        parser.add_argument('--index',
+                            dest='index_file', default=None, metavar='FILE',
+                            help='the index file for --archives (default: %s in DIRECTORY); '
+                                 'on its own, query FILE without updating it' % package_index.INDEX_FILE)
+        parser.add_argument('--dependents-of',
+                            dest='dependents_of', default=None, metavar='PACKAGE',
+                            help='with --archives or --index, print the builds that depend directly on PACKAGE '
+                                 '(a name, or name/version/build_id for one build)')
+        parser.add_argument('--newest',
+                            dest='newest', default=None, metavar='PACKAGE',
+                            help='with --archives or --index, print the newest build of PACKAGE')
+
     def run(self, args):
+        if getattr(args, 'archives', None) or getattr(args, 'index_file', None):
+            return self.run_index(args)
         platform=common.get_current_platform()
         metadata = None
         incomplete = ''
@@ -137,47 +281,12 @@ class AutobuildTool(autobuild_base.AutobuildBase):
         if not metadata:
             raise GraphError("No metadata found")
 
-        if args.graph_type == 'mermaid':
-            sb = StringIO()
-            sb.write('graph TB')
-
-            connections = set()
-            def add_depends(sb: StringIO, pkg, root = False):
-                name = pkg['package_description']['name']
-                version = pkg['package_description']['version'] if pkg['package_description']['version'] else ""
-                build_id = pkg['build_id'] if pkg['build_id'] else ""
-                dirty = pkg.get('dirty', False) in ('True', True)
-                id = hash(name)
-
-                if dirty:
-                    bracket = MermaidBrackets.Stadium
-                elif root:
-                    bracket = MermaidBrackets.Hexagon
-                else:
-                    bracket = MermaidBrackets.Box
-
-                sb.write(f'\n    {id}{bracket.start}"{name}<br />{version}<br />{build_id}"{bracket.end}')
-
-                archive = pkg.get('archive')
-                if archive:
-                    # Link to the archive URL
-                    url = pkg['archive']['url']
-                    sb.write(f'\n    click {id} "{url}"')
-
-                for dep_pkg in pkg.get('dependencies', {}).values():
-                    dep_name = dep_pkg['package_description']['name']
-                    dep_id = hash(dep_name)
-                    dep_dirty = dep_pkg.get('dirty', False) in ('True', True)
-                    # Draw dirty connections with dotted line
-                    arrow = '-.->' if dep_dirty else '-->'
-                    connection = f"{dep_id}-{pkg['build_id']}"
-                    if connection not in connections:
-                        add_depends(sb, dep_pkg)
-                        sb.write(f'\n    {dep_id}{arrow}{id}')
-                        connections.add(connection)
-
-            add_depends(sb, metadata, root=True)
-            print(sb.getvalue())
+        index = DependencyIndex(metadata)
+        if args.rebuild_from:
+            for number, level in enumerate(index.rebuild_levels(args.rebuild_from), 1):
+                print("%d: %s" % (number, " ".join(level)))
+        elif args.graph_type == 'mermaid':
+            print(mermaid_graph(index))
         else:
             import pydot
             graph = pydot.Dot(label=metadata['package_description']['name']+incomplete+' dependencies for '+platform, graph_type='digraph')
@@ -190,40 +299,25 @@ class AutobuildTool(autobuild_base.AutobuildBase):
 
             graph.set_node_defaults(shape='box')
 
-            def add_depends(graph, pkg):
-                name = pkg['package_description']['name']
-                got = graph.get_node(name) # can return a single Node instance, a list of Nodes, or None
-                try:
-                    pkg_node = got if got is None or isinstance(got, pydot.Node) else got[0]
-                except IndexError: # some versions of pydot may return an empty list instead of None
-                    pkg_node = None
-                if pkg_node is None:
-                    logger.debug(" graph adding package %s" % name)
-                    # can't use the dict .get to supply an empty string default for these,
-                    # because the value in the dict is None.
-                    pkg_version = pkg['package_description']['version'] if pkg['package_description']['version'] else "";
-                    pkg_build_id = pkg['build_id'] if pkg['build_id'] else "";
-                    # create the new node with name, version, and build id
-                    pkg_node = pydot.Node(name, label="%s\\n%s\\n%s" % (name, pkg_version, pkg_build_id))
-                    if 'dirty' in pkg and (pkg['dirty'] == 'True' or pkg['dirty'] is True):
-                        logger.debug(" setting %s dirty: %s" % (name, ("missing" if 'dirty' not in pkg else "explicit")))
-                        pkg_node.set_shape('ellipse')
-                        pkg_node.set_style('dashed')
-                    graph.add_node(pkg_node)
-                    if 'dependencies' in pkg:
-                        for dep_pkg in pkg['dependencies'].values():
-                            dep_name = dep_pkg['package_description']['name']
-                            dep_node = add_depends(graph, dep_pkg)
-                            logger.debug(" graph adding dependency %s -> %s" % (dep_name, name))
-                            edge = pydot.Edge(dep_name, name)
-                            if 'dirty' in dep_pkg and (dep_pkg['dirty'] == 'True' or dep_pkg['dirty'] is True):
-                                edge.set_style('dashed')
-                            graph.add_edge(edge)
-                return pkg_node
-
-            root = add_depends(graph, metadata)
-            root.set_root('true')
-            root.set_shape('octagon')
+            for name, pkg in index.packages.items():
+                logger.debug(" graph adding package %s" % name)
+                # create the new node with name, version, and build id
+                pkg_node = pydot.Node(name, label="%s\\n%s\\n%s" % (name, _version(pkg), _build_id(pkg)))
+                if _is_dirty(pkg):
+                    logger.debug(" setting %s dirty" % name)
+                    pkg_node.set_shape('ellipse')
+                    pkg_node.set_style('dashed')
+                if name == index.root:
+                    pkg_node.set_root('true')
+                    pkg_node.set_shape('octagon')
+                graph.add_node(pkg_node)
+            for name in index.packages:
+                for dep_name in index.dependencies[name]:
+                    logger.debug(" graph adding dependency %s -> %s" % (dep_name, name))
+                    edge = pydot.Edge(dep_name, name)
+                    if _is_dirty(index.packages[dep_name]):
+                        edge.set_style('dashed')
+                    graph.add_edge(edge)
 
             if args.dot_file:
                 graph.write_raw(args.dot_file)
@@ -246,3 +340,29 @@ class AutobuildTool(autobuild_base.AutobuildBase):
                     webbrowser.open('file:'+graph_file)
             else:
                 print("%s" % graph.to_string())
+
+    def run_index(self, args):
+        archives = args.archives() if callable(args.archives) else args.archives
+        if archives:
+            index_file = args.index_file or os.path.join(archives, package_index.INDEX_FILE)
+            if os.path.exists(index_file):
+                index = package_index.PackageIndex.load(index_file)
+                if os.path.realpath(index.directory) != os.path.realpath(archives):
+                    logger.warning("%s indexed %s: reindexing %s" % (index_file, index.directory, archives))
+                    index = package_index.PackageIndex(archives)
+            else:
+                index = package_index.PackageIndex(archives)
+            if index.update():
+                index.save(index_file)
+        else:
+            index = package_index.PackageIndex.load(args.index_file)
+
+        if args.dependents_of:
+            for dependent in index.dependents_of(args.dependents_of):
+                print(dependent)
+        elif args.newest:
+            print(index.newest(args.newest))
+        elif args.graph_type == 'mermaid':
+            index.write_mermaid(sys.stdout)
+        else:
+            index.write_dot(sys.stdout)
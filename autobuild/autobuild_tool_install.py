@@ -9,18 +9,19 @@ to specify all the files that have been installed.
 from __future__ import annotations
 
 import errno
-import http.client
 import logging
 import os
-import pprint
 import sys
-import urllib.error
-import urllib.parse
-import urllib.request
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
 
-from autobuild import archive_utils, autobuild_base, common, configfile
+from autobuild import archive_utils, autobuild_base, common, configfile, tracing
 from autobuild.autobuild_tool_source_environment import get_enriched_environment
-from autobuild.hash_algorithms import verify_hash
+from autobuild.hash_algorithms import verify_hash, verify_many
+
+if TYPE_CHECKING:
+    import http.client
 
 logger = logging.getLogger('autobuild.install')
 
@@ -144,7 +145,7 @@ def handle_query_args(options, config_file, installed_file):
 
     if options.export_manifest:
         for package in installed_file.dependencies.values():
-            item = pprint.pformat(package).rstrip()  # trim final newline
+            item = common.pformat(package).rstrip()  # trim final newline
             sys.stdout.writelines((item, ",\n"))  # permit parsing -- bad syntax otherwise
         return True
 
@@ -193,6 +194,9 @@ def package_cache_path(package):
 
 
 def download_package(package_url: str, timeout=120, creds=None, package_name="") -> http.client.HTTPResponse:
+    # urllib.request (with http.client, email, ssl...) is only needed to
+    # download: leave it out of the other commands' startup
+    import urllib.request
     req = urllib.request.Request(package_url)
 
     if creds:
@@ -217,10 +221,13 @@ def download_package(package_url: str, timeout=120, creds=None, package_name="")
     return urllib.request.urlopen(req, data=None, timeout=timeout)
 
 
-def get_package_file(package_name, package_url, hash_algorithm='md5', expected_hash=None, creds=None):
+@tracing.traced()
+def get_package_file(package_name, package_url, hash_algorithm='md5', expected_hash=None, creds=None, verified=False):
     """
     Get the package file in the cache, downloading if needed.
     Validate the cache file using the hash (removing it if needed)
+    Pass verified=True if the cached file has already been checked against
+    expected_hash (see verify_cached_packages()) to skip hashing it again.
     Returns None if there was a problem downloading the file.
     """
     cache_file = None
@@ -233,7 +240,7 @@ def get_package_file(package_name, package_url, hash_algorithm='md5', expected_h
                 logger.warning("empty cache file removed")
                 os.remove(cache_file)
                 cache_file = None
-            elif hash_algorithm is not None \
+            elif hash_algorithm is not None and not verified \
               and not verify_hash(hash_algorithm, cache_file, expected_hash):
                 logger.error("corrupt cached file removed: %s mismatch" % (hash_algorithm or "md5"))
                 os.remove(cache_file)
@@ -241,6 +248,8 @@ def get_package_file(package_name, package_url, hash_algorithm='md5', expected_h
             else:
                 logger.info("package in cache: %s" % cache_file)
         else:
+            from urllib.error import URLError
+
             # download timeout so a download doesn't hang
             download_timeout_seconds = 120
 
@@ -248,7 +257,7 @@ def get_package_file(package_name, package_url, hash_algorithm='md5', expected_h
             logger.info("downloading %s:\n  %s\n     to %s" % (package_name, package_url, cache_file))
             try:
                 package_response = download_package(package_url, timeout=download_timeout_seconds, creds=creds, package_name=package_name)
-            except urllib.error.URLError as err:
+            except URLError as err:
                 logger.error("error: %s\n  downloading package %s" % (err, package_url))
                 package_response = None
                 cache_file = None
@@ -286,13 +295,15 @@ def get_package_file(package_name, package_url, hash_algorithm='md5', expected_h
 
         # error out if MD5 doesn't match
         if cache_file is not None \
-          and hash_algorithm is not None:
+          and hash_algorithm is not None and not verified:
             logger.info("verifying %s" % package_name)
             if not verify_hash(hash_algorithm, cache_file, expected_hash):
                 logger.error("download error: %s mismatch for %s" % ((hash_algorithm or "md5"), cache_file))
                 os.remove(cache_file)
                 cache_file = None
         if cache_file is None:
+            # whatever we verified before is gone now
+            verified = False
             download_retries -= 1
             if download_retries > 0:
                 logger.warning("Retrying download")
@@ -300,6 +311,32 @@ def get_package_file(package_name, package_url, hash_algorithm='md5', expected_h
     return cache_file
 
 
+def verify_cached_packages(packages, config_file, platform):
+    """
+    Check the cached archives of all the specified packages in a single
+    batch, hashing them in parallel. Packages not yet in the cache, or without
+    a configured hash, are skipped.
+    Returns the set of (hash_algorithm, cache_file, hash) triples that
+    verified successfully.
+    """
+    requests = []
+    for pname in packages:
+        package = config_file.installables.get(pname)
+        req_plat = package.get_platform(platform) if package else None
+        archive = req_plat.archive if req_plat else None
+        if not (archive and archive.url and archive.hash):
+            continue
+        cache_file = package_cache_path(archive.url)
+        if os.path.isfile(cache_file) and os.path.getsize(cache_file):
+            requests.append((archive.hash_algorithm or 'md5', cache_file, archive.hash.lower()))
+    if not requests:
+        return set()
+    logger.info("verifying %d cached packages" % len(requests))
+    # installables whose URLs share a basename share a cache file: each
+    # request stands or falls on its own hash
+    return set(request for request, result in zip(requests, verify_many(requests)) if result)
+
+
 def do_install(packages, config_file, installed, platform, install_dir, dry_run, local_archives=[], cache_only=False):
     """
     Install the specified list of packages. By default this will download the
@@ -308,6 +345,10 @@ def do_install(packages, config_file, installed, platform, install_dir, dry_run,
     For packages listed in the local_archives, the local archive will be
     installed in place of the configured one.
     """
+    # Validate everything already in the cache up front, in parallel
+    verified = verify_cached_packages([pname for pname in packages if pname not in local_archives],
+                                      config_file, platform)
+
     # Decide whether to install a local package or download a tarball
     installed_pkgs = []
     for pname in packages:
@@ -326,7 +367,8 @@ def do_install(packages, config_file, installed, platform, install_dir, dry_run,
                 if _install_local(pname, platform, package, local_archives[pname], install_dir, installed, dry_run):
                     installed_pkgs.append(pname)
         else:
-            if _install_binary(pname, platform, package, config_file, install_dir, installed, dry_run, cache_only=cache_only):
+            if _install_binary(pname, platform, package, config_file, install_dir, installed, dry_run,
+                               cache_only=cache_only, verified=verified):
                 installed_pkgs.append(pname)
     return installed_pkgs
 
@@ -350,12 +392,12 @@ def _install_local(configured_name, platform, package, package_path, install_dir
         logger.warning("Using --local install flags any resulting package as 'dirty'")
         _update_installed_package_files(metadata, installed_package,
                                         platform=platform, installed=installed,
-                                        install_dir=install_dir, files=files)
+                                        install_dir=install_dir, files=files, dry_run=dry_run)
         return True
     else:
         return False
 
-def _install_binary(configured_name, platform, package, config_file, install_dir, installed, dry_run, cache_only=False):
+def _install_binary(configured_name, platform, package, config_file, install_dir, installed, dry_run, cache_only=False, verified=()):
     # Check that we have a platform-specific or common url to use.
     req_plat = package.get_platform(platform)
     package_name = getattr(package, 'name', '(undefined)')
@@ -384,14 +426,19 @@ def _install_binary(configured_name, platform, package, config_file, install_dir
 
     # get the package file in the cache, downloading if needed, and verify the hash
     # (raises InstallError on failure, so no check is needed)
-    cachefile = get_package_file(package_name, archive.url, hash_algorithm=(archive.hash_algorithm or 'md5'), expected_hash=archive.hash, creds=(archive.creds or None))
+    hash_algorithm = archive.hash_algorithm or 'md5'
+    is_verified = bool(archive.hash) and \
+        (hash_algorithm, package_cache_path(archive.url), archive.hash.lower()) in verified
+    cachefile = get_package_file(package_name, archive.url, hash_algorithm=hash_algorithm, expected_hash=archive.hash,
+                                 creds=(archive.creds or None), verified=is_verified)
     if cachefile is None:
         raise InstallError("Failed to download package '%s' from '%s'" % (package_name, archive.url))
 
     if cache_only:
         return True
 
-    metadata, files = _install_common(configured_name, platform, package, cachefile, install_dir, installed, dry_run)
+    metadata, files = _install_common(configured_name, platform, package, cachefile, install_dir, installed, dry_run,
+                                      verified=verified)
     if metadata:
         installed_package = package.copy()
         if platform not in package.platforms:
@@ -403,17 +450,27 @@ def _install_binary(configured_name, platform, package, config_file, install_dir
         metadata.install_type = 'package'
         _update_installed_package_files(metadata, package,
                                         platform=platform, installed=installed,
-                                        install_dir=install_dir, files=files)
+                                        install_dir=install_dir, files=files, dry_run=dry_run)
         return True
     else:
         return False
 
 
 def get_metadata_from_package(package_file) -> configfile.MetadataDescription:
+    """
+    Return the MetadataDescription in the archive package_file, or None if it
+    has none (or does not exist).
+    """
     try:
         with archive_utils.open_archive(package_file) as archive:
-            f = archive.extractfile(configfile.PACKAGE_METADATA_FILE)
-            return configfile.MetadataDescription(stream=f)
+            if isinstance(archive, zipfile.ZipFile):
+                return configfile.MetadataDescription(stream=archive.open(configfile.PACKAGE_METADATA_FILE))
+            # looking the metadata up by name would read the whole archive
+            # first: stop reading as soon as it turns up
+            for member in archive:
+                if os.path.normpath(member.name) == configfile.PACKAGE_METADATA_FILE:
+                    return configfile.MetadataDescription(stream=archive.extractfile(member))
+            return None
     except (FileNotFoundError, KeyError):
         return None
 
@@ -461,32 +518,40 @@ class ExtractPackageResults:
             raise common.AutobuildError("conflicting files\n  " + "\n  ".join(self.conflicts))
 
 
+@tracing.traced()
 def extract_package(package_file: str, install_dir: str, dry_run: bool = False) -> ExtractPackageResults:
     with archive_utils.open_archive(package_file) as archive:
         results = ExtractPackageResults()
-        for t in archive:
-            if t.name == configfile.PACKAGE_METADATA_FILE:
-                f = archive.extractfile(t)
+        # a ZipFile is not iterable, and names its directories with a trailing '/'
+        is_zip = isinstance(archive, zipfile.ZipFile)
+        for t in (archive.infolist() if is_zip else archive):
+            name = t.filename.rstrip('/') if is_zip else t.name
+            if name == configfile.PACKAGE_METADATA_FILE:
+                f = archive.open(t) if is_zip else archive.extractfile(t)
                 results.metadata = configfile.MetadataDescription(stream=f)
             else:
-                t_path = os.path.join(install_dir, t.name)
-                if os.path.exists(t_path) and not os.path.isdir(t_path) and t.name not in results.files:
+                t_path = os.path.join(install_dir, name)
+                if os.path.exists(t_path) and not os.path.isdir(t_path) and name not in results.files:
                     results.conflicts.append(t_path)
                     continue
 
                 if not dry_run:
-                    archive.extract(t.name, install_dir)
+                    archive.extract(t if is_zip else t.name, install_dir)
 
-                results.files.append(t.name)
+                results.files.append(name)
         return results
 
 
-def _install_common(configured_name: str, platform: str, package: configfile.PackageDescription, package_file: str, install_dir: str,  installed: configfile.Dependencies, dry_run: bool):
+def _install_common(configured_name: str, platform: str, package: configfile.PackageDescription, package_file: str, install_dir: str,  installed: configfile.Dependencies, dry_run: bool,
+                    verified=()):
 
     # Compare installed package hash to new hash, uninstall the existing one if they do not match
     installed_pkg = installed.dependencies.get(package.name, None)
     if installed_pkg:
-        if verify_hash(installed_pkg['archive'].get('hash_algorithm', 'md5'), package_file, installed_pkg['archive']['hash']):
+        installed_algorithm = installed_pkg['archive'].get('hash_algorithm') or 'md5'
+        installed_hash = installed_pkg['archive']['hash']
+        if (installed_hash and (installed_algorithm, package_file, installed_hash.lower()) in verified) \
+          or verify_hash(installed_pkg['archive'].get('hash_algorithm', 'md5'), package_file, installed_hash):
             logger.info("%s is already installed" % package.name)
             return None, None
         else:
@@ -564,36 +629,106 @@ Conflict: %s
 
     return metadata, extract_results.files
 
-TransitiveSearched = set()
+class InstalledIndex(object):
+    """
+    A flattened view of an installed tree for conflict checks. For each
+    package name, it lists every place that name appears in the tree, with
+    the chain of packages that import it. The places are in the order a
+    depth-first search of the tree would meet them.
+
+    As in that search, a package isn't looked for beneath another package of
+    the same name. Building the index walks the tree once; each lookup then
+    costs only the number of places its name appears.
+    """
+    def __init__(self, installed):
+        self.fingerprint = InstalledIndex.fingerprint_of(installed)
+        # name -> [(installed package, (outermost importer, ..., innermost))]
+        self.places = {}
+        self.__add(installed, (), frozenset())
+
+    @staticmethod
+    def fingerprint_of(installed):
+        # the index holds references to these packages, so their ids can't be
+        # reused while it is cached
+        return tuple((name, id(package))
+                     for name, package in installed.get('dependencies', {}).items())
+
+    @classmethod
+    def of(cls, installed):
+        """
+        Return the index for installed, reusing the one cached on a
+        Dependencies object until its set of installed packages changes.
+        """
+        index = getattr(installed, 'conflict_index', None)
+        if index is not None and index.fingerprint == cls.fingerprint_of(installed):
+            return index
+        index = cls(installed)
+        if isinstance(installed, configfile.Dependencies):
+            installed.conflict_index = index
+        return index
+
+    def __add(self, node, importers, importer_names):
+        if 'dependencies' not in node:
+            return
+        for name, package in node['dependencies'].items():
+            if name not in importer_names:
+                self.places.setdefault(name, []).append((package, importers))
+            self.__add(package, importers + (package,), importer_names | {name})
+
+    def conflict(self, new_package):
+        """
+        Return an error message describing the first installed package that
+        new_package conflicts with, or the empty string.
+        """
+        name = new_package['package_description']['name']
+        for package, importers in self.places.get(name, ()):
+            used_conflict = _installed_package_conflict(new_package, package)
+            if used_conflict:
+                # in order to be able to add the import path, we only report the first conflict
+                return name + "\n" + used_conflict + "".join(
+                    "used by %s version %s build %s\n" %
+                    (importer['package_description']['name'],
+                     importer['package_description']['version'],
+                     importer['build_id'])
+                    for importer in reversed(importers))
+        return ""
+
 
 def transitive_search(new_package, installed):
-    TransitiveSearched.clear()
-    return transitive_dependency_conflicts(new_package, installed)
+    return transitive_dependency_conflicts(new_package, installed, searched=set())
 
-def transitive_dependency_conflicts(new_package, installed):
+def transitive_dependency_conflicts(new_package, installed, searched=None, index=None):
     """
     Searches for new_package and each of its dependencies in the installed tree
     (checks the root of the tree and walks its dependency tree)
+
+    searched is the set of package names already checked; index is the
+    InstalledIndex for installed.
     """
+    if searched is None:
+        searched = set()
+    if index is None:
+        index = InstalledIndex.of(installed)
     conflicts = ""
     logger.debug("  checking conflicts for %s in installed" % new_package['package_description']['name'])
-    conflict = package_in_installed(new_package, installed)
+    conflict = index.conflict(new_package)
     if conflict:
         logger.debug("  found conflict in installed packages")
         conflicts += "with installed package "
         conflicts += conflict
     # Check for conflicts with the dependencies of the new package
-    TransitiveSearched.add(new_package['package_description']['name'])
+    searched.add(new_package['package_description']['name'])
     if 'dependencies' in new_package:
         logger.debug("  checking conflicts for dependencies of %s in installed" % new_package['package_description']['name'])
         for new_dependency in new_package['dependencies'].keys():
             depend_conflicts=""
-            if new_dependency not in TransitiveSearched:
-                depend_conflicts = transitive_dependency_conflicts(new_package['dependencies'][new_dependency], installed)
+            if new_dependency not in searched:
+                depend_conflicts = transitive_dependency_conflicts(new_package['dependencies'][new_dependency],
+                                                                   installed, searched, index)
                 if depend_conflicts:
                     conflicts += "dependency %s " % new_dependency
                     conflicts += depend_conflicts
-                TransitiveSearched.add(new_dependency)
+                searched.add(new_dependency)
     return conflicts
 
 def package_in_installed(new_package, installed):
@@ -601,60 +736,50 @@ def package_in_installed(new_package, installed):
     Searches for new_package in the installed tree, returns error message (or empty string)
     (checks the root of the tree and walks the installed tree)
     """
-    conflict = ""
-    if 'dependencies' in installed:
-        previous = installed['dependencies']
-        for used in previous.keys():
-            # logger.debug("=====\npackage\n%s\nvs\n%s" % (pprint.pformat(new_package), pprint.pformat(previous[used])))
-            used_conflict=""
-            if new_package['package_description']['name'] == used:
-                if 'archive' in new_package and new_package['archive']:
-                    # this is a dependency of the new package, so we have archive data
-                    if new_package['archive']['url'].rsplit('/',1)[-1] \
-                      != previous[used]['archive']['url'].rsplit('/',1)[-1]:
-                        used_conflict += "  installed url  %s\n" % previous[used]['archive']['url']
-                        used_conflict += "             vs  %s\n" % new_package['archive']['url']
-                    if new_package['archive']['hash'] != previous[used]['archive']['hash']:
-                        used_conflict += "  installed hash %s\n" % previous[used]['archive']['hash']
-                        used_conflict += "             vs  %s\n" % new_package['archive']['hash']
-                else:
-                    # this is the newly imported package, so we don't have a url for it
-                    pass
-                if new_package['configuration'] != previous[used]['configuration']:
-                    used_conflict += "  installed configuration %s\n" % previous[used]['configuration']
-                    used_conflict += "                      vs  %s\n" % new_package['configuration']
-                if new_package['package_description']['version'] != previous[used]['package_description']['version']:
-                    used_conflict += "  installed version %s\n" % previous[used]['package_description']['version']
-                    used_conflict += "                vs  %s\n" % new_package['package_description']['version']
-                if new_package['build_id'] != previous[used]['build_id']:
-                    used_conflict += "  installed build_id %s\n" % previous[used]['build_id']
-                    used_conflict += "                 vs  %s\n" % new_package['build_id']
-                if used_conflict:
-                    conflict += used + "\n" + used_conflict
-            else:
-                # recurse to check the dependencies of previous[used]
-                conflict += package_in_installed(new_package, previous[used])
-                if conflict:
-                    conflict += "used by %s version %s build %s\n" % \
-                      ( previous[used]['package_description']['name'],
-                        previous[used]['package_description']['version'],
-                        previous[used]['build_id'])
+    return InstalledIndex.of(installed).conflict(new_package)
 
-            if conflict:
-                # in order to be able to add the import path, we only detect the first conflict
-                return conflict
-    return ""
+def _installed_package_conflict(new_package, installed_package):
+    """
+    Compare new_package with an installed_package of the same name, returning
+    a description of their differences (or empty string)
+    """
+    used_conflict=""
+    if 'archive' in new_package and new_package['archive']:
+        # this is a dependency of the new package, so we have archive data
+        if new_package['archive']['url'].rsplit('/',1)[-1] \
+          != installed_package['archive']['url'].rsplit('/',1)[-1]:
+            used_conflict += "  installed url  %s\n" % installed_package['archive']['url']
+            used_conflict += "             vs  %s\n" % new_package['archive']['url']
+        if new_package['archive']['hash'] != installed_package['archive']['hash']:
+            used_conflict += "  installed hash %s\n" % installed_package['archive']['hash']
+            used_conflict += "             vs  %s\n" % new_package['archive']['hash']
+    else:
+        # this is the newly imported package, so we don't have a url for it
+        pass
+    if new_package['configuration'] != installed_package['configuration']:
+        used_conflict += "  installed configuration %s\n" % installed_package['configuration']
+        used_conflict += "                      vs  %s\n" % new_package['configuration']
+    if new_package['package_description']['version'] != installed_package['package_description']['version']:
+        used_conflict += "  installed version %s\n" % installed_package['package_description']['version']
+        used_conflict += "                vs  %s\n" % new_package['package_description']['version']
+    if new_package['build_id'] != installed_package['build_id']:
+        used_conflict += "  installed build_id %s\n" % installed_package['build_id']
+        used_conflict += "                 vs  %s\n" % new_package['build_id']
+    return used_conflict
 
 
 def _update_installed_package_files(metadata, package,
-                                    platform=None, installed=None, install_dir=None, files=None):
+                                    platform=None, installed=None, install_dir=None, files=None, dry_run=False):
     installed_package = metadata
     installed_package.install_dir = common.build_dir_relative_path(install_dir)
 
     installed_platform = package.get_platform(platform)
     installed_package.archive = installed_platform.archive
-    installed_package.manifest = files
-    installed.dependencies[metadata.package_description.name] = installed_package
+    installed_package.manifest = configfile.CompactManifest(files)
+    if dry_run:
+        installed.dependencies[metadata.package_description.name] = installed_package
+    else:
+        installed.journal_install(metadata.package_description.name, installed_package)
 
 
 def uninstall(package_name, installed_config):
@@ -662,64 +787,156 @@ def uninstall(package_name, installed_config):
     Uninstall specified package_name: remove related files and delete
     package_name from the installed_config ConfigurationDescription.
 
-    Saving the modified installed_config is the caller's responsibility.
+    The removal is journaled; saving (compacting) the modified
+    installed_config is the caller's responsibility.
     """
-    try:
-        # Retrieve this package's installed PackageDescription, and
-        # remove it from installed_config at the same time.
-        package = configfile.MetadataDescription(parsed_llsd=installed_config.dependencies.pop(package_name))
-    except KeyError:
-        # If the package has never yet been installed, we're good.
-        logger.debug("%s not installed, no uninstall needed" % package_name)
+    uninstall_all([package_name], installed_config)
+
+
+def uninstall_all(package_names, installed_config):
+    """
+    Uninstall each of package_names as uninstall() does, but remove the files
+    of all of them in a single pass.
+
+    A package is journaled as uninstalled only if all its files could be
+    removed; if any could not, raise AutobuildError after trying them all.
+    """
+    removals = []
+    for package_name in package_names:
+        try:
+            # Retrieve this package's installed PackageDescription, and
+            # remove it from installed_config at the same time.
+            package = configfile.MetadataDescription(parsed_llsd=installed_config.dependencies.pop(package_name))
+        except KeyError:
+            # If the package has never yet been installed, we're good.
+            logger.debug("%s not installed, no uninstall needed" % package_name)
+            continue
+
+        logger.info("uninstalling %s version %s" % (package_name, package.package_description.version))
+        removals.append((package_name,
+                         os.path.join(common.get_current_build_dir(), package.install_dir),
+                         package.manifest))
+
+    if not removals:
         return
+    errors = remove_files([(install_dir, files) for package_name, install_dir, files in removals])
+    for (package_name, install_dir, files), package_errors in zip(removals, errors):
+        if not package_errors:
+            installed_config.journal_uninstall(package_name)
+    messages = [message for package_errors in errors for message in package_errors]
+    if messages:
+        raise common.AutobuildError("\n".join(messages))
 
-    logger.info("uninstalling %s version %s" % (package_name, package.package_description.version))
-    clean_files(os.path.join(common.get_current_build_dir(),package.install_dir), package.manifest)
-    installed_config.save()
 
 def clean_files(install_dir, files):
-    # Tarballs that name directories name them before the files they contain,
-    # so the unpacker will create the directory before creating files in it.
-    # For exactly that reason, we must remove things in reverse order.
-    logger.debug("uninstalling from '%s'" % install_dir)
-    directories=set() # directories we've removed files from
-    for filename in files:
-        install_path = os.path.join(install_dir, filename)
-        if not os.path.isdir(install_path): # deal with directories below, after all files
-            try:
-                os.remove(install_path)
-                # We used to print "removing f" before the call above, the
-                # assumption being that we'd either succeed or produce a
-                # traceback. But there are a couple different ways we could get
-                # through this logic without actually deleting. So produce a
-                # message only when we're sure we've actually deleted something.
-                logger.info("    removed " + filename)
-            except OSError as err:
-                if err.errno == errno.ENOENT:
-                    # this file has already been deleted for some reason -- fine
-                    logger.warning("    expected file not found: " + install_path)
-                    pass
-                else:
-                    raise common.AutobuildError(str(err))
-        directories.add(os.path.dirname(filename))
-
-    # Check to see if any of the directories from which we removed files are now
-    # empty; if so, delete them (they will not have been listed in the manifest).
-    # Do the checks in descending length order so that subdirectories will appear
-    # before their containing directory. The loop is nested in order to clean up
-    # directories that previously contained only subdirectories, so they were not
-    # added to the list when deleting files above.
-    while directories:
-        parents=set()
-        for dirname in sorted(directories, key=len, reverse=True):
-            dir_path = os.path.join(install_dir, dirname)
-            if os.path.exists(dir_path) and not os.listdir(dir_path):
-                os.rmdir(dir_path)
-                logger.info("    removed " + dirname)
-                parent=os.path.dirname(dirname)
-                if dir_path:
-                    parents.add(parent)
-        directories=parents
+    """
+    Remove files (paths relative to install_dir, as recorded in a package
+    manifest), then any directories they leave empty.
+    """
+    errors = remove_files([(install_dir, files)])[0]
+    if errors:
+        raise common.AutobuildError("\n".join(errors))
+
+
+# Below this many files, a thread pool costs more than it saves.
+PARALLEL_REMOVE_THRESHOLD = 64
+
+
+def remove_files(groups, max_workers=None):
+    """
+    groups is a list of (install_dir, files) pairs, as for clean_files().
+
+    Remove all the files at once across a thread pool, then try once to
+    remove each directory that held any of them, deepest first: a directory
+    that still holds anything else simply stays. Log a summary rather than
+    each file.
+
+    Return a list, parallel to groups, of the error messages for each group.
+    """
+    paths = []              # (group index, path of a file to remove)
+    directories = set()     # directories to remove if left empty
+    for index, (install_dir, files) in enumerate(groups):
+        logger.debug("uninstalling from '%s'" % install_dir)
+        for filename in files:
+            # Tarballs that name directories name them before the files they
+            # contain, with a trailing slash; remove directories only after
+            # all files.
+            if filename.endswith('/'):
+                _add_directories(directories, install_dir, filename.rstrip('/'))
+            else:
+                paths.append((index, os.path.join(install_dir, filename)))
+                _add_directories(directories, install_dir, os.path.dirname(filename))
+
+    if len(paths) < PARALLEL_REMOVE_THRESHOLD:
+        results = list(map(_remove_file, paths))
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_remove_file, paths))
+
+    errors = [[] for group in groups]
+    removed_files = 0
+    missing = 0
+    for (index, path), error in zip(paths, results):
+        if error is None:
+            removed_files += 1
+        elif error is _MISSING:
+            # this file has already been deleted for some reason -- fine
+            logger.debug("    expected file not found: " + path)
+            missing += 1
+        elif error is _DIRECTORY:
+            directories.add(os.path.normpath(path))
+        else:
+            errors[index].append(str(error))
+
+    removed_directories = 0
+    for directory in sorted(directories, key=lambda d: d.count(os.sep), reverse=True):
+        try:
+            os.rmdir(directory)
+            removed_directories += 1
+        except OSError:
+            # not empty, or already gone
+            pass
+
+    logger.info("    removed %d files and %d directories" % (removed_files, removed_directories))
+    if missing:
+        logger.warning("    %d expected files not found" % missing)
+    return errors
+
+
+# _remove_file() results other than None or an exception
+_MISSING = object()
+_DIRECTORY = object()
+
+
+def _remove_file(item):
+    index, path = item
+    try:
+        os.remove(path)
+    except OSError as err:
+        if err.errno == errno.ENOENT:
+            return _MISSING
+        if os.path.isdir(path):
+            # a directory named without a trailing slash
+            return _DIRECTORY
+        return err
+    return None
+
+
+def _add_directories(directories, install_dir, dirname):
+    """
+    Add the directory dirname (relative to install_dir) and each of its
+    parents, up to and including install_dir itself, to the set directories.
+    """
+    while True:
+        path = os.path.normpath(os.path.join(install_dir, dirname))
+        if path in directories:
+            # and so are all its parents
+            return
+        directories.add(path)
+        if not dirname:
+            return
+        dirname = os.path.dirname(dirname)
+
 
 def install_packages(args, config_file, install_dir, platform, packages):
     if not args.check_license:
@@ -914,12 +1131,12 @@ class AutobuildTool(autobuild_base.AutobuildBase):
         for build_configuration in build_configurations:
             # then get a copy of the config specific to this build
             # configuration
-            bconfig = config.copy()
+            bconfig = config.copy_on_write()
             # Get enriched environment based on the current configuration
             if not args.skip_source_environment:
                 environment = get_enriched_environment(build_configuration.name)
                 # and expand its $variables according to the environment.
-                bconfig.expand_platform_vars(environment)
+                bconfig.expand_platform_vars(environment, platform=platform)
             # Re-fetch the build configuration so we have its expansions.
             build_configuration = bconfig.get_build_configuration(build_configuration.name, platform_name=platform)
             build_directory = bconfig.get_build_directory(build_configuration, platform_name=platform)
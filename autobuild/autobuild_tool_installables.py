@@ -6,11 +6,13 @@ that may installed by autobuild.
 """
 
 import logging
+import os
 import pprint
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
-from autobuild import autobuild_base, common, configfile
+from autobuild import autobuild_base, common, configfile, hash_algorithms
 from autobuild.autobuild_tool_install import get_metadata_from_package, get_package_file
 
 logger = logging.getLogger('autobuild.installables')
@@ -39,11 +41,17 @@ class AutobuildTool(autobuild_base.AutobuildBase):
                             dest='archive',
                             default=None,
                             help="infer installable attributes from the given archive")
+        parser.add_argument('--from-file',
+                            dest='from_file',
+                            default=None,
+                            help="bulk: also read archive paths or urls from this file, one per line ('-' for stdin)")
         parser.add_argument('command', nargs='?', default='print',
-                            help="installable command: add, remove, edit, or print")
+                            help="installable command: add, remove, edit, bulk, or print")
         parser.add_argument('name', nargs='?', default=None,
-                            help="the name of the installable")
-        parser.add_argument('argument', nargs='*', help='a key=value pair specifying an attribute')
+                            help="the name of the installable (bulk: an archive)")
+        parser.add_argument('argument', nargs='*',
+                            help='a key=value pair specifying an attribute (bulk: more archives, '
+                                 'and hash_algorithm= or creds= for them all)')
 
         parser.epilog = """EXAMPLES:\n
   autobuild edit --archive http://downloads.example.com/packages/foo-2.3.4-darwin-12345.zip
@@ -54,7 +62,14 @@ class AutobuildTool(autobuild_base.AutobuildBase):
             url=http://downloads.example.com/packages/foo-2.3.4-linux-12345.zip
      Adds the specified package url using explicit package name, platform, and hash values.
      The specified values must agree with the metadata in the package if it is present,
-     and with the construction of the package file name."""
+     and with the construction of the package file name.
+
+  autobuild installables bulk hash_algorithm=sha1 \\
+            http://downloads.example.com/packages/foo-2.3.4-darwin64-12345.tar.bz2 \\
+            http://downloads.example.com/packages/bar-1.0.2-darwin64-12346.tar.bz2
+     Fetches and hashes all the archives at once, then adds or edits the installable
+     (and platform) described by the metadata in each, saving the configuration once.
+     Nothing is changed unless every archive can be fetched and checked."""
 
 
     def run(self, args):
@@ -63,6 +78,14 @@ class AutobuildTool(autobuild_base.AutobuildBase):
             add(config, args.name, args.archive, args.argument)
         elif args.command == 'edit':
             edit(config, args.name, args.archive, args.argument)
+        elif args.command == 'bulk':
+            arguments = [args.name] + args.argument if args.name else args.argument
+            archives = [argument for argument in arguments if not _key_value_regexp.match(argument)]
+            if args.archive:
+                archives.insert(0, args.archive)
+            if args.from_file:
+                archives.extend(_read_archive_list(args.from_file))
+            bulk(config, archives, [argument for argument in arguments if _key_value_regexp.match(argument)])
         elif args.command == 'remove':
             remove(config, args.name)
         elif args.command == 'print':
@@ -116,8 +139,12 @@ def _get_new_metadata(config, args_name, args_archive, arguments):
             metadata.archive.url = archive_url
             if 'hash' not in key_values:
                 logger.warning("No hash specified, computing from %s" % archive_file)
-                metadata.archive['hash'] = common.compute_md5(archive_file)
-                metadata.archive['hash_algorithm'] = 'md5'
+                hash_algorithm = key_values.get('hash_algorithm') or 'md5'
+                try:
+                    metadata.archive['hash'] = hash_algorithms.compute_hash(hash_algorithm, archive_file)
+                except common.AutobuildError as err:
+                    raise InstallablesError(str(err))
+                metadata.archive['hash_algorithm'] = hash_algorithm
 
     if archive_file is None:
         logger.warning("Archive not downloaded; some integrity checks may not work")
@@ -183,6 +210,10 @@ def add(config, args_name, args_archive, arguments):
     Adds a package to the configuration's installable list.
     """
     (metadata, platform_description)  = _get_new_metadata(config, args_name, args_archive, arguments)
+    _add_installable(config, metadata, platform_description)
+
+
+def _add_installable(config, metadata, platform_description):
     package_name = metadata.package_description.name
     if package_name in config.installables:
         raise InstallablesError('package %s already exists, use edit instead' % package_name)
@@ -203,7 +234,11 @@ def edit(config, args_name, args_archive, arguments):
         raise InstallablesError('package %s does not exist, use add instead' % package_name)
     if args_name and args_name != package_name:
         raise InstallablesError('name argument (%s) does not match package name (%s)' % (args_name, package_name))
+    _edit_installable(config, metadata, platform_description)
+
 
+def _edit_installable(config, metadata, platform_description):
+    package_name = metadata.package_description.name
     installed_package_description = config.installables[package_name]
     for element in _PACKAGE_ATTRIBUTES:
         if element in metadata.package_description \
@@ -227,6 +262,112 @@ def edit(config, args_name, args_archive, arguments):
                 installed_package_description.platforms[platform_name].archive[element] = metadata.archive[element]
 
 
+def bulk(config, archives, arguments, max_workers=None):
+    """
+    Adds or edits the installable for each of archives (paths or urls), from
+    the metadata in the archive. The archives are fetched and hashed
+    concurrently, and checked -- each must have metadata naming the package
+    in its file name, and no two may be for the same package and platform --
+    before any change is made: if any fails, none are applied. arguments are
+    key=value pairs for all the archives; only hash_algorithm (default md5)
+    and creds are used.
+    """
+    key_values = _dict_from_key_value_arguments(arguments)
+    hash_algorithm = key_values.pop('hash_algorithm', None) or 'md5'
+    has_creds = 'creds' in key_values
+    creds = key_values.pop('creds', None)
+    _warn_unused(key_values)
+    # the same archive twice would be fetched into the same cache file at once
+    archives = list(dict.fromkeys(archive.strip() for archive in archives if archive.strip()))
+    if not archives:
+        raise InstallablesError('no archives specified for bulk')
+
+    if max_workers is None:
+        max_workers = min(len(archives), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [(archive, pool.submit(_fetch_archive, config, archive, hash_algorithm, creds))
+                   for archive in archives]
+        fetched = []
+        errors = []
+        for archive, future in futures:
+            try:
+                fetched.append(future.result())
+            except Exception as err:
+                # a corrupt archive raises tarfile.ReadError, BadZipFile,
+                # OSError...: report it with the others, not instead of them
+                errors.append("%s: %s" % (archive, err))
+
+    seen = {}
+    for metadata, platform_description in fetched:
+        key = (metadata.package_description.name, platform_description.name)
+        if key in seen:
+            errors.append("%s and %s are both %s for platform %s" %
+                          (seen[key], platform_description.archive.url, key[0], key[1]))
+        seen[key] = platform_description.archive.url
+    if errors:
+        raise InstallablesError("no installables changed:\n  " + "\n  ".join(errors))
+
+    for metadata, platform_description in fetched:
+        if has_creds:
+            metadata.archive['creds'] = creds
+            platform_description.archive['creds'] = creds
+        if metadata.package_description.name in config.installables:
+            logger.info("editing %s for %s" % (metadata.package_description.name, platform_description.name))
+            _edit_installable(config, metadata, platform_description)
+        else:
+            logger.info("adding %s for %s" % (metadata.package_description.name, platform_description.name))
+            _add_installable(config, metadata, platform_description)
+
+
+def _fetch_archive(config, archive_path, hash_algorithm, creds):
+    """
+    Fetch and hash one archive for bulk(): returns (metadata, platform
+    description) as _get_new_metadata() would.
+    """
+    if _is_uri(archive_path):
+        archive_url = archive_path
+    else:
+        archive_url = 'file://'+config.absolute_path(archive_path)
+    ignore_dir, from_name, ignore_ext = common.split_tarname(archive_path)
+    # there is no hash yet to verify a cached file against: it is computed below
+    archive_file = get_package_file(from_name[0], archive_url, hash_algorithm=hash_algorithm, creds=creds,
+                                    verified=True)
+    if not archive_file:
+        raise InstallablesError("unable to fetch archive")
+    metadata = get_metadata_from_package(archive_file)
+    if metadata is None or not metadata.package_description \
+      or not metadata.package_description.get('name'):
+        raise InstallablesError("archive has no package metadata")
+    package_name = metadata.package_description['name']
+    if len(from_name) == 4 and from_name[0] != package_name:
+        raise InstallablesError("archive name (%s) does not match package name (%s)" % (from_name[0], package_name))
+    if not metadata.get('platform'):
+        raise InstallablesError("archive metadata has no platform")
+    if len(from_name) == 4 and from_name[2] != metadata['platform']:
+        raise InstallablesError("archive platform (%s) does not match metadata platform (%s)"
+                                % (from_name[2], metadata['platform']))
+    metadata.archive = configfile.ArchiveDescription()
+    metadata.archive.url = archive_url
+    metadata.archive['hash'] = hash_algorithms.compute_hash(hash_algorithm, archive_file)
+    metadata.archive['hash_algorithm'] = hash_algorithm
+
+    platform_description = configfile.PlatformDescription()
+    platform_description.name = metadata['platform']
+    platform_description.archive = metadata.archive.copy()
+    return (metadata, platform_description)
+
+
+def _read_archive_list(path):
+    if path == '-':
+        lines = sys.stdin.readlines()
+    else:
+        try:
+            with open(path) as f:
+                lines = f.readlines()
+        except OSError as err:
+            raise InstallablesError("unable to read archive list: %s" % err)
+    return [line.strip() for line in lines if line.strip() and not line.lstrip().startswith('#')]
+
 
 def remove(config, installable_name):
     """
@@ -31,7 +31,7 @@ import tarfile
 from collections import UserDict
 from zipfile import ZIP_DEFLATED, ZipFile
 
-from autobuild import autobuild_base, common, configfile, archive_utils
+from autobuild import archive_utils, artifact_cache, autobuild_base, common, configfile, tracing
 from autobuild.common import AutobuildError
 
 logger = logging.getLogger('autobuild.package')
@@ -157,6 +157,16 @@ def package(config, build_directory, platform_name, archive_filename=None, archi
         raise PackageError("build directory %s is not a directory" % build_directory)
     logger.info("packaging from %s" % build_directory)
     platform_description = config.get_platform(platform_name)
+    if not dry_run:
+        format = _determine_archive_format(archive_format, platform_description.archive)
+        if artifact_cache.restore_package_metadata(build_directory, format):
+            return _restore_package(config, build_directory, platform_name, format,
+                                    archive_filename, clean_only, results_file)
+        if artifact_cache.was_restored(build_directory):
+            raise PackageError("build in %s was restored from the artifact cache, "
+                               "which has no %s package of it\n"
+                               "  rerun build with %s=false to package it as %s"
+                               % (build_directory, format, artifact_cache.ARTIFACT_CACHE_ENV, format))
     files = set()
     missing = []
     files, missing = _get_file_list(platform_description, build_directory)
@@ -196,9 +206,7 @@ def package(config, build_directory, platform_name, archive_filename=None, archi
     if disallowed_paths:
         raise PackageError("Absolute paths or paths with parent directory elements are not allowed:\n  "+"\n  ".join(sorted(disallowed_paths))+"\n")
     metadata_file.manifest = files
-    if metadata_file.build_id:
-        build_id = metadata_file.build_id
-    else:
+    if not metadata_file.build_id:
         raise PackageError("no build_id in metadata - rerun build\n"
                            "  you may specify (--id <id>) or let it default to the date")
     if metadata_file.platform != platform_name:
@@ -210,28 +218,14 @@ def package(config, build_directory, platform_name, archive_filename=None, archi
     # (they use the --results-file option instead)
     print("packing %s" % package_description.name)
 
-    results = PackageResults({
-        'autobuild_package_name': package_description.name,
-        'autobuild_package_version': metadata_file.package_description.version,
-        'autobuild_package_clean': 'false' if metadata_file.dirty else 'true',
-        'autobuild_package_metadata': metadata_file_path,
-        'autobuild_package_platform': metadata_file.platform,
-    })
+    results = _package_results(package_description, metadata_file)
     if not dry_run:
         metadata_file.save()
 
     # add the metadata file name to the list of files _after_ putting that list in the metadata
     files.add(metadata_file_name)
 
-    config_directory = os.path.dirname(config.path)
-    if not archive_filename:
-        tardir = config_directory
-        tarname = _generate_archive_name(metadata_file.package_description, build_id, platform_name)
-        tarfilename = os.path.join(tardir, tarname)
-    elif os.path.isabs(archive_filename):
-        tarfilename = archive_filename
-    else:
-        tarfilename = os.path.abspath(os.path.join(config_directory, archive_filename))
+    tarfilename = _archive_path(config, metadata_file, archive_filename, platform_name)
     logger.debug(tarfilename)
     if dry_run:
         for f in files:
@@ -241,8 +235,10 @@ def package(config, build_directory, platform_name, archive_filename=None, archi
         format = _determine_archive_format(archive_format, archive_description)
         if format in ('txz', 'tbz2', 'tgz', 'tzst'):
             _create_tarfile(tarfilename, format, build_directory, files, results)
+            artifact_cache.store_package(build_directory, format, tarfilename, results)
         elif format == 'zip':
             _create_zip_archive(tarfilename + '.zip', build_directory, files, results)
+            artifact_cache.store_package(build_directory, format, tarfilename, results)
         else:
             raise PackageError("archive format %s is not supported" % format)
     if not dry_run and results_file:
@@ -250,6 +246,55 @@ def package(config, build_directory, platform_name, archive_filename=None, archi
     return not metadata_file.dirty
 
 
+def _restore_package(config, build_directory, platform_name, format, archive_filename,
+                     clean_only, results_file):
+    """
+    package() for a build whose package the artifact cache has already
+    recorded, and whose autobuild-package.xml it has restored.
+    """
+    metadata_file = configfile.MetadataDescription(
+        path=os.path.abspath(os.path.join(build_directory, configfile.PACKAGE_METADATA_FILE)))
+    if metadata_file.dirty and clean_only:
+        raise PackageError("Package depends on local or legacy installables\n"
+                           "  use 'autobuild install --list-dirty' to see problem packages\n"
+                           "  rerun without --clean-only to allow packaging anyway")
+    print("packing %s" % config.package_description.name)
+    results = _package_results(config.package_description, metadata_file)
+    artifact_cache.restore_package(build_directory, format,
+                                   _archive_path(config, metadata_file, archive_filename, platform_name),
+                                   results)
+    if results_file:
+        results.write(results_file)
+    return not metadata_file.dirty
+
+
+def _package_results(package_description, metadata_file):
+    return PackageResults({
+        'autobuild_package_name': package_description.name,
+        'autobuild_package_version': metadata_file.package_description.version,
+        'autobuild_package_clean': 'false' if metadata_file.dirty else 'true',
+        'autobuild_package_metadata': metadata_file.path,
+        'autobuild_package_platform': metadata_file.platform,
+    })
+
+
+def _archive_path(config, metadata_file, archive_filename, platform_name):
+    """
+    Return the pathname of the archive to create for metadata_file, less
+    the suffix for its format.
+    """
+    config_directory = os.path.dirname(config.path)
+    if not archive_filename:
+        tardir = config_directory
+        tarname = _generate_archive_name(metadata_file.package_description, metadata_file.build_id,
+                                         platform_name)
+        return os.path.join(tardir, tarname)
+    elif os.path.isabs(archive_filename):
+        return archive_filename
+    else:
+        return os.path.abspath(os.path.join(config_directory, archive_filename))
+
+
 def _determine_archive_format(archive_format_argument, archive_description):
     if archive_format_argument is not None:
         return archive_format_argument
@@ -288,6 +333,7 @@ def _get_file_list(platform_description, build_directory):
             os.chdir(current_directory)
     return [files, missing]
 
+@tracing.traced()
 def _create_tarfile(tarfilename, format, build_directory, filelist, results: dict):
     if not os.path.exists(os.path.dirname(tarfilename)):
         os.makedirs(os.path.dirname(tarfilename))
@@ -379,9 +425,11 @@ def _add_file_to_zip_archive(zip_file, unnormalized_file, archive_filename, adde
         logger.info('added ' + file)
 
 
+@tracing.traced()
 def _calculate_hashes(filename: str, results: dict):
     results['autobuild_package_md5'] = common.compute_md5(filename)
     results['autobuild_package_blake2b'] = common.compute_blake2b(filename)
     results['autobuild_package_sha1'] = common.compute_sha1(filename)
     results['autobuild_package_sha256'] = common.compute_sha256(filename)
+    results['autobuild_package_blake2b_tree'] = common.compute_blake2b_tree(filename)
 
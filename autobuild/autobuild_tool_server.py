@@ -0,0 +1,48 @@
+"""
+Run a resident autobuild process to serve the autobuild commands of build
+scripts: see autobuild/server.py.
+"""
+
+import logging
+
+from autobuild import autobuild_base, server
+
+logger = logging.getLogger('autobuild.server')
+
+
+class AutobuildTool(autobuild_base.AutobuildBase):
+    def get_details(self):
+        return dict(name=self.name_from_file(__file__),
+                    description='Serve autobuild commands from a resident process.')
+
+    def register(self, parser):
+        parser.description = "run a resident autobuild server on a Unix socket. " \
+                             "autobuild commands run with %s set are then run by the server." % server.SERVER_ENV
+        parser.add_argument('--socket',
+                            dest='socket',
+                            default=None,
+                            help="path of the socket to listen on (defaults to $%s if that is a path, "
+                                 "otherwise to a socket in autobuild's per-user temporary directory)"
+                                 % server.SERVER_ENV)
+        parser.add_argument('--idle-timeout',
+                            dest='idle_timeout',
+                            type=float,
+                            default=3600,
+                            help="exit after this many seconds without a request (0 means never; default %(default)s)")
+        parser.add_argument('--stop',
+                            action='store_true',
+                            default=False,
+                            help="stop the server listening on the socket")
+
+    def run(self, args):
+        if not server.is_supported():
+            raise server.ServerError("autobuild server needs Unix domain sockets")
+        path = args.socket or server.get_socket_path() or server.default_socket_path()
+        if args.stop:
+            if not server.stop_server(path):
+                logger.warning("no autobuild server on %s" % path)
+            return
+        if args.dry_run:
+            logger.info("would listen on %s" % path)
+            return
+        server.Server(path, idle_timeout=args.idle_timeout or None).serve()
@@ -1,3 +1,4 @@
+import hashlib
 import itertools
 import json
 import logging
@@ -9,12 +10,12 @@ import sys
 import tempfile
 from ast import literal_eval
 from collections import OrderedDict
-from pprint import pformat
 
 from autobuild import autobuild_base, common
 
 logger = logging.getLogger('autobuild.source_environment')
 
+
 class SourceEnvError(common.AutobuildError):
     pass
 
@@ -239,7 +240,7 @@ def load_vsvars(vsver):
             # Any environment variable from our batch script that's identical
             # to our own os.environ was simply inherited. Discard it.
             del vcvars[var]
-    logger.debug("set by %s %s:\n%s" % (vcvarsall, arch, pformat(vcvars)))
+    logger.debug("set by %s %s:\n%s" % (vcvarsall, arch, common.pformat(vcvars)))
 
     return vcvars
 
@@ -307,7 +308,7 @@ call "%s"%s
         logger.debug("pprint output of %s:\n%s" % (batpath, raw_environ))
         raise
 
-    logger.debug("environment from %s:\n%s" % (batpath, pformat(vsvars)))
+    logger.debug("environment from %s:\n%s" % (batpath, common.pformat(vsvars)))
     return vsvars
 
 
@@ -768,6 +769,142 @@ def internal_source_environment(configurations, varsfile):
     return exports, vars, vsvars
 
 
+ENVIRONMENT_CACHE_ENV = "AUTOBUILD_ENVIRONMENT_CACHE"
+
+# Environment variables that differ from one invocation of the same build to
+# the next, and that neither internal_source_environment() nor vcvarsall.bat
+# reads: vcvarsall.bat passes them through, so they never appear in its
+# results either (compared in upper case, as on Windows)
+_UNKEYED_ENVIRONMENT = frozenset((
+    "_", "OLDPWD", "PWD", "SHLVL",
+    "AUTOBUILD_BUILD_ID", "AUTOBUILD_LOGLEVEL", "AUTOBUILD_TRACE", "AUTOBUILD_TRACE_ID",
+    "AUTOBUILD_TRACE_PARENT",
+))
+
+# Bump if the inputs to the key or the layout of disk cache entries change.
+_ENVIRONMENT_CACHE_FORMAT = 2
+
+
+class EnvironmentCache(object):
+    """
+    Cache the (exports, vars, vsvars) triple returned by runner (by default,
+    internal_source_environment()) for each distinct set of inputs: the
+    requested configuration, the variables file and its contents, the
+    platform and the whole environment, apart from the variables listed in
+    _UNKEYED_ENVIRONMENT. vcvarsall.bat may read any variable, so a change
+    to any other one, such as between the requests a long-lived 'autobuild
+    server' handles, computes the environment afresh.
+
+    Results are kept in memory for the life of the process. If
+    AUTOBUILD_ENVIRONMENT_CACHE is true, or cache_dir is given, they are also
+    kept on disk, to be reused by later autobuild invocations. That matters
+    most on Windows, where each computation runs vswhere.exe and
+    vcvarsall.bat. The disk cache is opt-in because a Visual Studio update
+    changes what vcvarsall.bat reports without changing any of those inputs.
+    """
+    def __init__(self, runner=None, cache_dir=None):
+        self.runner = runner
+        self.cache_dir = cache_dir
+        self.entries = {}
+
+    def get(self, configurations, varsfile):
+        """
+        Return (exports, vars, vsvars) as internal_source_environment(configurations, varsfile)
+        would.
+        """
+        runner = self.runner or internal_source_environment
+        key = self.key(configurations, varsfile)
+        if key is None:
+            # can't read varsfile: let runner report that
+            return runner(configurations, varsfile)
+        result = self.entries.get(key)
+        if result is None:
+            cache_dir = self.get_cache_dir()
+            if cache_dir is not None:
+                result = self.__load(cache_dir, key)
+            if result is None:
+                result = runner(configurations, varsfile)
+                if cache_dir is not None:
+                    self.__store(cache_dir, key, result)
+            self.entries[key] = result
+        exports = result[0]
+        if 'AUTOBUILD_VSVER' in exports and 'AUTOBUILD_VSVER' not in os.environ:
+            # internal_source_environment() sets a deduced AUTOBUILD_VSVER in
+            # os.environ for subprocesses: so must we. That changes the key
+            # for the next call in this process.
+            os.environ['AUTOBUILD_VSVER'] = exports['AUTOBUILD_VSVER']
+            self.entries[self.key(configurations, varsfile)] = result
+        return tuple(dict(d) for d in result)
+
+    def get_cache_dir(self):
+        if self.cache_dir is not None:
+            return self.cache_dir
+        if common.is_env_enabled(ENVIRONMENT_CACHE_ENV):
+            return common.get_temp_dir("environment.cache")
+        return None
+
+    def key(self, configurations, varsfile):
+        """
+        Return a hashable key for the inputs to internal_source_environment(),
+        or None if varsfile can't be read.
+        """
+        # first, since establishing the platform may set AUTOBUILD_ADDRSIZE
+        platform = common.get_current_platform()
+        varsfile_state = None
+        if varsfile is not None:
+            try:
+                stat = os.stat(varsfile)
+                with open(varsfile, 'rb') as f:
+                    digest = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+            except OSError:
+                return None
+            varsfile_state = (os.path.abspath(varsfile), stat.st_size, stat.st_mtime_ns, digest)
+        environment = hashlib.blake2b(repr(sorted(
+            (name, value) for name, value in os.environ.items()
+            if name.upper() not in _UNKEYED_ENVIRONMENT)).encode('utf-8'), digest_size=16).hexdigest()
+        return (_ENVIRONMENT_CACHE_FORMAT, common.AUTOBUILD_VERSION_STRING, sys.platform,
+                platform, common.get_autobuild_executable_path(),
+                configurations[0] if configurations else None, varsfile_state, environment)
+
+    def __cache_file(self, cache_dir, key):
+        name = hashlib.blake2b(repr(key).encode('utf-8'), digest_size=16).hexdigest()
+        return os.path.join(cache_dir, name + ".json")
+
+    def __load(self, cache_dir, key):
+        try:
+            with open(self.__cache_file(cache_dir, key)) as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as err:
+            logger.debug("ignoring unreadable environment cache entry: %s" % err)
+            return None
+        if entry.get('key') != repr(key):
+            return None
+        logger.debug("loaded environment from cache")
+        return entry['exports'], entry['vars'], entry['vsvars']
+
+    def __store(self, cache_dir, key, result):
+        exports, vars, vsvars = result
+        entry = dict(key=repr(key), exports=exports, vars=vars, vsvars=vsvars)
+        try:
+            # write to a temp file and rename, so concurrent autobuild
+            # processes never see a partial entry
+            fd, temp_name = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(entry, f)
+                os.replace(temp_name, self.__cache_file(cache_dir, key))
+            except BaseException:
+                os.remove(temp_name)
+                raise
+        except OSError as err:
+            logger.debug("unable to write environment cache entry: %s" % err)
+
+
+_environment_cache = EnvironmentCache()
+
+
 def get_enriched_environment(configuration):
     """
     Return a dict containing an 'enriched' environment in which to run
@@ -788,9 +925,12 @@ def get_enriched_environment(configuration):
 
     On Windows, if AUTOBUILD_VSVER isn't set, a value will be inferred from
     vswhere.exe or the available VSnnnCOMNTOOLS environment variables.
+
+    The variables computed for each configuration are cached: see
+    EnvironmentCache.
     """
     result = common.get_autobuild_environment()
-    exports, vars, vsvars = internal_source_environment(
+    exports, vars, vsvars = _environment_cache.get(
         [configuration] if configuration else [],
         os.environ.get("AUTOBUILD_VARIABLES_FILE"))
     result.update(exports)
@@ -10,7 +10,7 @@ import logging
 import os
 
 from autobuild import autobuild_base, common, configfile
-from autobuild.autobuild_tool_install import uninstall
+from autobuild.autobuild_tool_install import uninstall_all
 from autobuild.autobuild_tool_source_environment import get_enriched_environment
 
 logger = logging.getLogger('autobuild.uninstall')
@@ -33,10 +33,10 @@ def uninstall_packages(options, installed_filename, args, dry_run):
     logger.debug("loading " + installed_filename)
     installed_file = configfile.Dependencies(installed_filename)
 
-    for package in args:
-        if not dry_run:
-            uninstall(package, installed_file)
-        else:
+    if not dry_run:
+        uninstall_all(args, installed_file)
+    else:
+        for package in args:
             logger.info("would have uninstalled %s" % package)
 
     # update the installed-packages.xml file
@@ -110,9 +110,9 @@ class AutobuildTool(autobuild_base.AutobuildBase):
                 environment = get_enriched_environment(build_configuration.name)
                 # then get a copy of the config specific to this build
                 # configuration
-                bconfig = config.copy()
+                bconfig = config.copy_on_write()
                 # and expand its $variables according to the environment.
-                bconfig.expand_platform_vars(environment)
+                bconfig.expand_platform_vars(environment, platform=platform)
                 # Re-fetch the build configuration so we have its expansions.
                 build_configuration = bconfig.get_build_configuration(build_configuration.name, platform_name=platform)
                 build_directory = bconfig.get_build_directory(build_configuration, platform_name=platform)
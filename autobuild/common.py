@@ -10,14 +10,10 @@ from __future__ import annotations
 import hashlib
 import itertools
 import logging
-import multiprocessing
 import os
-import platform
-import pprint
 import subprocess
 import sys
-import tarfile
-import tempfile
+import threading
 from collections import OrderedDict
 from functools import partial
 from typing import Callable
@@ -99,6 +95,9 @@ def is_system_64bit():
     """
     Returns True if the build system is 64-bit compatible.
     """
+    # imported here, like other modules only some commands need, to keep
+    # autobuild's startup (run many times by build scripts) quick
+    import platform
     return platform.machine().lower() in ("x86_64", "amd64", "arm64", "aarch64")
 
 def is_system_windows():
@@ -164,7 +163,7 @@ def establish_platform(specified_platform=None, addrsize=DEFAULT_ADDRSIZE):
     os.environ['AUTOBUILD_ADDRSIZE'] = str(addrsize) # for spawned commands
     os.environ['AUTOBUILD_PLATFORM'] = Platform # for spawned commands
     os.environ['AUTOBUILD_PLATFORM_OVERRIDE'] = Platform # for recursive invocations
-    os.environ['AUTOBUILD_CPU_COUNT'] = os.environ.get('AUTOBUILD_CPU_COUNT', str(multiprocessing.cpu_count()))
+    os.environ['AUTOBUILD_CPU_COUNT'] = os.environ.get('AUTOBUILD_CPU_COUNT', str(os.cpu_count() or 1))
 
     logger.debug("Specified platform %s address-size %d: result %s" \
                  % (specified_platform, specified_addrsize, Platform))
@@ -181,6 +180,16 @@ def get_version_tuple(version_string):
         # Treat any unparseable version as "very old"
         return (0,)
 
+def pformat(value, *args, **kwds):
+    """
+    pprint.pformat(value, *args, **kwds). pprint (with the dataclasses and
+    inspect modules it loads) is imported on first use: most commands never
+    pretty-print anything.
+    """
+    import pprint
+    return pprint.pformat(value, *args, **kwds)
+
+
 def get_current_user():
     """
     Get the login name for the current user.
@@ -229,6 +238,7 @@ def get_temp_dir(basename):
     """
     user = get_current_user()
     if is_system_windows():
+        import tempfile
         installdir = '%s.%s' % (basename, user)
         tmpdir = os.path.join(tempfile.gettempdir(), installdir)
     else:
@@ -238,6 +248,26 @@ def get_temp_dir(basename):
     return tmpdir
 
 
+def get_private_temp_dir(basename):
+    """
+    Return get_temp_dir(basename), accessible only to the current user, for
+    files autobuild must trust: raises AutobuildError if another user owns
+    it, or could replace it.
+    """
+    tmpdir = get_temp_dir(basename)
+    if is_system_windows():
+        # the temporary directory is already per-user
+        return tmpdir
+    # the parent too: whoever can write there can replace tmpdir
+    for directory, others in ((os.path.dirname(tmpdir), 0o022), (tmpdir, 0o077)):
+        mode = os.lstat(directory)
+        if os.path.islink(directory) or not os.path.isdir(directory) or mode.st_uid != os.getuid():
+            raise AutobuildError("%s is not a directory owned by %s" % (directory, get_current_user()))
+        if mode.st_mode & others:
+            os.chmod(directory, mode.st_mode & 0o777 & ~others)
+    return tmpdir
+
+
 def get_autobuild_executable_path():
     if not is_system_windows():
         # Anywhere but Windows, the AUTOBUILD executable should be the first
@@ -321,17 +351,37 @@ def dedup_path(path, sep=os.pathsep):
     return sep.join(OrderedDict((dir.rstrip(r'\/'), 1) for dir in path.split(sep)))
 
 
+# Size of the per-thread read buffer used by compute_hash(). hashlib releases
+# the GIL for updates larger than a couple of KB, so large reads let several
+# threads hash different files concurrently.
+HASH_BUFFER_SIZE = 1024 * 1024
+
+_hash_buffers = threading.local()
+
+
+def _get_hash_buffer() -> memoryview:
+    """
+    Return a reusable read buffer private to the calling thread
+    """
+    try:
+        return _hash_buffers.view
+    except AttributeError:
+        _hash_buffers.view = memoryview(bytearray(HASH_BUFFER_SIZE))
+        return _hash_buffers.view
+
+
 def compute_hash(path: str, hash: Callable[[], hashlib._Hash]):
     """
     Compute a hash for a file effeciently by streaming it into the hash algorithm
     """
     h = hash()
+    view = _get_hash_buffer()
     try:
-        with open(path, 'rb') as f:
-            chunk = f.read(8192)
-            while chunk:
-                h.update(chunk)
-                chunk = f.read(8192)
+        with open(path, 'rb', buffering=0) as f:
+            size = f.readinto(view)
+            while size:
+                h.update(view[:size])
+                size = f.readinto(view)
             return h.hexdigest()
     except IOError as err:
         raise AutobuildError(f"Can't compute {h.name} for {path}: {err}")
@@ -343,6 +393,49 @@ compute_sha1 = partial(compute_hash, hash=hashlib.sha1)
 compute_sha256 = partial(compute_hash, hash=hashlib.sha256)
 
 
+# Chunk size for compute_blake2b_tree(). This is part of the definition of the
+# hash: changing it changes every digest.
+TREE_HASH_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def _blake2b_tree_leaf(path: str, index: int) -> bytes:
+    with open(path, 'rb', buffering=0) as f:
+        f.seek(index * TREE_HASH_CHUNK_SIZE)
+        data = f.read(TREE_HASH_CHUNK_SIZE)
+    return hashlib.blake2b(data, digest_size=32, person=b'autobuild-leaf').digest()
+
+
+def compute_blake2b_tree(path: str, max_workers: int | None = None):
+    """
+    Compute a Merkle tree hash of a file: each TREE_HASH_CHUNK_SIZE chunk is
+    hashed with blake2b (in parallel, on a pool of threads), then adjacent
+    pairs of digests are hashed together, level by level, until one digest
+    remains. An odd digest at the end of a level is carried up unchanged.
+    Leaf and interior nodes use distinct blake2b personalization strings.
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError as err:
+        raise AutobuildError(f"Can't compute blake2b_tree for {path}: {err}")
+    chunks = max(1, -(-size // TREE_HASH_CHUNK_SIZE))
+    leaf = partial(_blake2b_tree_leaf, path)
+    try:
+        if chunks == 1:
+            level = [leaf(0)]
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=min(chunks, max_workers or os.cpu_count() or 1)) as pool:
+                level = list(pool.map(leaf, range(chunks)))
+    except IOError as err:
+        raise AutobuildError(f"Can't compute blake2b_tree for {path}: {err}")
+    while len(level) > 1:
+        level = [hashlib.blake2b(b''.join(level[i:i + 2]), digest_size=32,
+                                 person=b'autobuild-node').digest()
+                 if i + 1 < len(level) else level[i]
+                 for i in range(0, len(level), 2)]
+    return level[0].hex()
+
+
 def split_tarname(pathname):
     """
     Given a tarfile pathname of the form:
@@ -406,20 +499,53 @@ def search_up_for_file(path):
     return os.path.abspath(os.path.join(dir, filename))
 
 
+def _field_property(name):
+    def get(self):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError("object has no attribute '%s'" % name)
+    return property(get)
+
+
+def _clone_value(value):
+    if isinstance(value, Serialized):
+        return value._clone()
+    if type(value) is dict:
+        return {key: _clone_value(item) if isinstance(item, dict) else item
+                for key, item in value.items()}
+    return value
+
+
 class Serialized(dict, object):
     """
     A base class for serialized objects.  Regular attributes are stored in the inherited dictionary
     and will be serialized. Class variables will be handled normally and are not serialized.
+
+    A subclass may list in 'fields' the keys it expects to hold. Each of
+    those gets a property, so that reading it as an attribute is a plain
+    descriptor lookup instead of a failed lookup followed by __getattr__().
     """
 
+    fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Snapshot the class variables before adding any field properties:
+        # assigning one of these names sets an ordinary Python attribute.
+        cls._class_attributes = frozenset(cls.__dict__)
+        for name in cls.fields:
+            if not hasattr(cls, name):
+                setattr(cls, name, _field_property(name))
+
     def __getattr__(self, name):
-        if name in self:
+        try:
             return self[name]
-        else:
+        except KeyError:
             raise AttributeError("object has no attribute '%s'" % name)
 
     def __setattr__(self, name, value):
-        if name in self.__class__.__dict__:
+        if name in self._class_attributes:
             self.__dict__[name] = value
         else:
             self[name] = value
@@ -429,7 +555,24 @@ class Serialized(dict, object):
         Intercept attempts to copy like a dict, need to preserve leaf class
         instead of letting dict.copy() return a simple dict.
         """
-        return self.__class__(self)
+        return self._clone()
+
+    def _clone(self):
+        # Copy the object graph structurally rather than by re-running each
+        # constructor: nested Serialized objects and plain dicts are copied,
+        # anything else (strings, lists such as manifests) is shared, as it
+        # always was by the constructors.
+        clone = dict.__new__(type(self))
+        dict.update(clone, self)
+        for key, value in self.items():
+            if isinstance(value, dict):
+                dict.__setitem__(clone, key, _clone_value(value))
+        if self.__dict__:
+            clone.__dict__.update(self.__dict__)
+        return clone
+
+
+Serialized._class_attributes = frozenset(Serialized.__dict__)
 
 
 def select_directories(args, config, desc, verb, dir_from_config):
@@ -496,7 +639,8 @@ def select_configurations(args, config, verb):
                           for name in args.configurations]
     else:
         configurations = config.get_default_build_configurations(platform)
-    logger.debug("common.select_configurations %s configuration(s)\n%s" % (verb, pprint.pformat(configurations)))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("common.select_configurations %s configuration(s)\n%s" % (verb, pformat(configurations)))
     return configurations
 
 
@@ -0,0 +1,134 @@
+"""
+On-disk cache of loaded autobuild configuration files.
+
+Build scripts commonly run autobuild many times against the same
+autobuild.xml. Rather than re-parsing the LLSD XML and converting it to the
+current format on every run, ConfigurationDescription stores the parsed data
+here in binary LLSD, which is much quicker to parse, and rebuilds its
+PackageDescription object graph from that on the next run. The cache holds
+plain data only -- never pickles -- in a directory only the current user can
+write (common.get_private_temp_dir()): what autobuild.xml says is what
+autobuild runs.
+
+Each entry is keyed by the configuration file's absolute path, size,
+mtime_ns and the running autobuild version, and also records a digest of the
+file contents: a file rewritten with the same size within one mtime tick is
+still detected. Any mismatch simply falls back to parsing the file.
+
+Set AUTOBUILD_CONFIG_CACHE=false to bypass the cache entirely.
+"""
+
+import hashlib
+import logging
+import os
+
+import llsd
+
+from autobuild import common
+
+logger = logging.getLogger('autobuild.config_cache')
+
+CONFIG_CACHE_ENV = "AUTOBUILD_CONFIG_CACHE"
+
+# Bump if the layout of cache entries changes.
+_CACHE_FORMAT = 2
+
+# The binary LLSD entries this process has loaded or stored, by path: a
+# resident autobuild server (see server.py) keeps them from one request to the
+# next. Entries are kept serialized so that each load() returns fresh data.
+entries = {}
+
+
+def is_enabled():
+    return not common.is_env_disabled(CONFIG_CACHE_ENV)
+
+
+def get_cache_dir():
+    return common.get_private_temp_dir("config.cache")
+
+
+def _cache_file(path):
+    name = hashlib.blake2b(path.encode('utf-8'), digest_size=16).hexdigest()
+    return os.path.join(get_cache_dir(), name + ".llsd")
+
+
+def _key(path, stat):
+    # a string: LLSD integers are 32 bits
+    return repr((_CACHE_FORMAT, path, stat.st_size, stat.st_mtime_ns, common.AUTOBUILD_VERSION_STRING))
+
+
+def _digest(contents):
+    return hashlib.blake2b(contents, digest_size=32).hexdigest()
+
+
+def load(path, contents):
+    """
+    Return the cached data (a dict, as parsed from the file) for the
+    configuration file at absolute path whose raw bytes are contents, or None
+    if there is no valid entry.
+    """
+    if not is_enabled():
+        return None
+    try:
+        key = _key(path, os.stat(path))
+        data = entries.get(path)
+        if data is None:
+            with open(_cache_file(path), 'rb') as f:
+                data = f.read()
+        entry = llsd.parse_binary(data)
+        entry_key, digest, state = entry['key'], entry['digest'], entry['data']
+    except FileNotFoundError:
+        return None
+    except Exception as err:
+        # a damaged or incompatible entry, or a cache directory we can't
+        # trust, is no worse than a missing one
+        logger.debug("ignoring unreadable config cache entry for %s: %s" % (path, err))
+        return None
+    if entry_key != key or digest != _digest(contents):
+        logger.debug("config cache entry for %s is stale" % path)
+        entries.pop(path, None)
+        return None
+    logger.debug("loaded %s from config cache" % path)
+    entries[path] = data
+    return state
+
+
+def store(path, contents, state):
+    """
+    Cache state (a dict of plain data, as parsed from the file) for the
+    configuration file at absolute path whose raw bytes are contents. Failure
+    to write the cache is never fatal.
+    """
+    if not is_enabled():
+        return
+    try:
+        key = _key(path, os.stat(path))
+        cache_file = _cache_file(path)
+        data = llsd.format_binary(dict(key=key, digest=_digest(contents), data=state))
+        # only needed on a cache miss: not worth importing up front
+        import tempfile
+
+        # write to a temp file and rename, so concurrent autobuild processes
+        # never see a partial entry
+        fd, temp_name = tempfile.mkstemp(dir=os.path.dirname(cache_file), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_name, cache_file)
+        except BaseException:
+            os.remove(temp_name)
+            raise
+        entries[path] = data
+    except Exception as err:
+        logger.debug("unable to write config cache entry for %s: %s" % (path, err))
+
+
+def invalidate(path):
+    """
+    Discard any cache entry for the configuration file at absolute path.
+    """
+    entries.pop(path, None)
+    try:
+        os.remove(_cache_file(path))
+    except (OSError, common.AutobuildError):
+        pass
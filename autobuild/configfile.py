@@ -2,15 +2,16 @@ import itertools
 import json
 import logging
 import os
-import pprint
 import re
 import string
+import struct
 import sys
+from collections.abc import Sequence
 from io import StringIO
 
 import llsd
 
-from autobuild import common
+from autobuild import common, config_cache, llsd_stream, tracing
 from autobuild.executable import Executable
 from autobuild.scm.git import get_version as get_git_version
 
@@ -20,15 +21,27 @@ AUTOBUILD_CONFIG_FILE = os.environ.get("AUTOBUILD_CONFIG_FILE", "autobuild.xml")
 AUTOBUILD_CONFIG_VERSION = "1.3"        # introduced version_file requirement
 AUTOBUILD_CONFIG_TYPE = "autobuild"
 
-AUTOBUILD_INSTALLED_VERSION = "1"
+AUTOBUILD_INSTALLED_VERSION = "2"     # introduced front-coded manifests
+# installed files in any of these format versions can be read
+AUTOBUILD_INSTALLED_READABLE_VERSIONS = ("1", AUTOBUILD_INSTALLED_VERSION)
 AUTOBUILD_INSTALLED_TYPE = "installed"
 INSTALLED_CONFIG_FILE = "installed-packages.xml"
+INSTALLED_JOURNAL_SUFFIX = ".journal"
 
-AUTOBUILD_METADATA_VERSION = "1"
+AUTOBUILD_METADATA_VERSION = "2"      # introduced normalized dependency_nodes
+# metadata without dependencies is saved as this, readable by older autobuild
+AUTOBUILD_METADATA_NESTED_VERSION = "1"
+# metadata in any of these format versions can be read
+AUTOBUILD_METADATA_READABLE_VERSIONS = (AUTOBUILD_METADATA_NESTED_VERSION, AUTOBUILD_METADATA_VERSION)
 AUTOBUILD_METADATA_TYPE = "metadata"
 PACKAGE_METADATA_FILE = "autobuild-package.xml"
 
 
+# Each installed packages journal record is a big-endian length followed by
+# that many bytes of binary LLSD.
+_JOURNAL_LENGTH = struct.Struct('>I')
+
+
 class ConfigurationError(common.AutobuildError):
     pass
 
@@ -46,6 +59,8 @@ class ConfigurationDescription(common.Serialized):
         installables
     """
 
+    fields = ('version', 'type', 'installables', 'package_description')
+
     # Setting 'path' as a class attribute tells Serialized not to save this
     # attribute to file: it should remain an ordinary Python attribute rather
     # than a dict key.
@@ -69,11 +84,24 @@ class ConfigurationDescription(common.Serialized):
             self.__init_from_dict(dict(copyfrom))
             self.path = getattr(copyfrom, "path", None)
 
-    def copy(self):
-        # Serialized.copy() only passes 'self' to our constructor -- which
-        # doesn't work, since our constructor treats it as a path. Do the
-        # right thing here.
-        return ConfigurationDescription(path=None, copyfrom=self)
+    def copy_on_write(self):
+        """
+        Return a lightweight copy of this configuration to be expanded for
+        one build configuration. Unlike copy(), which duplicates the entire
+        tree including every installable, the view shares everything with
+        this configuration except the package_description object and its
+        platforms dict: expand_platform_vars() replaces the platforms it
+        expands rather than modifying them. Callers must likewise replace,
+        not modify in place, any other part of the view they change.
+        """
+        view = _shallow_copy(self)
+        package_description = self.get('package_description')
+        if package_description is not None:
+            view.package_description = _shallow_copy(package_description)
+            platforms = package_description.get('platforms')
+            if platforms is not None:
+                view.package_description.platforms = dict(platforms)
+        return view
 
     def absolute_path(self, path):
         """
@@ -116,9 +144,10 @@ class ConfigurationDescription(common.Serialized):
                 for (key, value) in self.get_platform(platform_name).configurations.items()
                 if value.default]
 
-    def get_build_directory(self, configuration, platform_name=None):
+    def get_build_directory(self, configuration, platform_name=None, establish=True):
         """
-        Returns the absolute path to the build directory for the platform.
+        Returns the absolute path to the build directory for the platform,
+        and (if establish) makes it the current build directory.
         """
         build_directory=None
         if platform_name is None:
@@ -142,7 +171,8 @@ class ConfigurationDescription(common.Serialized):
         else:
             build_directory = config_directory
 
-        common.establish_build_dir(build_directory) # save global state
+        if establish:
+            common.establish_build_dir(build_directory) # save global state
         return build_directory
 
     def get_platform(self, platform_name):
@@ -170,12 +200,13 @@ class ConfigurationDescription(common.Serialized):
         """
         return self.get_platform(common.get_current_platform())
 
-    def make_build_directory(self, configuration, platform=common.get_current_platform(), dry_run=False):
+    def make_build_directory(self, configuration, platform=common.get_current_platform(), dry_run=False,
+                             establish=True):
         """
         Makes the working platform's build directory if it does not exist and returns a path to it.
         """
         logger.debug("make_build_directory platform %s" % platform)
-        build_directory = self.get_build_directory(configuration, platform_name=platform)
+        build_directory = self.get_build_directory(configuration, platform_name=platform, establish=establish)
         if not os.path.isdir(build_directory):
             if not dry_run:
                 logger.info("Creating build directory %s"
@@ -217,6 +248,11 @@ class ConfigurationDescription(common.Serialized):
             if not autobuild_xml:
                 logger.warning("Configuration file '%s' is empty" % self.path)
                 return
+            cached = config_cache.load(self.path, autobuild_xml)
+            if cached is not None:
+                self.__init_from_dict(cached)
+                logger.debug("Configuration file '%s' (cached)" % self.path)
+                return
             try:
                 saved_data = llsd.parse(autobuild_xml)
             except llsd.LLSDParseError:
@@ -227,6 +263,9 @@ class ConfigurationDescription(common.Serialized):
             # include "type".
             if saved_data.get("type", None) != 'autobuild':
                 raise common.AutobuildError(self.path + ' not an autobuild configuration file')
+            if not orig_ver:
+                # before __init_from_dict() consumes it
+                config_cache.store(self.path, autobuild_xml, saved_data)
             self.__init_from_dict(saved_data)
             logger.debug("Configuration file '%s'" % self.path)
             if orig_ver:
@@ -255,7 +294,8 @@ class ConfigurationDescription(common.Serialized):
                                          % (name, self.installables[name].name))
         self.update(dictionary)
 
-    def expand_platform_vars(self, vars=os.environ):
+    @tracing.traced()
+    def expand_platform_vars(self, vars=os.environ, platform=None):
         try:
             package_description = self.package_description
         except AttributeError:
@@ -263,7 +303,7 @@ class ConfigurationDescription(common.Serialized):
                          "%s has no package_description" % self.name)
             return
 
-        package_description.expand_platform_vars(vars)
+        package_description.expand_platform_vars(vars, platform=platform)
         self._expanded = True
 
 class AttrErrorString(str):
@@ -319,28 +359,268 @@ def check_package_attributes(container, additional_requirements=[]):
                 errors.append("'%s' not specified in the package_description" % attribute)
     return AttrErrorString(attrs, '\n'.join(errors))
 
+class CompactManifest(Sequence):
+    """
+    The list of files installed by a package, front-coded: each path is
+    stored as the length of the prefix it shares with the previous path plus
+    the remaining suffix, all packed into a single string. Installed files
+    come out of an archive grouped by directory, so this is typically a
+    fraction of the size of the equivalent list of strings -- both in memory
+    and, via to_llsd(), in installed-packages.xml.
+
+    It behaves as a read-only sequence of path strings and compares equal to
+    the equivalent list. Paths containing newlines cannot be front-coded;
+    such a manifest is simply kept as a list.
+    """
+    ENCODING = "front-coded"
+
+    __slots__ = ('_encoded', '_length', '_paths')
+
+    def __init__(self, paths=()):
+        paths = list(paths)
+        self._length = len(paths)
+        if any('\n' in path for path in paths):
+            self._encoded = None
+            self._paths = paths
+            return
+        self._paths = None
+        lines = []
+        previous = ''
+        for path in paths:
+            shared = _shared_prefix_length(previous, path)
+            lines.append('%d:%s' % (shared, path[shared:]))
+            previous = path
+        self._encoded = '\n'.join(lines)
+
+    @classmethod
+    def from_llsd(cls, value):
+        """
+        Accept either a plain list of paths (the original installed file
+        format) or the map produced by to_llsd().
+        """
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, dict):
+            if value.get('encoding') != cls.ENCODING:
+                raise ConfigurationError("unknown manifest encoding '%s'" % value.get('encoding'))
+            manifest = cls()
+            manifest._encoded = value.get('paths', '')
+            manifest._length = value.get('count', 0)
+            return manifest
+        return cls(value or ())
+
+    def to_llsd(self):
+        if self._encoded is None:
+            return list(self._paths)
+        return dict(encoding=self.ENCODING, count=self._length, paths=self._encoded)
+
+    def __iter__(self):
+        if self._paths is not None:
+            yield from self._paths
+            return
+        if not self._length:
+            return
+        path = ''
+        for line in self._encoded.split('\n'):
+            shared, _, suffix = line.partition(':')
+            path = path[:int(shared)] + suffix
+            yield path
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if self._paths is None:
+            # decode once, on first random access, rather than once per index
+            self._paths = list(self)
+        return self._paths[index]
+
+    def __contains__(self, path):
+        return any(path == candidate for candidate in self)
+
+    def __eq__(self, other):
+        if isinstance(other, (CompactManifest, list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class LazyManifest(CompactManifest):
+    """
+    A CompactManifest read from file whose raw XML is not parsed until the
+    manifest is first used. Queries that never examine manifests thus never
+    pay to parse them.
+    """
+    __slots__ = ('_raw',)
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    def _materialize(self):
+        if self._raw is not None:
+            manifest = CompactManifest.from_llsd(llsd_stream.parse_value(self._raw))
+            self._encoded, self._length, self._paths = manifest._encoded, manifest._length, manifest._paths
+            self._raw = None
+
+    def to_llsd(self):
+        self._materialize()
+        return super().to_llsd()
+
+    def __iter__(self):
+        self._materialize()
+        return super().__iter__()
+
+    def __len__(self):
+        self._materialize()
+        return super().__len__()
+
+    def __getitem__(self, index):
+        self._materialize()
+        return super().__getitem__(index)
+
+    def __contains__(self, path):
+        self._materialize()
+        return super().__contains__(path)
+
+    def __eq__(self, other):
+        self._materialize()
+        return super().__eq__(other)
+
+    def __repr__(self):
+        self._materialize()
+        return super().__repr__()
+
+
+# llsd_stream.parse() argument: defer parsing every 'manifest'
+_LAZY_MANIFESTS = dict(manifest=LazyManifest)
+
+
+def _shared_prefix_length(first, second):
+    # binary search using slice comparisons, which run in C
+    low, high = 0, min(len(first), len(second))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if first[:middle] == second[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _load_installed_package(package):
+    """
+    Up-convert the LLSD for one installed package as read from file.
+    """
+    if 'manifest' in package:
+        package['manifest'] = CompactManifest.from_llsd(package['manifest'])
+    return package
+
+
 class Dependencies(common.Serialized):
     """
     The record of packages installed in a build tree.
 
     Attributes:
         dependencies - a map of MetadataDescriptions, indexed by package name
+
+    Rewriting the whole file after each package installed or uninstalled is
+    expensive, so journal_install() and journal_uninstall() instead append a
+    compact record of each change to a journal file beside it. save() folds
+    the journal into the file and discards it; if autobuild dies first, the
+    next load replays the journal, so the recorded state still matches what
+    is actually on disk.
     """
 
+    fields = ('version', 'type', 'dependencies')
+
+    # autobuild_tool_install.InstalledIndex caches itself here
+    conflict_index = None
+
     def __init__(self, path):
         self.version = AUTOBUILD_INSTALLED_VERSION
         self.type = AUTOBUILD_INSTALLED_TYPE
         self.dependencies = {}
         self.__load(path=path)
 
+    def journal_path(self):
+        return self.path + INSTALLED_JOURNAL_SUFFIX
+
+    def journal_install(self, name, package):
+        """
+        Record package (a MetadataDescription) as installed under name.
+        """
+        self.dependencies[name] = package
+        self.__append_journal(dict(op='install', name=name,
+                                   package=_compact_to_dict(package, encode_manifests=True)))
+
+    def journal_uninstall(self, name):
+        """
+        Record that the package installed under name has been removed.
+        """
+        self.dependencies.pop(name, None)
+        self.__append_journal(dict(op='uninstall', name=name))
+
+    @tracing.traced()
     def save(self):
         """
-        Save the configuration state to the input file.
+        Save the configuration state to the input file, compacting any journal.
         """
-        dict_representation=_compact_to_dict(self)
+        dict_representation=_compact_to_dict(self, encode_manifests=True)
         del dict_representation['path'] # there's no need for the file to include its own name
-        with open(self.path, 'wb') as f:
+        # replace the file atomically, then drop the journal it now subsumes:
+        # if we die in between, replaying the journal again is harmless
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'wb') as f:
             f.write(llsd.format_pretty_xml(dict_representation))
+        os.replace(temp_path, self.path)
+        try:
+            os.remove(self.journal_path())
+        except FileNotFoundError:
+            pass
+
+    def __append_journal(self, record):
+        data = llsd.format_binary(record)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.journal_path(), 'ab') as f:
+            f.write(_JOURNAL_LENGTH.pack(len(data)) + data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def __replay_journal(self):
+        try:
+            with open(self.journal_path(), 'rb') as f:
+                journal = f.read()
+        except FileNotFoundError:
+            return
+        logger.info("Replaying installed packages journal '%s'" % self.journal_path())
+        offset = 0
+        while offset < len(journal):
+            start = offset + _JOURNAL_LENGTH.size
+            end = start + (_JOURNAL_LENGTH.unpack_from(journal, offset)[0]
+                           if start <= len(journal) else 0)
+            if start > len(journal) or end > len(journal):
+                # the last append was cut short: that change never finished
+                logger.warning("Ignoring incomplete record at end of '%s'" % self.journal_path())
+                break
+            try:
+                record = llsd.parse(journal[start:end])
+            except llsd.LLSDParseError:
+                raise common.AutobuildError("Installed packages journal %s is corrupt.\n"
+                                            "Clearing your build directory and rebuilding should correct it."
+                                            % self.journal_path())
+            if record['op'] == 'install':
+                self.dependencies[record['name']] = _load_installed_package(record['package'])
+            else:
+                self.dependencies.pop(record['name'], None)
+            offset = end
 
     def __load(self, path=None):
         if os.path.isabs(path):
@@ -357,25 +637,29 @@ class Dependencies(common.Serialized):
                 installed_xml = f.read()
             if not installed_xml:
                 logger.warn("Installed file '%s' is empty" % self.path)
+                self.__replay_journal()
                 return
             logger.debug("Installed file '%s'" % self.path)
             try:
-                saved_data = llsd.parse(installed_xml)
+                saved_data = llsd_stream.parse(installed_xml, lazy=_LAZY_MANIFESTS)
             except llsd.LLSDParseError:
                 raise common.AutobuildError("Installed file %s is not valid. Aborting..." % self.path)
-            if not (('version' in saved_data and saved_data['version'] == self.version)
+            if not (('version' in saved_data and saved_data['version'] in AUTOBUILD_INSTALLED_READABLE_VERSIONS)
                     and ('type' in saved_data) and (saved_data['type'] == AUTOBUILD_INSTALLED_TYPE)):
                 raise common.AutobuildError(self.path + ' is not compatible with this version of autobuild.'
                                      + '\nClearing your build directory and rebuilding should correct it.')
 
             dependencies = saved_data.pop('dependencies', {})
             for (name, package) in dependencies.items():
-                self.dependencies[name] = package
+                self.dependencies[name] = _load_installed_package(package)
             self.update(saved_data)
+            # we always save in the current format
+            self.version = AUTOBUILD_INSTALLED_VERSION
         elif not os.path.exists(self.path):
             logger.info("Installed packages file '%s' not found; creating." % self.path)
         else:
             raise ConfigurationError("cannot create installed packages file %s" % self.path)
+        self.__replay_journal()
 
 
 class MetadataDescription(common.Serialized):
@@ -401,6 +685,9 @@ class MetadataDescription(common.Serialized):
     """
     path = None
 
+    fields = ('version', 'type', 'build_id', 'platform', 'configuration', 'package_description',
+              'manifest', 'dependencies', 'archive', 'install_type', 'install_dir', 'dirty')
+
     def __init__(self, path=None, stream=None, parsed_llsd=None, convert_platform=None, create_quietly=False):
         self.version = AUTOBUILD_METADATA_VERSION
         self.type = AUTOBUILD_METADATA_TYPE
@@ -432,7 +719,7 @@ class MetadataDescription(common.Serialized):
             metadata_xml = stream.read()
         if metadata_xml:
             try:
-                parsed_llsd = llsd.parse(metadata_xml)
+                parsed_llsd = llsd_stream.parse(metadata_xml, lazy=_LAZY_MANIFESTS)
             except llsd.LLSDParseError:
                 raise common.AutobuildError("Metadata file %s is corrupt. Aborting..." % self.path)
 
@@ -442,10 +729,10 @@ class MetadataDescription(common.Serialized):
 
 
     def __load(self, parsed_llsd):
-        if (not 'version' in parsed_llsd) or (parsed_llsd['version'] != self.version) \
+        if (not 'version' in parsed_llsd) or (parsed_llsd['version'] not in AUTOBUILD_METADATA_READABLE_VERSIONS) \
                 or (not 'type' in parsed_llsd) or (parsed_llsd['type'] != 'metadata'):
             raise ConfigurationError("missing or incompatible metadata %s" %
-                                     pprint.pformat(parsed_llsd))
+                                     common.pformat(parsed_llsd))
         else:
             package_description = parsed_llsd.pop('package_description', None)
             if package_description:
@@ -453,8 +740,13 @@ class MetadataDescription(common.Serialized):
             else:
                 raise ConfigurationError("metadata is missing package_description")
             dependencies = parsed_llsd.pop('dependencies', {})
-            for (name, package) in dependencies.items():
-                self.dependencies[name] = MetadataDescription(parsed_llsd=package)
+            nodes = parsed_llsd.pop('dependency_nodes', None)
+            if nodes is None:
+                # original layout: each dependency's metadata nested in full
+                for (name, package) in dependencies.items():
+                    self.dependencies[name] = MetadataDescription(parsed_llsd=package)
+            else:
+                self.dependencies = _denormalize_dependencies(dependencies, nodes)
             self.manifest = parsed_llsd.pop('manifest', [])
 
     def add_dependencies(self, installed_pathname):
@@ -465,16 +757,96 @@ class MetadataDescription(common.Serialized):
             del package['manifest']
             if 'dirty' in package and package['dirty']:
                 self.dirty=True
-            logger.debug("adding '%s':\n%s"%(name, pprint.pformat(package)))
+            logger.debug("adding '%s':\n%s"%(name, common.pformat(package)))
             self.dependencies[name] = package
 
     def save(self):
         """
         Save the metadata.
+
+        Rather than nesting each dependency's metadata (with its own
+        dependencies nested in turn) the saved file lists every distinct
+        (name, build_id, hash) dependency once in 'dependency_nodes', and each
+        'dependencies' map refers to those nodes by key. A diamond in the
+        dependency tree thus costs one node rather than a copy per path.
+        Only such a file is marked AUTOBUILD_METADATA_VERSION: metadata
+        without dependencies is saved in the original layout, as version
+        AUTOBUILD_METADATA_NESTED_VERSION, for older autobuild to read.
         """
         if self.path:
+            dict_representation = _compact_to_dict(
+                {key: value for key, value in self.items() if key != 'dependencies'})
+            references, nodes = _normalize_dependencies(self.dependencies)
+            if references:
+                dict_representation['dependencies'] = references
+                dict_representation['dependency_nodes'] = nodes
+                dict_representation['version'] = AUTOBUILD_METADATA_VERSION
+            else:
+                dict_representation['version'] = AUTOBUILD_METADATA_NESTED_VERSION
             with open(self.path, 'wb') as f:
-                f.write(llsd.format_pretty_xml(_compact_to_dict(self)))
+                f.write(llsd.format_pretty_xml(dict_representation))
+
+
+def _normalize_dependencies(dependencies):
+    """
+    Flatten a (possibly shared) tree of dependency metadata into a map of
+    node key to compacted node, each node's 'dependencies' being a map of
+    name to node key. Returns (map of name to key for the top level, nodes).
+
+    A package archive is identified by (name, build_id, hash). A local or
+    dirty install may have no hash, so it is one node only with itself (the
+    same object): its key carries the version and a counter instead.
+    """
+    nodes = {}
+    local_keys = {}
+
+    def dependency_key(name, package):
+        package_description = package.get('package_description') or {}
+        name = package_description.get('name') or name
+        archive = package.get('archive') or {}
+        if archive.get('hash'):
+            return "%s|%s|%s" % (name, package.get('build_id') or '', archive['hash'])
+        try:
+            return local_keys[id(package)]
+        except KeyError:
+            key = local_keys[id(package)] = "%s|%s|local-%d" % (
+                name, package_description.get('version') or '', len(local_keys))
+            return key
+
+    def visit(name, package):
+        key = dependency_key(name, package)
+        if key not in nodes:
+            nodes[key] = None       # claim the key before recursing
+            node = _compact_to_dict({k: v for k, v in package.items() if k != 'dependencies'})
+            node['dependencies'] = {dep_name: visit(dep_name, dep)
+                                    for dep_name, dep in (package.get('dependencies') or {}).items()}
+            nodes[key] = node
+        return key
+
+    references = {name: visit(name, package) for name, package in dependencies.items()}
+    return references, nodes
+
+
+def _denormalize_dependencies(references, nodes):
+    """
+    Inverse of _normalize_dependencies(): returns a map of name to
+    MetadataDescription, in which a node referenced from several places is a
+    single shared MetadataDescription.
+    """
+    loaded = {}
+
+    def load(key):
+        if key not in loaded:
+            try:
+                node = dict(nodes[key])
+            except KeyError:
+                raise ConfigurationError("metadata refers to unknown dependency node '%s'" % key)
+            node_references = node.pop('dependencies', {})
+            loaded[key] = metadata = MetadataDescription(parsed_llsd=node)
+            metadata.dependencies = {name: load(node_key) for name, node_key in node_references.items()}
+        return loaded[key]
+
+    return {name: load(key) for name, key in references.items()}
 
 package_selected_platform = None
 
@@ -505,6 +877,12 @@ class PackageDescription(common.Serialized):
     and store a version attribute instead of the version_file attribute.
     """
 
+    fields = ('name', 'copyright', 'description', 'license', 'license_file', 'homepage',
+              'version', 'version_file', 'use_scm_version', 'platforms', 'install_dir',
+              'vcs_branch', 'vcs_revision', 'vcs_url')
+
+    _expansion_plans = None
+
     def __init__(self, arg):
         self.platforms = {}
         self.license = None
@@ -518,6 +896,9 @@ class PackageDescription(common.Serialized):
         self.vcs_branch = None
         self.vcs_revision = None
         self.vcs_url = None
+        # compiled _ExpansionPlans by platform name: an ordinary attribute
+        # (see below), so every copy() of this package shares them
+        self._expansion_plans = {}
         if isinstance(arg, dict):
             self.__init_from_dict(dict(arg))
         else:
@@ -590,7 +971,12 @@ class PackageDescription(common.Serialized):
             self.platforms[key] = PlatformDescription(value)
         self.update(dictionary)
 
-    def expand_platform_vars(self, vars=os.environ):
+    def expand_platform_vars(self, vars=os.environ, platform=None):
+        """
+        Expand $variable references in the platforms of this package. If
+        platform is given, only the platforms get_platform(platform) can
+        return are expanded; the others are left as they are.
+        """
         try:
             platforms = self.platforms
         except AttributeError:
@@ -598,11 +984,20 @@ class PackageDescription(common.Serialized):
                          "%s has no platforms" % self.name)
             return
 
-        # Iterate through items() -- a copy -- so we can update in place
-        for key, platform in list(platforms.items()):
-            # expand_vars() returns a copy of the original dict rather than
-            # modifying it in place, so make a new PlatformDescription
-            platforms[key] = PlatformDescription(expand_vars(platform, vars))
+        if platform is None:
+            selected = list(platforms.keys())
+        else:
+            selected = [name for name in _platform_candidates(platform) if name in platforms]
+        plans = self._expansion_plans
+        if plans is None:
+            plans = self._expansion_plans = {}
+        for key in selected:
+            plan = plans.get(key)
+            if plan is None or not plan.matches(platforms[key]):
+                plan = plans[key] = _ExpansionPlan(platforms[key])
+            # apply() leaves the original untouched, returning a new
+            # PlatformDescription
+            platforms[key] = plan.apply(platforms[key], vars)
 
 
 class PlatformDescription(common.Serialized):
@@ -617,6 +1012,8 @@ class PlatformDescription(common.Serialized):
         configurations
     """
 
+    fields = ('name', 'archive', 'dependencies', 'build_directory', 'manifest', 'configurations')
+
     def __init__(self, dictionary=None):
         self.configurations = {}
         self.manifest = []
@@ -645,6 +1042,8 @@ class BuildConfigurationDescription(common.Serialized):
         build
     """
 
+    fields = ('name', 'default', 'configure', 'build')
+
     build_steps = ['configure', 'build']
 
     def __init__(self, dictionary=None):
@@ -680,6 +1079,8 @@ class ArchiveDescription(common.Serialized):
     """
     # Implementations for various values of hash_algorithm should be found in
     # hash_algorithms.py.
+    fields = ('creds', 'format', 'hash', 'hash_algorithm', 'url')
+
     def __init__(self, dictionary=None):
         self.creds = None
         self.format = None
@@ -727,7 +1128,7 @@ def pretty_print(description, stream=sys.stdout, format='pprint'):
     Pretty prints a compact version of any description to a stream.
     """
     if format == 'pprint':
-        pprint.pprint(compact_to_dict(description), stream, 1, 80)
+        stream.write(common.pformat(compact_to_dict(description), 1, 80) + "\n")
     elif format == 'json':
         json.dump(compact_to_dict(description), stream, indent=4)
     else:
@@ -745,17 +1146,21 @@ def pretty_print_string(description):
 
 # LLSD will only export dict objects, not objects which inherit from dict.  This function will
 # recursively copy dict like objects into dict's in preparation for export.
-def _compact_to_dict(obj):
+# CompactManifests become plain lists unless encode_manifests is set, which
+# only installed-packages.xml understands.
+def _compact_to_dict(obj, encode_manifests=False):
     if isinstance(obj, dict):
         result = {}
         for (key, value) in list(obj.items()):
             if value:
-                result[key] = _compact_to_dict(value)
+                result[key] = _compact_to_dict(value, encode_manifests)
         return result
     elif isinstance(obj, list):
-        return [_compact_to_dict(o) for o in obj if o]
+        return [_compact_to_dict(o, encode_manifests) for o in obj if o]
     elif isinstance(obj, set):
-        return [_compact_to_dict(o) for o in obj if o]
+        return [_compact_to_dict(o, encode_manifests) for o in obj if o]
+    elif isinstance(obj, CompactManifest):
+        return obj.to_llsd() if encode_manifests else [o for o in obj if o]
     else:
         return obj
 
@@ -810,6 +1215,137 @@ def expand_vars(data, vars=os.environ):
 # enhancement, if ever.
 _placeholder = re.compile(r"\$\{(.*?)\|(.*?)\}")
 
+# stands in for an undefined variable in _ExpansionPlan snapshots
+_UNDEFINED = object()
+
+
+def _platform_candidates(platform):
+    """
+    The platform names PackageDescription.get_platform(platform) may select.
+    """
+    candidates = [platform]
+    if platform.endswith('64'):
+        candidates.append(platform[:-2])
+    if platform != common.PLATFORM_COMMON:
+        candidates.append(common.PLATFORM_COMMON)
+    return candidates
+
+
+def _referenced_variables(value):
+    """
+    Return (names, memoizable) for the string value: the set of variable
+    names it references, and whether its expansion is determined by the
+    values of just those variables. That isn't so if the result of a
+    ${var|fallback} substitution may itself be expanded by string.Template.
+    """
+    names = set()
+    memoizable = True
+    for match in _placeholder.finditer(value):
+        names.add(match.group(1))
+        if '$' in match.group(2) or value[max(match.start() - 1, 0):match.start()] == '$':
+            memoizable = False
+    for match in string.Template.pattern.finditer(_placeholder.sub('', value)):
+        name = match.group('named') or match.group('braced')
+        if name:
+            names.add(name)
+    return names, memoizable
+
+
+def _dollar_strings(value, path=(), entries=None):
+    """
+    Return a list of (path of keys and indexes, string) for each string
+    containing '$' in value, in the order they are found.
+    """
+    if entries is None:
+        entries = []
+    if isinstance(value, str):
+        if '$' in value:
+            entries.append((path, value))
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            _dollar_strings(item, path + (key,), entries)
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            _dollar_strings(item, path + (index,), entries)
+    return entries
+
+
+class _ExpansionPlan(object):
+    """
+    The strings containing '$' in one PlatformDescription, found once so that
+    expanding the platform for each build configuration visits only those
+    strings. Expansions are memoized by the values of the variables they
+    reference.
+    """
+    def __init__(self, platform):
+        # (path of keys and indexes from the platform, unexpanded string)
+        self.entries = _dollar_strings(platform)
+        self.names = set()
+        self.memoizable = True
+        for path, template in self.entries:
+            names, memoizable = _referenced_variables(template)
+            self.names.update(names)
+            self.memoizable = self.memoizable and memoizable
+        self.names = tuple(sorted(self.names))
+        self.memo = {}
+
+    def matches(self, platform):
+        """
+        Is platform still the unexpanded platform this plan was compiled from?
+        Compares every string containing '$' and where it is, so that one
+        added or moved since (by edit, say) is not left unexpanded.
+        """
+        return _dollar_strings(platform) == self.entries
+
+    def expand(self, vars):
+        """
+        Return the list of expanded strings, in the order of self.entries.
+        """
+        snapshot = tuple(vars.get(name, _UNDEFINED) for name in self.names)
+        try:
+            return self.memo[snapshot]
+        except KeyError:
+            pass
+        values = [_expand_vars_string(template, vars) for path, template in self.entries]
+        # a variable value containing '$' may be expanded again by
+        # string.Template, referencing variables outside the snapshot
+        if self.memoizable and not any(isinstance(value, str) and '$' in value
+                                       for value in snapshot):
+            self.memo[snapshot] = values
+        return values
+
+    def apply(self, platform, vars):
+        """
+        Return a copy of platform with its strings expanded. Only containers
+        on the path to an expanded string are copied; the rest is shared.
+        """
+        values = self.expand(vars)
+        root = _shallow_copy(platform)
+        copied = {(): root}
+        for (path, template), value in zip(self.entries, values):
+            container = root
+            for depth in range(1, len(path)):
+                prefix = path[:depth]
+                child = copied.get(prefix)
+                if child is None:
+                    child = copied[prefix] = _shallow_copy(container[path[depth - 1]])
+                    container[path[depth - 1]] = child
+                container = child
+            container[path[-1]] = value
+        return root
+
+
+def _shallow_copy(container):
+    if isinstance(container, list):
+        return list(container)
+    if isinstance(container, common.Serialized):
+        copy = dict.__new__(type(container))
+        dict.update(copy, container)
+        copy.__dict__.update(container.__dict__)
+        return copy
+    return container.copy()
+
+
 def _expand_vars_string(value, vars):
     """
     value is a string.
@@ -4,11 +4,13 @@ Defines a system executable object which can be linked to cascade parameters.
 
 import logging
 import os
+import queue
 import re
 import subprocess
 import sys
+import threading
 
-from autobuild import common
+from autobuild import common, tracing
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +18,173 @@ class ExecutableError(common.AutobuildError):
     pass
 
 
+# Serializes writes of prefixed output from Executables running concurrently
+# (autobuild build --parallel-configurations) so lines never interleave.
+_output_lock = threading.Lock()
+
+
+def _write_output(data):
+    out = getattr(sys.stdout, 'buffer', None)
+    with _output_lock:
+        if out is not None:
+            sys.stdout.flush()
+            out.write(data)
+            out.flush()
+        else:
+            sys.stdout.write(data.decode('utf-8', 'replace'))
+            sys.stdout.flush()
+
+
+class _OutputFilter(object):
+    """
+    Copies a child process's output to our stdout, dropping every line that
+    matches any of a list of regexes and optionally prefixing the rest.
+
+    Rather than testing each line against each filter in Python, the output
+    is handled a block of lines at a time: each regex (the line-anchored
+    filters combined into one) is searched for across the whole block in C,
+    and only matching lines cost any Python work. Each line is still judged
+    on its own, as if filtered a line at a time. A reader thread drains the
+    pipe in large chunks while the calling thread filters and writes
+    whatever has accumulated, so a slow terminal never stalls the child.
+    Output is handled as bytes throughout; carriage returns (CRLF or
+    progress-style bare CR) become newlines.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, filters=None, prefix=None):
+        self._compile(filters or ())
+        self.prefix = prefix.encode('utf-8') if prefix is not None else None
+
+    def _compile(self, filters):
+        patterns = [filter.encode('utf-8') if isinstance(filter, str) else filter
+                    for filter in filters]
+        # sre has no fast path for searching an alternation, only for a
+        # pattern that begins with a literal. So filters anchored at the
+        # start of a line are combined into a single regex that begins with
+        # the literal newline preceding the line, and each other filter is
+        # searched for on its own.
+        anchored = [pattern for pattern in patterns
+                    if pattern.startswith(b"^") and b"|" not in pattern]
+        self.regexes = [re.compile(pattern, re.MULTILINE) for pattern in patterns
+                        if pattern not in anchored]
+        self.line_regex = None
+        if anchored:
+            try:
+                self.line_regex = re.compile(
+                    b"\n(?:%s)" % b"|".join(b"(?:%s)" % pattern for pattern in anchored),
+                    re.MULTILINE)
+                # to judge a line the combined regex matches past its end
+                self.anchored_regexes = [re.compile(pattern, re.MULTILINE) for pattern in anchored]
+            except re.error:
+                # e.g. a filter using global inline flags, which may not be
+                # embedded in another pattern
+                self.regexes.extend(re.compile(pattern, re.MULTILINE) for pattern in anchored)
+
+    def copy(self, stream):
+        """
+        Filter everything read from the binary stream until end of file.
+        """
+        chunks = queue.Queue()
+
+        def reader():
+            try:
+                read = getattr(stream, 'read1', stream.read)
+                while True:
+                    chunk = read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    chunks.put(chunk)
+            finally:
+                chunks.put(None)
+
+        thread = threading.Thread(target=reader, name="output-filter", daemon=True)
+        thread.start()
+        pending = b""
+        done = False
+        while not done:
+            # take everything that has arrived since the last write
+            data = [chunks.get()]
+            while data[-1] is not None:
+                try:
+                    data.append(chunks.get_nowait())
+                except queue.Empty:
+                    break
+            done = data[-1] is None
+            if done:
+                data.pop()
+            pending += b"".join(data)
+            if not done and pending.endswith(b"\r"):
+                # might be the first half of a CRLF split between chunks
+                complete, pending = pending[:-1], b"\r"
+            else:
+                complete, pending = pending, b""
+            complete = complete.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+            if done:
+                if complete and not complete.endswith(b"\n"):
+                    complete += b"\n"
+            else:
+                end = complete.rfind(b"\n") + 1
+                complete, pending = complete[:end], complete[end:] + pending
+            if complete:
+                output = self.filter(complete)
+                if output:
+                    _write_output(output)
+        thread.join()
+
+    def filter(self, block):
+        """
+        Given a block of complete newline-terminated lines, return those that
+        should be shown, prefixed if need be.
+        """
+        if self.regexes or self.line_regex is not None:
+            # offsets of the start of each line to drop
+            dropped = set()
+            size = len(block)
+            if self.line_regex is not None:
+                # each match starts at the newline preceding its line: with
+                # one more newline in front, that is the line's offset
+                self._drop_matching(self.line_regex, b"\n" + block, 1, block, self.anchored_regexes, dropped)
+            for regex in self.regexes:
+                self._drop_matching(regex, block, 0, block, (regex,), dropped)
+            if dropped:
+                kept = []
+                start = 0
+                for line_start in sorted(dropped):
+                    if line_start < size:
+                        kept.append(block[start:line_start])
+                        start = block.find(b"\n", line_start) + 1 or size
+                kept.append(block[start:])
+                block = b"".join(kept)
+        if self.prefix is not None and block:
+            block = self.prefix + block[:-1].replace(b"\n", b"\n" + self.prefix) + b"\n"
+        return block
+
+    @staticmethod
+    def _drop_matching(regex, text, shift, block, alone, dropped):
+        """
+        Add to the set dropped the offset of each line of block in which
+        regex finds a match, searching text: block preceded by shift bytes.
+        Each line is judged by itself, without its newline, as grep would: a
+        match running on past the end of its line counts only if one of the
+        regexes alone matches that line by itself.
+        """
+        size = len(block)
+        match = regex.search(text)
+        while match is not None:
+            position = match.start() - shift
+            line_start = block.rfind(b"\n", 0, position + shift) + 1
+            # every line in block ends with a newline
+            line_end = block.find(b"\n", max(position, line_start)) + 1 or size
+            if match.end() - shift < line_end or \
+               any(line_regex.search(block, line_start, line_end - 1) for line_regex in alone):
+                dropped.add(line_start)
+            # one match per line: carry on from the next (in text, the
+            # newline before it when shift is 1)
+            match = regex.search(text, line_end) if line_end < size else None
+
+
 class Executable(common.Serialized):
     """
     An executable object which invokes a provided command as subprocess.
@@ -37,6 +206,8 @@ class Executable(common.Serialized):
         result = myExecutable()
     """
 
+    fields = ('command', 'options', 'arguments', 'filters')
+
     parent = None
 
     def __init__(self, command=None, options=[], arguments=None, filters=None, parent=None):
@@ -46,7 +217,15 @@ class Executable(common.Serialized):
         self.parent = parent
         self.filters = filters
 
-    def __call__(self, options=[], environment=os.environ):
+    @tracing.traced("Executable")
+    def __call__(self, options=[], environment=os.environ, cwd=None, output_prefix=None):
+        """
+        Run the command with the given extra options in environment and
+        return its exit code. If cwd is given, the command runs there rather
+        than in the current directory. If output_prefix is given, the
+        command's stdout and stderr are captured and each line is written to
+        our stdout preceded by output_prefix.
+        """
         # let the passed environment help us find self.command
         commandlist = self._get_all_arguments(options)
         prog = commandlist[0]
@@ -71,27 +250,29 @@ class Executable(common.Serialized):
                 if prog:
                     commandlist[0] = prog
 
+        # let a nested autobuild add itself to our trace
+        environment = tracing.child_environment(environment)
         filters = self.get_filters()
-        self.show_command(commandlist, filters)
-        if not filters:
+        self.show_command(commandlist, filters, output_prefix)
+        if not filters and output_prefix is None:
             # no filtering, dump child stdout directly to our own stdout
-            return subprocess.call(commandlist, env=environment)
-        else:
-            # have to filter, so run stdout through a pipe
-            process = subprocess.Popen(commandlist, env=environment,
-                                       stdout=subprocess.PIPE)
-            filters_re = [re.compile(filter, re.MULTILINE) for filter in filters]
-            for line in process.stdout:
-                if any(regex.search(line) for regex in filters_re):
-                    continue
-                line = line.replace("\r\n", "\n")
-                line = line.replace("\r", "\n")
-                print(line, end=' ')
+            return subprocess.call(commandlist, env=environment, cwd=cwd)
+        # have to filter or prefix, so run output through a pipe; prefixed
+        # output (one of several concurrent commands) includes stderr too
+        process = subprocess.Popen(commandlist, env=environment, cwd=cwd,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT if output_prefix is not None else None)
+        with process:
+            _OutputFilter(filters, output_prefix).copy(process.stdout)
             return process.wait()
 
-    def show_command(self, commandlist, filters):
+    def show_command(self, commandlist, filters, prefix=None):
         showcmd=" '%s'" % "' '".join(commandlist)
         showfilter="\n| filter (%s)" % "|".join(filters) if filters else ""
+        if prefix is not None:
+            _write_output("".join("%s%s\n" % (prefix, line)
+                                  for line in (showcmd + showfilter).splitlines()).encode('utf-8'))
+            return
         print("%s%s" % (showcmd, showfilter))
         sys.stdout.flush()
 
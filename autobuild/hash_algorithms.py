@@ -1,12 +1,17 @@
 """
 Implementations for various values of configfile.ArchiveDescription.hash_algorithm
 """
-from autobuild import common
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from autobuild import common, tracing
 from autobuild.common import AutobuildError
 
 # Valid configfile.ArchiveDescription.hash_algorithm values are registered
 # here by means of the @hash_algorithm decorator.
 REGISTERED_ALGORITHMS = {}
+# Functions computing the hex digest of a file, by hash_algorithm value
+REGISTERED_COMPUTE_FUNCTIONS = {}
 
 
 class hash_algorithm(object):
@@ -14,24 +19,32 @@ class hash_algorithm(object):
     This decorator is used to register each supported hash algorithm in
     REGISTERED_ALGORITHMS using syntax like:
 
-    @hash_algorithm("md5")
+    @hash_algorithm("md5", common.compute_md5)
     def _verify_md5(self, pathname, hash):
         ...
+
+    The optional second argument, a function accepting a pathname and
+    returning the hex digest of that file, is registered in
+    REGISTERED_COMPUTE_FUNCTIONS for use by compute_hash().
     """
     # called when we instantiate @hash_algorithm("md5")
-    def __init__(self, key):
+    def __init__(self, key, compute=None):
         self.key = key
+        self.compute = compute
 
     # called when this decorator is applied to an implementation function
     def __call__(self, func):
         global REGISTERED_ALGORITHMS
         # Register the decorated function with the specified key.
         REGISTERED_ALGORITHMS[self.key] = func
+        if self.compute is not None:
+            REGISTERED_COMPUTE_FUNCTIONS[self.key] = self.compute
         # Unlike many decorators, we don't want to wrap the passed function in
         # any way; just return the same function.
         return func
 
 
+@tracing.traced()
 def verify_hash(hash_algorithm, pathname, hash):
     """
     Primary entry point for this module
@@ -64,21 +77,68 @@ def verify_hash(hash_algorithm, pathname, hash):
     return function(pathname, hash)
 
 
-@hash_algorithm("md5")
+def compute_hash(hash_algorithm, pathname):
+    """
+    Return the hex digest of the file pathname using the specified
+    hash_algorithm (default md5).
+    """
+    hash_algorithm = hash_algorithm or "md5"
+    try:
+        function = REGISTERED_COMPUTE_FUNCTIONS[hash_algorithm]
+    except KeyError:
+        raise AutobuildError("Unsupported hash type %s for %s" %
+                             (hash_algorithm, pathname))
+    return function(pathname)
+
+
+def verify_many(requests, max_workers=None):
+    """
+    Verify a batch of files at once. requests is an iterable of
+    (hash_algorithm, pathname, hash) triples, with the same meaning as the
+    arguments to verify_hash(). The files are hashed concurrently by a pool of
+    threads; hashlib releases the GIL while digesting large buffers, so this
+    scales with the number of cores (and the disk).
+
+    Returns a list of True or False, one for each request in order: the same
+    pathname may be requested with different hashes. Like verify_hash(),
+    raises AutobuildError for an unsupported hash_algorithm or an unreadable
+    file.
+    """
+    requests = list(requests)
+    if not requests:
+        return []
+    if max_workers is None:
+        max_workers = min(len(requests), os.cpu_count() or 1)
+    if max_workers <= 1:
+        return [verify_hash(algorithm, pathname, hash) for algorithm, pathname, hash in requests]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(verify_hash, algorithm, pathname, hash)
+                   for algorithm, pathname, hash in requests]
+        # collect in request order so any exception surfaces deterministically
+        return [future.result() for future in futures]
+
+
+@hash_algorithm("md5", common.compute_md5)
 def verify_md5(pathname, hash):
     return common.compute_md5(pathname) == hash
 
 
-@hash_algorithm("blake2b")
+@hash_algorithm("blake2b", common.compute_blake2b)
 def verify_blake2b(pathname, hash):
     return common.compute_blake2b(pathname) == hash
 
 
-@hash_algorithm("sha1")
+@hash_algorithm("sha1", common.compute_sha1)
 def verify_sha1(pathname, hash):
     return common.compute_sha1(pathname) == hash
 
 
-@hash_algorithm("sha256")
+@hash_algorithm("sha256", common.compute_sha256)
 def verify_sha256(pathname, hash):
     return common.compute_sha256(pathname) == hash
+
+
+@hash_algorithm("blake2b_tree", common.compute_blake2b_tree)
+def verify_blake2b_tree(pathname, hash):
+    return common.compute_blake2b_tree(pathname) == hash
@@ -0,0 +1,188 @@
+"""
+A streaming LLSD+XML reader for installed-packages.xml and
+autobuild-package.xml.
+
+llsd.parse() builds a complete ElementTree for the document and then
+converts it, so reading installed-packages.xml costs time and memory
+proportional to every per-file manifest it contains -- even for queries like
+--list-installed that never look at a manifest. This reader drives expat
+directly, producing the same Python values as llsd.parse() without an
+intermediate tree. In addition, the value of any map key named in 'lazy' is
+not converted at all: the raw XML for that value is sliced out of the
+document and handed to a factory, which may defer parsing it (with
+parse_value()) until it is actually needed.
+"""
+
+from xml.parsers import expat
+
+import llsd
+
+_CONTAINERS = ('map', 'array')
+
+
+def _to_bool(text):
+    return text.lower() in ('true', '1', '1.0')
+
+
+def _to_int(text):
+    return int(text) if text.strip() else 0
+
+
+def _to_real(text):
+    return float(text) if text.strip() else 0.0
+
+
+# converters for the scalar types that appear in autobuild files; anything
+# else (uuid, date, uri, binary) is rare enough to hand back to llsd itself
+_SCALARS = dict(
+    string=lambda text: text,
+    integer=_to_int,
+    real=_to_real,
+    boolean=_to_bool,
+    undef=lambda text: None,
+)
+
+
+class _Reader(object):
+    def __init__(self, data, lazy):
+        self.data = data
+        self.lazy = lazy or {}
+        # stack of [container, pending map key] pairs
+        self.stack = []
+        self.text = []
+        self.attrs = None
+        self.result = None
+        self.started = False
+        self.done = False
+        self.skip_depth = 0
+        self.skip_start = 0
+        self.skip_factory = None
+
+        self.parser = expat.ParserCreate()
+        self.parser.buffer_text = True
+        self._parse_handlers()
+
+    def _parse_handlers(self):
+        self.parser.StartElementHandler = self.start
+        self.parser.EndElementHandler = self.end
+        self.parser.CharacterDataHandler = self.text.append
+
+    def _skip_handlers(self):
+        self.parser.StartElementHandler = self.skip_element_start
+        self.parser.EndElementHandler = self.skip_element_end
+        self.parser.CharacterDataHandler = None
+
+    def read(self):
+        try:
+            self.parser.Parse(self.data, True)
+        except expat.ExpatError as err:
+            raise llsd.LLSDParseError(str(err))
+        if not self.done:
+            raise llsd.LLSDParseError("Invalid XML Declaration")
+        return self.result
+
+    def add(self, value):
+        if not self.stack:
+            self.result = value
+            return
+        top = self.stack[-1]
+        container = top[0]
+        if isinstance(container, dict):
+            container[top[1] if top[1] is not None else ''] = value
+            top[1] = None
+        else:
+            container.append(value)
+
+    def start(self, name, attrs):
+        del self.text[:]
+        if name == 'llsd':
+            self.started = True
+            return
+        if not self.started:
+            raise llsd.LLSDParseError("Invalid XML Declaration")
+        if name == 'key':
+            return
+        if self.stack:
+            top = self.stack[-1]
+            if top[1] is not None and top[1] in self.lazy and isinstance(top[0], dict):
+                self.skip_start = self.parser.CurrentByteIndex
+                self.skip_depth = 1
+                self.skip_factory = self.lazy[top[1]]
+                self._skip_handlers()
+                return
+        if name in _CONTAINERS:
+            self.stack.append([{} if name == 'map' else [], None])
+        else:
+            self.attrs = attrs
+
+    def end(self, name):
+        if name == 'llsd':
+            self.done = True
+            return
+        if name == 'key':
+            self.stack[-1][1] = ''.join(self.text)
+            return
+        if name in _CONTAINERS:
+            container = self.stack.pop()[0]
+            self.add(container)
+            return
+        text = ''.join(self.text)
+        try:
+            convert = _SCALARS[name]
+        except KeyError:
+            value = self._delegate(name, text)
+        else:
+            try:
+                value = convert(text)
+            except ValueError as err:
+                raise llsd.LLSDParseError("bad %s value '%s': %s" % (name, text, err))
+        self.add(value)
+
+    def _delegate(self, name, text):
+        if name not in ('uuid', 'date', 'uri', 'binary'):
+            raise llsd.LLSDParseError("unknown LLSD element <%s>" % name)
+        # rare: not worth importing saxutils (and with it urllib) up front
+        from xml.sax.saxutils import escape, quoteattr
+        attrs = ''.join(' %s=%s' % (key, quoteattr(value)) for key, value in self.attrs.items())
+        return llsd.parse_xml(('<llsd><%s%s>%s</%s></llsd>' % (name, attrs, escape(text), name)).encode('utf-8'))
+
+    def skip_element_start(self, name, attrs):
+        self.skip_depth += 1
+
+    def skip_element_end(self, name):
+        self.skip_depth -= 1
+        if self.skip_depth:
+            return
+        start_tag_end = self.data.index(b'>', self.skip_start) + 1
+        if self.data[start_tag_end - 2:start_tag_end] == b'/>':
+            # an empty element (<array />) is just its start tag: expat
+            # reports its end somewhere past it
+            raw = self.data[self.skip_start:start_tag_end]
+        else:
+            # CurrentByteIndex is the start of the end tag
+            raw = self.data[self.skip_start:self.data.index(b'>', self.parser.CurrentByteIndex) + 1]
+        self._parse_handlers()
+        self.add(self.skip_factory(raw))
+
+
+def parse(data, lazy=None):
+    """
+    Parse the LLSD+XML document in the bytes object data, returning the same
+    value llsd.parse() would -- except that for each map key in the dict
+    lazy, the value is replaced by lazy[key](raw XML bytes of that value).
+    Raises llsd.LLSDParseError on malformed input.
+    """
+    if not data.lstrip().startswith(b'<'):
+        # not XML at all: let llsd figure out (or reject) the format
+        return llsd.parse(data)
+    return _Reader(data, lazy).read()
+
+
+def parse_value(raw):
+    """
+    Parse the raw XML bytes for a single LLSD value, as passed to a lazy
+    factory by parse().
+    """
+    # a single self-contained value: llsd's own (C ElementTree based) parser
+    # is quickest here
+    return llsd.parse_xml(b'<llsd>' + raw + b'</llsd>')
@@ -0,0 +1,240 @@
+"""
+An index of the dependencies between every package in a directory of
+archives -- by default, the install cache.
+
+Each archive's autobuild-package.xml names the exact build (name, version
+and build_id) of every package it was built against, directly or not.
+PackageIndex.update() reads the metadata of each archive in the directory,
+in parallel, and merges them into one graph whose nodes are those builds.
+The graph is saved as a JSON index file along with what each node depends
+on, what depends on each node and the builds of each package name, so that
+later queries need only load the file. Archives already indexed are not
+read again unless they have changed.
+"""
+
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from autobuild import common
+from autobuild.autobuild_tool_install import get_metadata_from_package
+
+logger = logging.getLogger('autobuild.package_index')
+
+INDEX_FILE = "autobuild-package-index.json"
+ARCHIVE_SUFFIXES = (".tar.bz2", ".tar.gz", ".tar.zst", ".zip")
+
+# Bump if the layout of the index file changes.
+_INDEX_FORMAT = 1
+
+
+class PackageIndexError(common.AutobuildError):
+    pass
+
+
+def node_id(name, version, build_id):
+    """The key of the node for one build of a package"""
+    return "%s/%s/%s" % (name, version or "", build_id or "")
+
+
+def _natural_key(text):
+    # '1.10' sorts after '1.9', and '20100222b' after '20100222a'
+    return [(0, int(part), "") if part.isdigit() else (1, 0, part)
+            for part in re.findall(r"\d+|\D+", str(text or ""))]
+
+
+def _archive_nodes(metadata, archive_name):
+    """
+    Return (root node id, dict of node id: node) for the metadata tree of the
+    archive archive_name.
+    """
+    nodes = {}
+    root = None
+    stack = [(metadata, archive_name)]
+    while stack:
+        package, archive = stack.pop()
+        description = package['package_description']
+        this_id = node_id(description['name'], description.get('version'), package.get('build_id'))
+        if root is None:
+            root = this_id
+        if this_id in nodes:
+            continue
+        dependencies = list((package.get('dependencies') or {}).values())
+        nodes[this_id] = dict(
+            name=description['name'], version=description.get('version') or "",
+            build_id=package.get('build_id') or "", platform=package.get('platform') or "",
+            archive=archive,
+            dependencies=[node_id(dep['package_description']['name'],
+                                  dep['package_description'].get('version'),
+                                  dep.get('build_id'))
+                          for dep in dependencies])
+        stack.extend((dependency, None) for dependency in dependencies)
+    return root, nodes
+
+
+def _index_archive(path):
+    try:
+        metadata = get_metadata_from_package(path)
+    except Exception as err:
+        logger.warning("unable to read %s: %s" % (path, err))
+        return None
+    if metadata is None or not metadata.package_description:
+        logger.info("no metadata in %s" % path)
+        return None
+    return _archive_nodes(metadata, os.path.basename(path))
+
+
+class PackageIndex(object):
+    """
+    The dependency graph of a directory of archives.
+
+    Attributes:
+        directory   the directory of archives indexed
+        archives    archive file name: dict(size, mtime_ns, root, nodes) --
+                    root and nodes as returned by _archive_nodes(), root None
+                    for an archive without metadata
+        nodes       node id: dict(name, version, build_id, platform,
+                    archive, dependencies) -- archive is None for a build
+                    seen only as another's dependency
+        dependents  node id: ids of the nodes that depend on it directly
+        builds      package name: ids of the nodes for that package
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.archives = {}
+        self.nodes = {}
+        self.dependents = {}
+        self.builds = {}
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as err:
+            raise PackageIndexError("unable to read package index %s: %s" % (path, err))
+        if data.get('format') != _INDEX_FORMAT:
+            raise PackageIndexError("%s is not a package index autobuild %s can read" %
+                                    (path, common.AUTOBUILD_VERSION_STRING))
+        index = cls(data['directory'])
+        for name in ('archives', 'nodes', 'dependents', 'builds'):
+            setattr(index, name, data[name])
+        return index
+
+    def save(self, path):
+        temp_name = "%s.%s.tmp" % (path, os.getpid())
+        with open(temp_name, 'w') as f:
+            json.dump(dict(format=_INDEX_FORMAT, directory=self.directory, archives=self.archives,
+                           nodes=self.nodes, dependents=self.dependents, builds=self.builds), f)
+        os.replace(temp_name, path)
+
+    def update(self, jobs=None):
+        """
+        Bring the index up to date with the archives now in the directory,
+        reading (jobs at a time) only those not indexed as they are now.
+        Returns the number of archives read.
+        """
+        current = {}
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(ARCHIVE_SUFFIXES):
+                stat = entry.stat()
+                current[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        archives = {}
+        changed = []
+        for name, (size, mtime_ns) in current.items():
+            known = self.archives.get(name)
+            if known and known['size'] == size and known['mtime_ns'] == mtime_ns:
+                archives[name] = known
+            else:
+                changed.append(name)
+        if changed:
+            logger.info("indexing %d archives in %s" % (len(changed), self.directory))
+            with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as executor:
+                results = executor.map(_index_archive,
+                                       [os.path.join(self.directory, name) for name in changed])
+                for name, result in zip(changed, results):
+                    root, nodes = result or (None, {})
+                    size, mtime_ns = current[name]
+                    archives[name] = dict(size=size, mtime_ns=mtime_ns, root=root, nodes=nodes)
+        self.archives = archives
+        self._merge()
+        return len(changed)
+
+    def _merge(self):
+        nodes = {}
+        for name in sorted(self.archives):
+            for this_id, node in self.archives[name]['nodes'].items():
+                known = nodes.get(this_id)
+                # prefer the description of a build from its own archive
+                if known is None or (node['archive'] and not known['archive']):
+                    nodes[this_id] = node
+        dependents = {this_id: [] for this_id in nodes}
+        builds = {}
+        for this_id, node in nodes.items():
+            builds.setdefault(node['name'], []).append(this_id)
+            for dependency in node['dependencies']:
+                dependents.setdefault(dependency, []).append(this_id)
+        self.nodes = nodes
+        self.dependents = {this_id: sorted(ids) for this_id, ids in dependents.items()}
+        self.builds = {name: sorted(ids) for name, ids in builds.items()}
+
+    def _resolve(self, package):
+        # a package name stands for all its builds
+        if package in self.nodes:
+            return [package]
+        try:
+            return self.builds[package]
+        except KeyError:
+            raise PackageIndexError("no package %s in the index of %s" % (package, self.directory))
+
+    def dependents_of(self, package):
+        """
+        Return the ids of the nodes that depend directly on package: a node id,
+        or a package name for any of its builds.
+        """
+        return sorted(set(dependent for this_id in self._resolve(package)
+                          for dependent in self.dependents.get(this_id, ())))
+
+    def newest(self, name):
+        """
+        Return the id of the newest build of the package name, by version and
+        then build_id.
+        """
+        return max(self._resolve(name),
+                   key=lambda this_id: (_natural_key(self.nodes[this_id]['version']),
+                                        _natural_key(self.nodes[this_id]['build_id'])))
+
+    def write_mermaid(self, stream):
+        """Write the graph as a mermaid flowchart to stream, a line at a time"""
+        ids = {}
+        stream.write("graph TB\n")
+        for number, (this_id, node) in enumerate(self.nodes.items()):
+            ids[this_id] = "n%d" % number
+            # a build seen only as a dependency is drawn as a stadium
+            start, end = ("[", "]") if node['archive'] else ("([", "])")
+            label = "<br />".join((node['name'], node['version'], node['build_id'])).replace('"', "#quot;")
+            stream.write('    %s%s"%s"%s\n' % (ids[this_id], start, label, end))
+        for this_id, node in self.nodes.items():
+            for dependency in node['dependencies']:
+                stream.write("    %s-->%s\n" % (ids[dependency], ids[this_id]))
+
+    def write_dot(self, stream):
+        """Write the graph in the dot language to stream, a line at a time"""
+        def escape(text):
+            return text.replace('\\', '\\\\').replace('"', '\\"')
+
+        def quote(text):
+            return '"%s"' % escape(text)
+        stream.write("digraph packages {\n")
+        stream.write("    node [shape=box];\n")
+        for this_id, node in self.nodes.items():
+            # escape each part, not the \n line breaks between them
+            label = "\\n".join(escape(node[key]) for key in ('name', 'version', 'build_id'))
+            stream.write('    %s [label="%s"%s];\n' %
+                         (quote(this_id), label, "" if node['archive'] else ", style=dashed"))
+        for this_id, node in self.nodes.items():
+            for dependency in node['dependencies']:
+                stream.write("    %s -> %s;\n" % (quote(dependency), quote(this_id)))
+        stream.write("}\n")
@@ -31,14 +31,26 @@ variables to a falsey value (0, f, no, false)
 
 - AUTOBUILD_SCM        - disable SCM version resolution
 - AUTOBUILD_SCM_SEARCH - disable walking up parent directories to search for SCM root
+
+## Queries
+
+new_client() returns one Git object per repository for the life of the
+process, and each Git object remembers what it has asked git. The revision
+and branch are read straight from HEAD, the loose refs and packed-refs, and
+the origin URL from .git/config, falling back to git itself for anything out
+of the ordinary (an unborn branch, URL rewriting, includes...). The version
+is remembered for as long as HEAD, the tags and the index are unchanged.
 """
 
 import logging
+import os
+import re
+import shutil
 import subprocess
 from pathlib import Path
 from typing import NamedTuple
 
-from autobuild.common import cmd, has_cmd, is_env_disabled
+from autobuild.common import cmd, is_env_disabled
 from autobuild.scm.base import Semver, date
 
 __all__ = ["get_version"]
@@ -49,6 +61,11 @@ log = logging.getLogger(__name__)
 
 MAX_GIT_SEARCH_DEPTH = 20
 
+_SHA_RE = re.compile(r"^[0-9a-f]{40}([0-9a-f]{24})?$")
+
+# Git objects by repository directory: see new_client()
+_clients: dict[Path, "Git"] = {}
+
 
 class GitMeta(NamedTuple):
     dirty: bool
@@ -91,11 +108,112 @@ def _parse_describe(describe: str) -> GitMeta:
     )
 
 
+def _stat_key(path: Path):
+    """Something that changes whenever the file or directory at path does"""
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def _rewrites_urls(git_dir: Path) -> bool:
+    """
+    Whether any git configuration that applies to git_dir might change what
+    'git remote get-url' reports from what the repository's config says.
+    """
+    if any(name.startswith("GIT_CONFIG") for name in os.environ):
+        return True
+    home = Path.home()
+    xdg_config = Path(os.environ.get("XDG_CONFIG_HOME") or home / ".config")
+    for config in (git_dir / "config", home / ".gitconfig", xdg_config / "git" / "config",
+                   Path("/etc/gitconfig")):
+        try:
+            text = config.read_text(errors="replace").lower()
+        except OSError:
+            continue
+        if "insteadof" in text or "[include" in text:
+            return True
+    return False
+
+
 class Git:
     repo_dir: Path | None
 
     def __init__(self, root: str):
         self.repo_dir = _find_repo_dir(Path(root))
+        # query name: (key, value) -- see _remember()
+        self._memo = {}
+
+    @property
+    def git_dir(self) -> Path:
+        return self.repo_dir / ".git"
+
+    def _remember(self, name, key, compute):
+        """
+        Return the value compute() returned for query name when key() last
+        returned what it returns now, or call compute() now.
+        """
+        try:
+            memo_key, value = self._memo[name]
+            if memo_key == key():
+                return value
+        except KeyError:
+            pass
+        value = compute()
+        # afterwards: git itself may have touched what key() looks at
+        self._memo[name] = (key(), value)
+        return value
+
+    def _packed_refs(self) -> dict[str, str]:
+        packed_refs = self.git_dir / "packed-refs"
+        return self._remember("packed-refs", lambda: _stat_key(packed_refs),
+                              lambda: self._read_packed_refs(packed_refs))
+
+    @staticmethod
+    def _read_packed_refs(path: Path) -> dict[str, str]:
+        refs = {}
+        try:
+            lines = path.read_text().splitlines()
+        except OSError:
+            return refs
+        for line in lines:
+            # skip the header and peeled tags
+            if line and line[0] not in "#^":
+                sha, _, ref = line.partition(" ")
+                refs[ref.strip()] = sha
+        return refs
+
+    def _read_ref(self, ref: str) -> str | None:
+        try:
+            sha = (self.git_dir / ref).read_text().strip()
+        except OSError:
+            sha = self._packed_refs().get(ref)
+        return sha if sha and _SHA_RE.match(sha) else None
+
+    def _head(self) -> tuple[str, str]:
+        """
+        (revision, branch) as 'git rev-parse HEAD' and 'git rev-parse
+        --abbrev-ref HEAD' report them
+        """
+        try:
+            head = (self.git_dir / "HEAD").read_text().strip()
+        except OSError:
+            head = ""
+        if head.startswith("ref: refs/heads/"):
+            ref = head[len("ref: "):]
+            revision = self._read_ref(ref)
+            if revision:
+                return revision, ref[len("refs/heads/"):]
+        elif _SHA_RE.match(head):
+            # detached
+            return head, "HEAD"
+        # anything else: ask git, once for both
+        revision, branch = self._git("rev-parse", "HEAD", "--abbrev-ref", "HEAD").stdout.splitlines()
+        return revision, branch
+
+    def _tags_key(self):
+        return (_stat_key(self.git_dir / "packed-refs"), _stat_key(self.git_dir / "refs" / "tags"))
 
     def _git(self, *args) -> subprocess.CompletedProcess[str]:
         """Run git subcommand against the active git directory"""
@@ -113,15 +231,37 @@ class Git:
 
     @property
     def revision(self) -> str | None:
-        return self._git("rev-parse", "HEAD").stdout if self.repo_dir else None
+        return self._head()[0] if self.repo_dir else None
+
+    @property
+    def dirty(self) -> bool:
+        """Whether any tracked file has uncommitted changes"""
+        return bool(self._git("status", "--porcelain", "--untracked-files=no").stdout)
 
     @property
     def url(self) -> str | None:
-        return self._git("remote", "get-url", "origin").stdout if self.repo_dir else None
+        if not self.repo_dir:
+            return None
+        return self._remember("url", lambda: _stat_key(self.git_dir / "config"), self._origin_url)
+
+    def _origin_url(self) -> str:
+        if not _rewrites_urls(self.git_dir):
+            section = None
+            for line in (self.git_dir / "config").read_text().splitlines():
+                line = line.strip()
+                if line.startswith("["):
+                    section = line.strip("[] ")
+                elif section == 'remote "origin"':
+                    name, _, value = line.partition("=")
+                    value = value.strip()
+                    if name.strip().lower() == "url" and value and not any(c in value for c in '"\\;#'):
+                        return value
+        # quoting, rewriting, no origin (let git report that)...
+        return self._git("remote", "get-url", "origin").stdout
 
     @property
     def branch(self) -> str | None:
-        return self._git("rev-parse", "--abbrev-ref", "HEAD").stdout if self.repo_dir else None
+        return self._head()[1] if self.repo_dir else None
 
     @property
     def version(self) -> str | None:
@@ -129,6 +269,13 @@ class Git:
         if not self.repo_dir:
             log.debug("no git root found, returning null version")
             return None
+        # 'git describe --dirty' refreshes the index
+        return self._remember("version", self._version_key, self._version)
+
+    def _version_key(self):
+        return (self._head(), self._tags_key(), _stat_key(self.git_dir / "index"))
+
+    def _version(self) -> str:
         meta = _parse_describe(self.describe())
 
         # If the tag is not a valid semver, then use the raw tag as the next version.
@@ -146,10 +293,21 @@ class Git:
 
 
 def new_client(root: str) -> Git | None:
-    if not has_cmd("git"):
+    """
+    Return the Git object for the repository containing root, shared by all
+    callers in this process, or None if git is not available.
+    """
+    if not shutil.which("git"):
         log.warning("git command not available, skipping git version detection")
         return None
-    return Git(root)
+    repo_dir = _find_repo_dir(Path(root))
+    if repo_dir is None:
+        return Git(root)
+    repo_dir = repo_dir.resolve()
+    try:
+        return _clients[repo_dir]
+    except KeyError:
+        return _clients.setdefault(repo_dir, Git(str(repo_dir)))
 
 
 def get_version(root: str) -> str | None:
@@ -0,0 +1,468 @@
+"""
+A resident autobuild process serving repeated invocations.
+
+Build scripts run autobuild many times -- source_environment, nested
+install, build and package commands -- and each run starts a new Python
+interpreter, imports autobuild and reloads the same configuration. 'autobuild
+server' instead imports every tool once and listens on a per-user Unix
+socket. With AUTOBUILD_SERVER enabled, the autobuild command passes its
+argv, working directory, environment and standard streams to the server
+(see run_on_server()) rather than running the command itself.
+
+The server forks a child for each request, so that each command gets the
+caller's cwd and os.environ, writes straight to the caller's stdout and
+stderr, and cannot disturb the server or other requests running at the same
+time (such as an 'autobuild install' run by the build script of an
+'autobuild build'). When a child finishes it sends the server what it has
+added to autobuild's in-memory caches -- loaded configuration files and
+computed build environments -- so that later requests start with them.
+
+If the server can't be reached, or is running a different version of
+autobuild, the command simply runs locally. Set AUTOBUILD_SERVER=true to use
+the default socket, or to the path of the socket to use.
+"""
+
+import array
+import json
+import logging
+import os
+import pickle
+import selectors
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+
+from autobuild import common
+
+logger = logging.getLogger('autobuild.server')
+
+SERVER_ENV = "AUTOBUILD_SERVER"
+
+# a request starts with its length, sent along with the caller's stdin,
+# stdout and stderr
+_HEADER = struct.Struct('>I')
+_STREAMS = (0, 1, 2)
+# sent by the client when interrupted
+_INTERRUPT = b'\x03'
+# seconds to wait for the rest of a request
+_REQUEST_TIMEOUT = 10
+
+# set in the child serving a request: it must run the command itself
+_serving = False
+
+
+class ServerError(common.AutobuildError):
+    pass
+
+
+def is_supported():
+    # passing file descriptors needs Unix domain sockets
+    return hasattr(socket, 'AF_UNIX') and hasattr(socket, 'SCM_RIGHTS')
+
+
+def default_socket_path():
+    directory = common.get_temp_dir("server")
+    # other users don't get to run commands as us
+    os.chmod(directory, 0o700)
+    return os.path.join(directory, "autobuild.sock")
+
+
+def get_socket_path():
+    """
+    Return the path of the server socket clients should use, or None if
+    AUTOBUILD_SERVER is not enabled.
+    """
+    setting = os.environ.get(SERVER_ENV, "")
+    if not setting or common.is_env_disabled(SERVER_ENV):
+        return None
+    if common.is_env_enabled(SERVER_ENV):
+        return default_socket_path()
+    return setting
+
+
+def _send_message(connection, message):
+    data = json.dumps(message).encode('utf-8')
+    connection.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _receive_exactly(connection, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data.extend(chunk)
+    return bytes(data)
+
+
+def _receive_message(connection):
+    size, = _HEADER.unpack(_receive_exactly(connection, _HEADER.size))
+    return json.loads(_receive_exactly(connection, size).decode('utf-8'))
+
+
+def _connect(path):
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+    except BaseException:
+        connection.close()
+        raise
+    return connection
+
+
+# ****************************************************************************
+#   client
+# ****************************************************************************
+def run_on_server(argv):
+    """
+    If AUTOBUILD_SERVER is enabled and its server is running, run the autobuild
+    command with arguments argv there and return its exit status. Otherwise
+    return None: the caller should run the command itself.
+    """
+    if _serving or not is_supported():
+        return None
+    tool = next((arg for arg in argv if not arg.startswith('-')), None)
+    if tool in (None, 'server'):
+        # nothing worth sending, or the server itself
+        return None
+    path = get_socket_path()
+    if path is None:
+        return None
+    try:
+        connection = _connect(path)
+    except OSError as err:
+        logger.debug("not using autobuild server %s: %s" % (path, err))
+        return None
+    with connection:
+        umask = os.umask(0)
+        os.umask(umask)
+        request = json.dumps(dict(version=common.AUTOBUILD_VERSION_STRING,
+                                  argv=[sys.argv[0]] + list(argv), cwd=os.getcwd(),
+                                  environment=dict(os.environ), umask=umask)).encode('utf-8')
+        try:
+            connection.sendmsg([_HEADER.pack(len(request))],
+                               [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', _STREAMS))])
+            connection.sendall(request)
+            reply = _receive_message(connection)
+        except OSError as err:
+            logger.debug("not using autobuild server %s: %s" % (path, err))
+            return None
+        if 'error' in reply:
+            # e.g. a server for another version of autobuild
+            logger.debug("not using autobuild server %s: %s" % (path, reply['error']))
+            return None
+        # the command is running: from here on, it's the server's to finish
+        while True:
+            try:
+                return _receive_message(connection)['status']
+            except KeyboardInterrupt:
+                # we got the terminal's interrupt, the command didn't
+                connection.sendall(_INTERRUPT)
+            except (OSError, ValueError, KeyError) as err:
+                raise ServerError("lost autobuild server %s: %s" % (path, err))
+
+
+def stop_server(path):
+    """
+    Ask the server listening on path to exit once its current requests are
+    done. Returns False if there is no server there.
+    """
+    try:
+        connection = _connect(path)
+    except OSError:
+        return False
+    with connection:
+        connection.sendmsg([_HEADER.pack(0)])
+        try:
+            _receive_message(connection)
+        except (OSError, ValueError):
+            pass
+    return True
+
+
+# ****************************************************************************
+#   server
+# ****************************************************************************
+def _warm_caches():
+    """
+    The in-memory caches a request's child hands back to the server: a dict
+    of name: dict of entries.
+    """
+    from autobuild import config_cache
+    from autobuild.autobuild_tool_source_environment import _environment_cache
+    return dict(config=config_cache.entries, environment=_environment_cache.entries)
+
+
+def _preload():
+    # import every tool, and everything they import, once and for all
+    import importlib
+
+    from autobuild.autobuild_main import TOOLS
+    for name in TOOLS:
+        importlib.import_module('autobuild.autobuild_tool_' + name)
+
+
+def _reset_process_state(request):
+    """
+    In the child serving request, discard state the server process picked up
+    from its own environment and command line.
+    """
+    global _serving
+    _serving = True
+    os.environ.clear()
+    os.environ.update(request['environment'])
+    os.chdir(request['cwd'])
+    os.umask(request['umask'])
+    sys.argv = request['argv']
+
+    from autobuild import configfile, tracing
+
+    # captured from the environment when these modules were imported
+    common._AUTOBUILD_PLATFORM_OVERRIDE = os.environ.get('AUTOBUILD_PLATFORM_OVERRIDE')
+    common._AUTOBUILD_PLATFORM = os.environ.get('AUTOBUILD_PLATFORM')
+    configfile.AUTOBUILD_CONFIG_FILE = os.environ.get("AUTOBUILD_CONFIG_FILE", "autobuild.xml")
+    # set by the server's own 'autobuild server' command
+    common.Platform = None
+    common._build_dir = None
+    tracing._recorder = None
+    autobuild_logger = logging.getLogger('autobuild')
+    for handler in list(autobuild_logger.handlers):
+        autobuild_logger.removeHandler(handler)
+    autobuild_logger.setLevel(logging.NOTSET)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def _run_command():
+    """
+    Run the autobuild command described by sys.argv, as the autobuild script
+    would, and return its exit status.
+    """
+    from autobuild import autobuild_main
+    try:
+        autobuild_main.main()
+        return 0
+    except SystemExit as exit:
+        if exit.code is None:
+            return 0
+        if isinstance(exit.code, int):
+            return exit.code
+        print(exit.code, file=sys.stderr)
+        return 1
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+def _watch_for_interrupt(connection, finished):
+    # the client writes to (or closes) the connection only if interrupted
+    try:
+        connection.recv(1)
+    except OSError:
+        pass
+    if not finished.is_set():
+        os.kill(os.getpid(), signal.SIGINT)
+
+
+def _serve_request(connection, request, streams, cache_pipe):
+    """
+    In the child forked for request: run the command and report its status to
+    the client and its cache entries to the server. Never returns.
+    """
+    status = 1
+    try:
+        for stream, fd in zip(_STREAMS, streams):
+            os.dup2(fd, stream)
+            os.close(fd)
+        _reset_process_state(request)
+        finished = threading.Event()
+        threading.Thread(target=_watch_for_interrupt, args=(connection, finished), daemon=True).start()
+        status = _run_command()
+        finished.set()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        with os.fdopen(cache_pipe, 'wb') as pipe:
+            pickle.dump(_warm_caches(), pipe, protocol=pickle.HIGHEST_PROTOCOL)
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+    finally:
+        try:
+            _send_message(connection, dict(status=status))
+        finally:
+            os._exit(0)
+
+
+class _Child(object):
+    def __init__(self, pid, pipe):
+        self.pid = pid
+        self.pipe = pipe
+        self.data = bytearray()
+
+
+class Server(object):
+    """
+    Listen on the Unix socket at path, serving each request in a child
+    process, until stopped or until idle_timeout seconds (if not None) pass
+    without a request.
+    """
+    def __init__(self, path, idle_timeout=None):
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.children = {}
+        self.stopping = False
+        self.selector = selectors.DefaultSelector()
+        self.caches = None
+
+    def listen(self):
+        if os.path.exists(self.path):
+            try:
+                _connect(self.path).close()
+            except OSError:
+                # left behind by a server that didn't get to clean up
+                os.remove(self.path)
+            else:
+                raise ServerError("an autobuild server is already listening on %s" % self.path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            self.listener.bind(self.path)
+        finally:
+            os.umask(old_umask)
+        self.listener.listen(64)
+        self.selector.register(self.listener, selectors.EVENT_READ)
+
+    def serve(self):
+        _preload()
+        self.caches = _warm_caches()
+        self.listen()
+        logger.warning("autobuild server %s listening on %s" % (common.AUTOBUILD_VERSION_STRING, self.path))
+        last_activity = time.monotonic()
+        try:
+            while not (self.stopping and not self.children):
+                if self.idle_timeout and not self.children and \
+                   time.monotonic() - last_activity > self.idle_timeout:
+                    logger.warning("autobuild server idle for %s seconds: exiting" % self.idle_timeout)
+                    break
+                for key, events in self.selector.select(timeout=1):
+                    if key.fileobj is self.listener:
+                        self._accept()
+                    else:
+                        self._read_child(key.data)
+                    last_activity = time.monotonic()
+        finally:
+            self.close()
+
+    def close(self):
+        self.selector.close()
+        self.listener.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def _accept(self):
+        connection, _ = self.listener.accept()
+        with connection:
+            # a request arrives all at once: don't let a stuck client hold up
+            # the others
+            connection.settimeout(_REQUEST_TIMEOUT)
+            try:
+                self._check_peer(connection)
+                size, streams = self._receive_header(connection)
+                if not size:
+                    logger.warning("autobuild server stopping")
+                    self.stopping = True
+                    # new clients run their commands themselves
+                    self.selector.unregister(self.listener)
+                    self.listener.close()
+                    os.remove(self.path)
+                    _send_message(connection, dict(status=0))
+                    return
+                try:
+                    request = json.loads(_receive_exactly(connection, size).decode('utf-8'))
+                    if self.stopping:
+                        _send_message(connection, dict(error="server stopping"))
+                    elif request.get('version') != common.AUTOBUILD_VERSION_STRING:
+                        _send_message(connection, dict(
+                            error="server runs autobuild %s" % common.AUTOBUILD_VERSION_STRING))
+                    else:
+                        self._fork(connection, request, streams)
+                finally:
+                    for fd in streams:
+                        os.close(fd)
+            except (OSError, ValueError, ServerError) as err:
+                logger.warning("autobuild server dropped request: %s" % err)
+
+    def _check_peer(self, connection):
+        # the socket is only accessible to us anyway; where the platform
+        # says who is calling, check that too
+        if not hasattr(socket, 'SO_PEERCRED'):
+            return
+        credentials = struct.Struct('3i')
+        pid, uid, gid = credentials.unpack(
+            connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, credentials.size))
+        if uid != os.getuid():
+            raise ServerError("request from uid %s refused" % uid)
+
+    def _receive_header(self, connection):
+        fd_size = array.array('i').itemsize
+        header, ancillary, flags, address = connection.recvmsg(
+            _HEADER.size, socket.CMSG_SPACE(len(_STREAMS) * fd_size))
+        streams = array.array('i')
+        for level, type, data in ancillary:
+            if level == socket.SOL_SOCKET and type == socket.SCM_RIGHTS:
+                streams.frombytes(data[:len(data) - (len(data) % fd_size)])
+        if len(header) != _HEADER.size:
+            for fd in streams:
+                os.close(fd)
+            raise ServerError("truncated request")
+        size, = _HEADER.unpack(header)
+        if size and len(streams) != len(_STREAMS):
+            for fd in streams:
+                os.close(fd)
+            raise ServerError("request without standard streams")
+        return size, list(streams)
+
+    def _fork(self, connection, request, streams):
+        logger.info("serving %s in %s" % (' '.join(request['argv'][1:]), request['cwd']))
+        _send_message(connection, dict(accepted=True))
+        read_end, write_end = os.pipe()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_end)
+            for other in self.children.values():
+                os.close(other.pipe)
+            self.selector.close()
+            self.listener.close()
+            connection.settimeout(None)
+            _serve_request(connection, request, streams, write_end)
+        os.close(write_end)
+        child = _Child(pid, read_end)
+        self.children[pid] = child
+        self.selector.register(read_end, selectors.EVENT_READ, child)
+
+    def _read_child(self, child):
+        data = os.read(child.pipe, 65536)
+        if data:
+            child.data.extend(data)
+            return
+        self.selector.unregister(child.pipe)
+        os.close(child.pipe)
+        os.waitpid(child.pid, 0)
+        del self.children[child.pid]
+        if not child.data:
+            return
+        try:
+            caches = pickle.loads(bytes(child.data))
+        except Exception as err:
+            logger.warning("ignoring cache entries from request: %s" % err)
+            return
+        for name, entries in caches.items():
+            self.caches[name].update(entries)
@@ -0,0 +1,226 @@
+"""
+Phase-level tracing of autobuild runs.
+
+Run autobuild with --trace FILE (or with AUTOBUILD_TRACE=FILE in the
+environment) to record how long each phase of the run takes -- download,
+hash verification, extraction, configuration parsing and saving, build
+commands, packaging -- as a Chrome trace-event JSON file, which can be
+loaded into chrome://tracing or https://ui.perfetto.dev.
+
+Functions are instrumented with the @traced decorator, or with a span()
+block. When tracing is off either costs one attribute test per call.
+
+autobuild invocations nested inside a traced run (e.g. by a build script)
+are traced too: Executable passes the trace file, the trace id and the
+calling span to its child through the environment (see
+child_environment()). Each nested invocation writes its events to a
+fragment file beside the trace file, and the outermost invocation merges
+them all into the trace when it finishes. Flow events link each nested
+invocation to the command that launched it.
+"""
+
+import functools
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger('autobuild.tracing')
+
+# the trace file to write; setting it enables tracing
+TRACE_ENV = "AUTOBUILD_TRACE"
+# identifies the outermost invocation's trace, for nested invocations
+TRACE_ID_ENV = "AUTOBUILD_TRACE_ID"
+# the flow id of the span that launched a nested invocation
+TRACE_PARENT_ENV = "AUTOBUILD_TRACE_PARENT"
+
+
+class _Recorder(object):
+    """
+    The events recorded by one traced autobuild invocation.
+    """
+    def __init__(self, path, trace_id, parent):
+        self.path = path
+        self.trace_id = trace_id
+        self.parent = parent
+        self.pid = os.getpid()
+        self.events = []
+        self.span_ids = itertools.count(1)
+        self.local = threading.local()
+
+    def stack(self):
+        try:
+            return self.local.stack
+        except AttributeError:
+            self.local.stack = []
+            return self.local.stack
+
+    def add(self, phase, name, ts, **fields):
+        event = dict(ph=phase, name=name, ts=ts, pid=self.pid, tid=_thread_id())
+        event.update(fields)
+        # list.append() is atomic: no lock needed between threads
+        self.events.append(event)
+
+
+_recorder = None
+
+
+def _now():
+    # microseconds since the epoch: comparable between processes, as the
+    # events of nested invocations must be
+    return time.time_ns() // 1000
+
+
+def _thread_id():
+    return threading.get_native_id() if hasattr(threading, 'get_native_id') else threading.get_ident()
+
+
+def is_enabled():
+    return _recorder is not None
+
+
+@contextmanager
+def span(name, category="autobuild", **args):
+    """
+    Record the time spent in the body of the with block as a span called
+    name, with args (if any) shown as its details.
+    """
+    recorder = _recorder
+    if recorder is None:
+        yield
+        return
+    span_id = next(recorder.span_ids)
+    stack = recorder.stack()
+    stack.append(span_id)
+    start = _now()
+    try:
+        yield
+    finally:
+        stack.pop()
+        recorder.add("X", name, start, dur=_now() - start, cat=category,
+                     args=dict(args, span=span_id))
+
+
+def traced(name=None, category="autobuild"):
+    """
+    Decorator recording each call of the decorated function as a span called
+    name (by default, the function's qualified name).
+    """
+    def decorate(func):
+        span_name = name or "%s.%s" % (func.__module__.rsplit('.', 1)[-1], func.__qualname__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwds):
+            if _recorder is None:
+                return func(*args, **kwds)
+            with span(span_name, category):
+                return func(*args, **kwds)
+        return wrapper
+    return decorate
+
+
+def child_environment(environment):
+    """
+    Return environment, for a child process, with what a nested autobuild
+    invocation needs to add its events to this trace; and record a flow
+    event from the current span to that child. Returns environment itself
+    when tracing is off.
+    """
+    recorder = _recorder
+    if recorder is None:
+        return environment
+    stack = recorder.stack()
+    flow_id = "%s.%s" % (recorder.pid, stack[-1] if stack else 0)
+    recorder.add("s", "autobuild", _now(), cat="invocation", id=flow_id)
+    environment = dict(environment)
+    environment[TRACE_ENV] = recorder.path
+    environment[TRACE_ID_ENV] = recorder.trace_id
+    environment[TRACE_PARENT_ENV] = flow_id
+    return environment
+
+
+@contextmanager
+def session(path, name):
+    """
+    Trace the body of the with block, as one autobuild invocation called
+    name, into the Chrome trace file path. If path is empty, tracing is off
+    and this does nothing.
+    """
+    global _recorder
+    if not path or _recorder is not None:
+        yield
+        return
+    path = os.path.abspath(path)
+    trace_id = os.environ.get(TRACE_ID_ENV)
+    outermost = not trace_id
+    if outermost:
+        import uuid
+        trace_id = uuid.uuid4().hex
+    recorder = _Recorder(path, trace_id, os.environ.get(TRACE_PARENT_ENV))
+    recorder.add("M", "process_name", 0, args=dict(name=name))
+    if recorder.parent:
+        recorder.add("f", "autobuild", _now(), cat="invocation", id=recorder.parent, bp="e")
+    _recorder = recorder
+    try:
+        with span(name, "invocation", argv=sys.argv, cwd=os.getcwd()):
+            yield
+    finally:
+        _recorder = None
+        try:
+            if outermost:
+                _write_trace(recorder)
+            else:
+                _write_fragment(recorder)
+        except (OSError, ValueError) as err:
+            # tracing must never break the run it is tracing
+            logger.warning("unable to write trace %s: %s" % (path, err))
+
+
+def _fragment_dir(path):
+    return path + ".parts"
+
+
+def _write_fragment(recorder):
+    directory = _fragment_dir(recorder.path)
+    os.makedirs(directory, exist_ok=True)
+    fragment = os.path.join(directory, "%s.%s.json" % (recorder.trace_id, recorder.pid))
+    _write_json(fragment, recorder.events)
+
+
+def _write_trace(recorder):
+    events = list(recorder.events)
+    directory = _fragment_dir(recorder.path)
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        names = []
+    for fragment_name in sorted(names):
+        if not fragment_name.startswith(recorder.trace_id + "."):
+            continue
+        fragment = os.path.join(directory, fragment_name)
+        try:
+            with open(fragment) as f:
+                events.extend(json.load(f))
+            os.remove(fragment)
+        except (OSError, ValueError) as err:
+            logger.warning("ignoring trace fragment %s: %s" % (fragment, err))
+    if names:
+        try:
+            os.rmdir(directory)
+        except OSError:
+            # someone else's fragments are still there
+            pass
+    _write_json(recorder.path, dict(traceEvents=events, displayTimeUnit="ms",
+                                    otherData=dict(trace_id=recorder.trace_id)))
+    logger.info("wrote trace %s" % recorder.path)
+
+
+def _write_json(path, data):
+    temp_name = "%s.%s.tmp" % (path, os.getpid())
+    with open(temp_name, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_name, path)
@@ -0,0 +1 @@
+AUTOBUILD_VERSION_STRING = '0.1.dev1'
\ No newline at end of file
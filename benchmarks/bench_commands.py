@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Time autobuild commands against a synthetic package corpus (see corpus.py)
+served from a local HTTP server, and write the timings as JSON so runs can
+be compared over time.
+
+    python benchmarks/bench_commands.py [--output FILE] [--repeat N] [corpus.py options]
+
+Each command runs as 'python -m autobuild.autobuild_main' in a scratch
+project whose autobuild.xml installs the whole corpus, with its own install
+cache, and with the config cache and resident server off unless noted.
+Readings:
+
+  install (cold)        install everything: empty install cache, so every
+                        archive is downloaded, verified and extracted
+  install (warm)        the same with the archives already in the cache
+  install (no-op)       install again when everything is already installed
+  uninstall             uninstall every package
+  package               package a staged build directory of corpus-sized
+                        files (metadata listing every corpus dependency)
+  config load (parse)   ConfigurationDescription of the project's
+                        autobuild.xml, in this process, config cache off
+  config load (cached)  the same from the config cache
+  graph                 graph --type mermaid of the last package's archive
+  graph index (cold)    graph --archives of the install cache, no index yet
+  graph index (warm)    graph --archives --dependents-of on the first
+                        package, with the index up to date
+
+The JSON results record, for each reading, every sample and the best and
+median, in seconds, with the corpus parameters and the autobuild version.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import corpus
+
+from autobuild import common, config_cache, configfile
+
+
+class Project(object):
+    """
+    A scratch project (directory) installing corpus from server_url, run with
+    a private install cache.
+    """
+    def __init__(self, directory, packages, server_url, files, file_size):
+        self.directory = directory
+        self.packages = packages
+        self.cache = os.path.join(directory, "cache")
+        self.config_path = os.path.join(directory, configfile.AUTOBUILD_CONFIG_FILE)
+        corpus.write_config(self.config_path, packages, server_url)
+        self.environment = dict(os.environ)
+        for name in ("AUTOBUILD_SERVER", "AUTOBUILD_TRACE", "AUTOBUILD_CONFIG_FILE"):
+            self.environment.pop(name, None)
+        self.environment.update(AUTOBUILD_INSTALLABLE_CACHE=self.cache,
+                                AUTOBUILD_CONFIG_CACHE="false",
+                                AUTOBUILD_BUILD_ID="1")
+        self._stage(files, file_size)
+
+    def _stage(self, files, file_size):
+        # what 'autobuild build' would leave for 'autobuild package'
+        stage = os.path.join(self.directory, "stage")
+        corpus.write_files(stage, "consumer", files, file_size, random.Random(1))
+        os.makedirs(os.path.join(stage, "LICENSES"), exist_ok=True)
+        with open(os.path.join(stage, "LICENSES", "consumer.txt"), 'w') as f:
+            f.write("consumer license\n")
+        metadata = configfile.MetadataDescription(path=self.metadata_path(), create_quietly=True)
+        metadata.build_id = "1"
+        metadata.platform = common.get_current_platform()
+        metadata.configuration = "Release"
+        metadata.package_description = configfile.PackageDescription(dict(
+            name="consumer", version="1.0", license="MIT", license_file="LICENSES/consumer.txt",
+            copyright="Copyright (c) example"))
+        metadata.save()
+
+    def metadata_path(self):
+        return os.path.join(self.directory, "stage", configfile.PACKAGE_METADATA_FILE)
+
+    def installed_path(self):
+        return os.path.join(self.directory, "stage", "packages", configfile.INSTALLED_CONFIG_FILE)
+
+    def record_dependencies(self):
+        # as 'autobuild build' does, once the dependencies are installed
+        metadata = configfile.MetadataDescription(path=self.metadata_path())
+        metadata.add_dependencies(self.installed_path())
+        metadata.save()
+
+    def autobuild(self, *args):
+        result = subprocess.run([sys.executable, "-m", "autobuild.autobuild_main"] + list(args),
+                                cwd=self.directory, env=self.environment,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if result.returncode:
+            raise SystemExit("autobuild %s failed:\n%s%s" % (" ".join(args), result.stdout, result.stderr))
+        return result.stdout
+
+    def clear_cache(self):
+        shutil.rmtree(self.cache, ignore_errors=True)
+        os.makedirs(self.cache)
+
+    def uninstall_all(self):
+        # uninstall fails if nothing was ever installed
+        if os.path.exists(self.installed_path()):
+            self.autobuild("uninstall", *[package['name'] for package in self.packages])
+
+    def remove_packaged(self):
+        for name in os.listdir(self.directory):
+            if name.startswith("consumer-"):
+                os.remove(os.path.join(self.directory, name))
+
+
+def measure(function, repeat, setup=None):
+    """Run function repeat times, after setup() each time; returns the samples"""
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def load_config(path):
+    # as a new autobuild process would: nothing already loaded in memory
+    config_cache.entries.clear()
+    return configfile.ConfigurationDescription(path)
+
+
+def run(project, repeat):
+    """Return a list of (reading, samples) in the order of the docstring"""
+    first, last = project.packages[0], project.packages[-1]
+    last_archive = os.path.join(project.cache, last['archive'])
+    previous = os.environ.get(config_cache.CONFIG_CACHE_ENV)
+    readings = []
+
+    def reading(name, samples):
+        readings.append((name, samples))
+        print("  %-22s %9.1f ms" % (name, min(samples) * 1000), flush=True)
+
+    def cold_install():
+        project.uninstall_all()
+        project.clear_cache()
+
+    reading("install (cold)", measure(lambda: project.autobuild("install"), repeat, cold_install))
+    reading("install (warm)", measure(lambda: project.autobuild("install"), repeat, project.uninstall_all))
+    reading("install (no-op)", measure(lambda: project.autobuild("install"), repeat))
+    reading("uninstall", measure(project.uninstall_all, repeat, lambda: project.autobuild("install")))
+    project.autobuild("install")
+    project.record_dependencies()
+    reading("package", measure(lambda: project.autobuild("package"), repeat, project.remove_packaged))
+    try:
+        os.environ[config_cache.CONFIG_CACHE_ENV] = "false"
+        reading("config load (parse)", measure(lambda: load_config(project.config_path), repeat))
+        os.environ[config_cache.CONFIG_CACHE_ENV] = "true"
+        load_config(project.config_path)
+        reading("config load (cached)", measure(lambda: load_config(project.config_path), repeat))
+    finally:
+        if previous is None:
+            del os.environ[config_cache.CONFIG_CACHE_ENV]
+        else:
+            os.environ[config_cache.CONFIG_CACHE_ENV] = previous
+    reading("graph", measure(lambda: project.autobuild("graph", "--type", "mermaid", last_archive), repeat))
+
+    index_file = os.path.join(project.directory, "package-index.json")
+
+    def remove_index():
+        if os.path.exists(index_file):
+            os.remove(index_file)
+    reading("graph index (cold)",
+            measure(lambda: project.autobuild("graph", "--archives", project.cache, "--index", index_file,
+                                              "--type", "mermaid"), repeat, remove_index))
+    reading("graph index (warm)",
+            measure(lambda: project.autobuild("graph", "--archives", project.cache, "--index", index_file,
+                                              "--dependents-of", first['name']), repeat))
+    return readings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    corpus.add_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', '-o', default=None,
+                        help='write the results to this JSON file (default: only print them)')
+    parser.add_argument('--keep', default=None, metavar='DIRECTORY',
+                        help='build the corpus and project in DIRECTORY, and leave them there')
+    args = parser.parse_args()
+
+    directory = args.keep or tempfile.mkdtemp(prefix="autobuild-bench-")
+    try:
+        corpus_dir = os.path.join(directory, "corpus")
+        start = time.perf_counter()
+        packages = corpus.generate_from_args(corpus_dir, args)
+        archive_bytes = sum(os.path.getsize(os.path.join(corpus_dir, package['archive']))
+                            for package in packages)
+        print("corpus: %d packages x %d files, %.1f MB of archives (generated in %.1f s)" %
+              (len(packages), args.files, archive_bytes / 1e6, time.perf_counter() - start), flush=True)
+        with corpus.CorpusServer(corpus_dir) as server:
+            project_dir = os.path.join(directory, "project")
+            os.makedirs(project_dir, exist_ok=True)
+            project = Project(project_dir, packages, server.url, args.files, args.file_size)
+            readings = run(project, args.repeat)
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    results = dict(
+        autobuild_version=common.AUTOBUILD_VERSION_STRING,
+        python=platform.python_version(),
+        platform=common.get_current_platform(),
+        cpu_count=os.cpu_count(),
+        time=time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        corpus=dict(packages=args.packages, files=args.files, file_size=list(args.file_size),
+                    formats=list(args.formats), fan_in=args.fan_in, hash_algorithm=args.hash_algorithm,
+                    seed=args.seed, archive_bytes=archive_bytes),
+        repeat=args.repeat,
+        results={name: dict(best=min(samples), median=statistics.median(samples), samples=samples)
+                 for name, samples in readings})
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print("wrote %s" % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Throughput of Executable output filtering on a chatty child process.
+
+    python benchmarks/bench_executable_filter.py [--lines N] [--filters N] [--repeat N]
+
+The child writes N compiler-like lines; our stdout is redirected to
+/dev/null for the duration so that terminal speed does not dominate.
+Readings:
+
+  subprocess.call      unfiltered: the child writes straight to our stdout
+  per-line loop        the previous filter loop: every line against every
+                       regex, one print() per line
+  filtered             Executable with filters (the _OutputFilter engine)
+  filtered + prefixed  the same with an output prefix, as
+                       build --parallel-configurations uses
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+from autobuild.executable import Executable
+
+CHILD = """
+import sys
+out = sys.stdout.buffer
+line = b"%s"
+for i in range(%d):
+    out.write(line %% i)
+"""
+
+
+def child_command(lines):
+    line = rb"src/module/file%06d.cpp(123): warning C4996: 'strcpy': This function may be unsafe\n"
+    return [sys.executable, "-c", CHILD % (line.decode(), lines)]
+
+
+def previous_loop(command, filters):
+    # the filter loop Executable used before, with its str/bytes mismatch
+    # corrected so that it can run at all
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    filters_re = [re.compile(filter.encode(), re.MULTILINE) for filter in filters]
+    out = sys.stdout.buffer
+    for line in process.stdout:
+        if any(regex.search(line) for regex in filters_re):
+            continue
+        line = line.replace(b"\r\n", b"\n")
+        line = line.replace(b"\r", b"\n")
+        out.write(line)
+        out.flush()
+    return process.wait()
+
+
+def measure(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lines', type=int, default=500000)
+    parser.add_argument('--filters', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    command = child_command(args.lines)
+    # realistic filters, of which only the last ever matches
+    filters = ["^note: unused filter %d" % i for i in range(args.filters - 1)] + ["file0+1\\.cpp"]
+    executable = Executable(command=command[0], options=command[1:], filters=filters)
+    cases = (
+        ("subprocess.call", lambda: subprocess.call(command)),
+        ("per-line loop", lambda: previous_loop(command, filters)),
+        ("filtered", lambda: executable()),
+        ("filtered + prefixed", lambda: executable(output_prefix="[Release] ")),
+    )
+
+    results = []
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    try:
+        for name, function in cases:
+            sys.stdout.flush()
+            os.dup2(devnull, 1)
+            try:
+                elapsed = measure(function, args.repeat)
+            finally:
+                sys.stdout.flush()
+                os.dup2(saved, 1)
+            results.append((name, elapsed))
+    finally:
+        os.close(devnull)
+        os.close(saved)
+
+    print("%d lines, %d filters" % (args.lines, len(filters)))
+    for name, elapsed in results:
+        print("  %-20s %8.1f ms   %6.1f Mlines/s" % (name, elapsed * 1000, args.lines / elapsed / 1e6))
+
+
+if __name__ == '__main__':
+    main()
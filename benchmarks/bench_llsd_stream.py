@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Compare llsd.parse() with autobuild.llsd_stream.parse() on a synthetic
+installed-packages.xml: parse time, and peak traced memory.
+
+    python benchmarks/bench_llsd_stream.py [--packages N] [--files N] [--repeat N]
+
+Three readings are reported for each document format (the original list
+manifests and the front-coded manifests written today):
+
+  llsd.parse         the previous Dependencies load path
+  stream (lazy)      llsd_stream with manifests left unparsed, as used by
+                     queries like --list-installed or --versions
+  stream (touched)   llsd_stream, then every manifest materialized
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import llsd
+
+from autobuild import configfile, llsd_stream
+
+
+def make_document(packages, files, encode_manifests):
+    dependencies = {}
+    for p in range(packages):
+        name = "package%04d" % p
+        paths = ["include/%s/" % name] + \
+                ["include/%s/module%03d/header%05d.h" % (name, f // 50, f) for f in range(files)]
+        manifest = configfile.CompactManifest(paths)
+        dependencies[name] = dict(
+            version="2", type="metadata", build_id="12345%d" % p, platform="linux64",
+            configuration="Release", install_dir="packages", install_type="package",
+            package_description=dict(name=name, version="1.%d" % p, license="MIT",
+                                     license_file="LICENSES/%s.txt" % name,
+                                     copyright="Copyright (c) example"),
+            archive=dict(url="https://example.com/%s-1.%d-linux64-12345.tar.zst" % (name, p),
+                         hash="0" * 32, hash_algorithm="md5"),
+            manifest=manifest.to_llsd() if encode_manifests else list(manifest))
+    return llsd.format_pretty_xml(dict(version=configfile.AUTOBUILD_INSTALLED_VERSION,
+                                       type=configfile.AUTOBUILD_INSTALLED_TYPE,
+                                       dependencies=dependencies))
+
+
+def measure(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    result = function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return best, peak
+
+
+def touch_manifests(parsed):
+    for package in parsed['dependencies'].values():
+        len(package['manifest'])
+    return parsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--packages', type=int, default=100)
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for label, encode in (("list manifests", False), ("front-coded manifests", True)):
+        document = make_document(args.packages, args.files, encode)
+        print("%s: %d packages x %d files, %.1f MB" %
+              (label, args.packages, args.files, len(document) / 1e6))
+        cases = (
+            ("llsd.parse", lambda: llsd.parse(document)),
+            ("stream (lazy)", lambda: llsd_stream.parse(document, lazy=configfile._LAZY_MANIFESTS)),
+            ("stream (touched)", lambda: touch_manifests(
+                llsd_stream.parse(document, lazy=configfile._LAZY_MANIFESTS))),
+        )
+        for name, function in cases:
+            elapsed, peak = measure(function, args.repeat)
+            print("  %-18s %8.1f ms   peak %8.1f MB" % (name, elapsed * 1000, peak / 1e6))
+
+
+if __name__ == '__main__':
+    main()
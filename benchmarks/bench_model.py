@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the configuration model: load, copy, attribute access
+and save of a synthetic autobuild.xml.
+
+    python benchmarks/bench_model.py [--installables N] [--platforms N] [--repeat N]
+
+Readings:
+
+  load (parse)         ConfigurationDescription from the file, config cache off
+  load (cached)        ConfigurationDescription from the config cache
+  copy (constructors)  the previous copy(): rebuild every object via __init__
+  copy                 Serialized.copy(): structural clone
+  copy + expand        copy(), then expand_platform_vars() for one platform,
+                       as each build configuration used to
+  copy_on_write + expand
+                       the same with copy_on_write(), as each build
+                       configuration does now
+  attribute (field)    reading a key listed in 'fields' as an attribute
+  attribute (other)    reading any other key as an attribute (__getattr__)
+  save                 compact_to_dict() and LLSD formatting, as save() does
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import llsd
+
+from autobuild import config_cache, configfile
+from autobuild.executable import Executable
+
+PLATFORMS = ("common", "darwin64", "linux64", "windows", "windows64")
+
+
+def make_package(name, platforms):
+    package = configfile.PackageDescription(name)
+    package.license = "MIT"
+    package.license_file = "LICENSES/%s.txt" % name
+    package.copyright = "Copyright (c) example"
+    package.version_file = "VERSION.txt"
+    for platform_name in PLATFORMS[:platforms]:
+        platform = configfile.PlatformDescription()
+        platform.name = platform_name
+        platform.build_directory = "build-%s" % platform_name
+        platform.archive = configfile.ArchiveDescription(dict(
+            url="https://example.com/%s-1.0-%s.tar.zst" % (name, platform_name),
+            hash="0" * 32, hash_algorithm="md5"))
+        for configuration_name in ("Debug", "Release"):
+            configuration = configfile.BuildConfigurationDescription()
+            configuration.name = configuration_name
+            configuration.configure = Executable(command="cmake", options=["-DCONFIG=%s" % configuration_name])
+            configuration.build = Executable(command="make", options=["-j$AUTOBUILD_CPU_COUNT"])
+            platform.configurations[configuration_name] = configuration
+        package.platforms[platform_name] = platform
+    return package
+
+
+def make_config(path, installables, platforms):
+    config = configfile.ConfigurationDescription(path)
+    config.package_description = make_package("example", platforms)
+    for i in range(installables):
+        name = "package%04d" % i
+        config.installables[name] = make_package(name, platforms)
+    config.save()
+    config_cache.invalidate(config.path)
+    return config.path
+
+
+def measure(function, repeat, number=1):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = (time.perf_counter() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def read_attributes(config, name):
+    for package in config.installables.values():
+        for platform in package.platforms.values():
+            getattr(platform, name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--installables', type=int, default=200)
+    parser.add_argument('--platforms', type=int, default=len(PLATFORMS))
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_config(os.path.join(tmp, "autobuild.xml"), args.installables, args.platforms)
+        print("%d installables x %d platforms, %.1f MB" %
+              (args.installables, args.platforms, os.path.getsize(path) / 1e6))
+
+        os.environ[config_cache.CONFIG_CACHE_ENV] = "false"
+        parse = measure(lambda: configfile.ConfigurationDescription(path), args.repeat)
+        del os.environ[config_cache.CONFIG_CACHE_ENV]
+        configfile.ConfigurationDescription(path)
+        cached = measure(lambda: configfile.ConfigurationDescription(path), args.repeat)
+
+        config = configfile.ConfigurationDescription(path)
+        accesses = args.installables * args.platforms
+        # an extra key, not listed in PlatformDescription.fields
+        for package in config.installables.values():
+            for platform in package.platforms.values():
+                platform.extra = None
+        cases = (
+            ("load (parse)", parse),
+            ("load (cached)", cached),
+            ("copy (constructors)", measure(
+                lambda: configfile.ConfigurationDescription(path=None, copyfrom=config), args.repeat)),
+            ("copy", measure(config.copy, args.repeat)),
+            ("copy + expand", measure(
+                lambda: config.copy().expand_platform_vars(
+                    dict(AUTOBUILD_CPU_COUNT="8"), platform="linux64"), args.repeat)),
+            ("copy_on_write + expand", measure(
+                lambda: config.copy_on_write().expand_platform_vars(
+                    dict(AUTOBUILD_CPU_COUNT="8"), platform="linux64"), args.repeat)),
+            ("attribute (field)", measure(lambda: read_attributes(config, 'build_directory'),
+                                          args.repeat, 100) / accesses),
+            ("attribute (other)", measure(lambda: read_attributes(config, 'extra'),
+                                          args.repeat, 100) / accesses),
+            ("save", measure(lambda: llsd.format_pretty_xml(configfile.compact_to_dict(config)),
+                             args.repeat)),
+        )
+        for name, elapsed in cases:
+            if name.startswith("attribute"):
+                print("  %-24s %8.0f ns/access" % (name, elapsed * 1e9))
+            else:
+                print("  %-24s %8.3f ms" % (name, elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Generate a synthetic corpus of autobuild packages, and serve it over HTTP.
+
+    python benchmarks/corpus.py DIRECTORY [--packages N] [--files N] [--file-size MIN[:MAX]]
+                                [--formats gz,bz2,zst,zip] [--fan-in N] [--serve]
+
+Each package archive holds --files files of --file-size bytes (half random,
+half zeros, so they compress about as well as typical build output), a
+license file and an autobuild-package.xml. The archives cycle through the
+--formats. Each package depends on up to --fan-in of the packages generated
+before it, so the early packages are the common dependencies of many others,
+and its metadata carries their metadata as 'autobuild package' would.
+
+write_config() writes an autobuild.xml with every package as an installable
+downloaded from a CorpusServer, which serves the corpus from a local HTTP
+server on an ephemeral port. bench_commands.py uses these to time autobuild
+commands; run this script on its own to inspect (or --serve) a corpus.
+"""
+
+import argparse
+import functools
+import os
+import random
+import re
+import tarfile
+import threading
+import time
+import zipfile
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from autobuild import archive_utils, common, configfile, hash_algorithms
+
+FORMATS = dict(gz=".tar.gz", bz2=".tar.bz2", zst=".tar.zst", zip=".zip")
+PLATFORM = common.PLATFORM_COMMON
+
+
+def parse_size(text):
+    """'65536', '64k' or '1M' -> bytes"""
+    match = re.match(r'^(\d+)([kKmM]?)$', text.strip())
+    if not match:
+        raise argparse.ArgumentTypeError("bad size %r" % text)
+    return int(match.group(1)) * {'': 1, 'k': 1 << 10, 'm': 1 << 20}[match.group(2).lower()]
+
+
+def parse_size_range(text):
+    """'MIN[:MAX]' -> (min, max) bytes"""
+    sizes = [parse_size(part) for part in text.split(':', 1)]
+    return sizes[0], sizes[-1]
+
+
+def write_files(directory, name, files, file_size, rng):
+    """
+    Write files files for package name under directory, sized between the
+    bounds of file_size; returns their paths relative to directory.
+    """
+    paths = []
+    for number in range(files):
+        path = "%s/%s/file%05d.%s" % ("lib" if number % 4 == 0 else "include", name, number,
+                                      "a" if number % 4 == 0 else "h")
+        size = rng.randint(*file_size)
+        full_path = os.path.join(directory, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'wb') as f:
+            f.write(os.urandom(size // 2))
+            f.write(bytes(size - size // 2))
+        paths.append(path)
+    return paths
+
+
+def _write_archive(archive_path, source_dir, paths):
+    if archive_path.endswith(".zip"):
+        with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for path in paths:
+                archive.write(os.path.join(source_dir, path), path)
+        return
+    if archive_path.endswith(".tar.zst"):
+        archive = archive_utils.ZstdTarFile(archive_path, 'w')
+    else:
+        archive = tarfile.open(archive_path, 'w:' + archive_path.rsplit('.', 1)[-1])
+    with archive:
+        for path in paths:
+            archive.add(os.path.join(source_dir, path), path)
+
+
+def generate(directory, packages=20, files=50, file_size=(1024, 65536), formats=tuple(FORMATS),
+             fan_in=3, hash_algorithm="md5", seed=0):
+    """
+    Generate the corpus in directory. Returns a list, in dependency order, of
+    one dict per package: name, version, build_id, archive (the archive's file
+    name), hash, hash_algorithm and dependencies (names).
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    corpus = []
+    metadata_by_name = {}
+    for number in range(packages):
+        name = "pkg%04d" % number
+        version = "1.%d.%d" % (number % 7, number)
+        build_id = str(100000 + number)
+        dependencies = sorted(rng.sample([package['name'] for package in corpus], min(fan_in, len(corpus))))
+
+        source_dir = os.path.join(directory, "source", name)
+        paths = write_files(source_dir, name, files, file_size, rng)
+        license_file = "LICENSES/%s.txt" % name
+        os.makedirs(os.path.join(source_dir, "LICENSES"), exist_ok=True)
+        with open(os.path.join(source_dir, license_file), 'w') as f:
+            f.write("%s license\n" % name)
+        paths.append(license_file)
+
+        metadata = configfile.MetadataDescription(create_quietly=True)
+        metadata.path = os.path.join(source_dir, configfile.PACKAGE_METADATA_FILE)
+        metadata.build_id = build_id
+        metadata.platform = PLATFORM
+        metadata.configuration = "Release"
+        metadata.package_description = configfile.PackageDescription(dict(
+            name=name, version=version, license="MIT", license_file=license_file,
+            copyright="Copyright (c) example"))
+        metadata.manifest = list(paths)
+        metadata.dependencies = {dependency: metadata_by_name[dependency] for dependency in dependencies}
+        metadata.save()
+        paths.append(configfile.PACKAGE_METADATA_FILE)
+
+        archive = "%s-%s-%s-%s%s" % (name, version, PLATFORM, build_id,
+                                     FORMATS[formats[number % len(formats)]])
+        archive_path = os.path.join(directory, archive)
+        _write_archive(archive_path, source_dir, paths)
+        package_hash = hash_algorithms.compute_hash(hash_algorithm, archive_path)
+
+        # as installed, for the metadata of the packages that depend on this one
+        installed = configfile.MetadataDescription(create_quietly=True)
+        installed.update({key: value for key, value in metadata.items() if key not in ('path', 'manifest')})
+        installed.archive = configfile.ArchiveDescription(dict(url=archive, hash=package_hash,
+                                                               hash_algorithm=hash_algorithm))
+        metadata_by_name[name] = installed
+
+        corpus.append(dict(name=name, version=version, build_id=build_id, archive=archive,
+                           hash=package_hash, hash_algorithm=hash_algorithm, dependencies=dependencies))
+    return corpus
+
+
+def write_config(path, corpus, base_url, name="consumer", manifest=("include/*", "lib/*")):
+    """
+    Write an autobuild.xml at path for a package called name with every
+    package in corpus as an installable downloaded from base_url, and a
+    platform entry (build directory 'stage', default configuration Release)
+    for 'autobuild package' and 'autobuild uninstall' to use.
+    """
+    config = configfile.ConfigurationDescription(path)
+    config.package_description = configfile.PackageDescription(dict(
+        name=name, version="1.0", license="MIT", license_file="LICENSES/%s.txt" % name,
+        copyright="Copyright (c) example"))
+    platform = configfile.PlatformDescription()
+    platform.name = common.get_current_platform()
+    platform.build_directory = "stage"
+    platform.manifest = list(manifest)
+    configuration = configfile.BuildConfigurationDescription()
+    configuration.name = "Release"
+    configuration.default = True
+    platform.configurations[configuration.name] = configuration
+    config.package_description.platforms[platform.name] = platform
+    for package in corpus:
+        installable = configfile.PackageDescription(dict(
+            name=package['name'], version=package['version'], license="MIT",
+            license_file="LICENSES/%s.txt" % package['name'], copyright="Copyright (c) example"))
+        platform = configfile.PlatformDescription()
+        platform.name = PLATFORM
+        platform.archive = configfile.ArchiveDescription(dict(
+            url="%s/%s" % (base_url, package['archive']),
+            hash=package['hash'], hash_algorithm=package['hash_algorithm']))
+        installable.platforms[PLATFORM] = platform
+        config.installables[package['name']] = installable
+    config.save()
+    return config
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class CorpusServer(object):
+    """
+    Serve directory over HTTP from a local thread for the life of the with
+    block; url is its base URL.
+    """
+    def __init__(self, directory):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0),
+                                          functools.partial(_QuietHandler, directory=directory))
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+def add_arguments(parser):
+    parser.add_argument('--packages', type=int, default=20, help='number of packages')
+    parser.add_argument('--files', type=int, default=50, help='files in each package')
+    parser.add_argument('--file-size', type=parse_size_range, default=(1024, 65536), metavar='MIN[:MAX]',
+                        help='size of each file, e.g. 4k:1M')
+    parser.add_argument('--formats', default=",".join(FORMATS),
+                        type=lambda text: tuple(text.split(',')),
+                        help='archive formats to cycle through (gz, bz2, zst, zip)')
+    parser.add_argument('--fan-in', type=int, default=3,
+                        help='number of earlier packages each package depends on')
+    parser.add_argument('--hash-algorithm', default="md5")
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def generate_from_args(directory, args):
+    unknown = set(args.formats) - set(FORMATS)
+    if unknown:
+        raise SystemExit("unknown formats: %s" % ", ".join(sorted(unknown)))
+    return generate(directory, packages=args.packages, files=args.files, file_size=args.file_size,
+                    formats=args.formats, fan_in=args.fan_in, hash_algorithm=args.hash_algorithm,
+                    seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('directory')
+    add_arguments(parser)
+    parser.add_argument('--serve', action='store_true',
+                        help='then serve the corpus, with an autobuild.xml installing it, until interrupted')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    corpus = generate_from_args(args.directory, args)
+    size = sum(os.path.getsize(os.path.join(args.directory, package['archive'])) for package in corpus)
+    print("%d packages, %.1f MB of archives, in %.1f s" %
+          (len(corpus), size / 1e6, time.perf_counter() - start))
+    if args.serve:
+        with CorpusServer(args.directory) as server:
+            write_config(os.path.join(args.directory, "autobuild.xml"), corpus, server.url)
+            print("serving %s at %s; autobuild.xml installs it" % (args.directory, server.url))
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                pass
+
+
+if __name__ == '__main__':
+    main()
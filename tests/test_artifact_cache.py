@@ -0,0 +1,128 @@
+import os
+import sys
+
+import autobuild.common as common
+import autobuild.configfile as configfile
+from autobuild import artifact_cache
+from autobuild import autobuild_tool_build as build_tool
+from autobuild import autobuild_tool_package as package_tool
+from autobuild.common import cmd
+from autobuild.executable import Executable
+from tests.basetest import BaseTest, envvar, git_repo, needs_git, temp_dir
+
+# appends to stage/count each time it runs, and produces stage/lib/out.txt
+BUILD_SCRIPT = """
+import os
+os.makedirs('lib', exist_ok=True)
+open('count', 'a').write('x')
+open(os.path.join('lib', 'out.txt'), 'w').write('output')
+"""
+
+
+@needs_git
+class TestArtifactCache(BaseTest):
+    def setUp(self):
+        BaseTest.setUp(self)
+
+    def write_config(self, root):
+        config = configfile.ConfigurationDescription(os.path.join(root, "autobuild.xml"))
+        package = configfile.PackageDescription('cached')
+        package.license = "MIT"
+        package.license_file = "LICENSE"
+        package.copyright = "copyright"
+        package.version_file = os.path.join(os.pardir, "VERSION.txt")
+        platform = configfile.PlatformDescription()
+        platform.build_directory = "stage"
+        platform.manifest = ["lib/*"]
+        platform.archive = configfile.ArchiveDescription()
+        platform.archive.format = 'tgz'
+        build_configuration = configfile.BuildConfigurationDescription()
+        build_configuration.build = Executable(command=sys.executable, options=['-c', BUILD_SCRIPT])
+        build_configuration.default = True
+        build_configuration.name = 'Release'
+        platform.configurations['Release'] = build_configuration
+        package.platforms[common.get_current_platform()] = platform
+        config.package_description = package
+        config.save()
+        for name, contents in (("VERSION.txt", "1.0\n"), ("stage/LICENSE", "license\n")):
+            with open(os.path.join(root, name), "w") as f:
+                f.write(contents)
+        cmd("git", "add", "autobuild.xml", "VERSION.txt")
+        cmd("git", "commit", "-m", "autobuild.xml")
+        return config
+
+    def build_and_package(self, root, build_id, *package_arguments):
+        config_file = '--config-file=' + os.path.join(root, "autobuild.xml")
+        with envvar("AUTOBUILD_BUILD_ID", str(build_id)):
+            build_tool.AutobuildTool().main([config_file, '--no-configure'])
+        package_tool.AutobuildTool().main([config_file] + list(package_arguments))
+        with open(os.path.join(root, "stage", "count")) as f:
+            return len(f.read())
+
+    def test_restore(self):
+        with git_repo() as root, temp_dir() as cache, envvar(artifact_cache.ARTIFACT_CACHE_ENV, cache):
+            self.write_config(root)
+            stage = os.path.join(root, "stage")
+            self.assertEqual(self.build_and_package(root, 111), 1)
+            archives = [name for name in os.listdir(root) if name.endswith(".tar.gz")]
+            self.assertEqual(len(archives), 1)
+            self.assertIn("111", archives[0])
+
+            # everything gone but the build count: build and package restore
+            # the cached results
+            os.remove(os.path.join(root, archives[0]))
+            os.remove(os.path.join(stage, "lib", "out.txt"))
+            os.remove(os.path.join(stage, configfile.PACKAGE_METADATA_FILE))
+            self.assertEqual(self.build_and_package(root, 111), 1)
+            self.assertTrue(os.path.exists(os.path.join(root, archives[0])))
+            metadata = configfile.MetadataDescription(os.path.join(stage, configfile.PACKAGE_METADATA_FILE))
+            self.assertEqual(metadata.build_id, "111")
+            self.assertEqual(sorted(metadata.manifest), ["LICENSE", "lib/out.txt"])
+
+            # another build id restores too, renamed for that build
+            self.assertEqual(self.build_and_package(root, 222), 1)
+            metadata = configfile.MetadataDescription(os.path.join(stage, configfile.PACKAGE_METADATA_FILE))
+            self.assertEqual(metadata.build_id, "222")
+            self.assertTrue([name for name in os.listdir(root) if name.endswith(".tar.gz") and "222" in name])
+
+            # a build with another toolchain is built, but not in another terminal
+            with envvar("CC", "other-cc"):
+                self.assertEqual(self.build_and_package(root, 111), 2)
+            with envvar("TERM_SESSION_ID", "another"):
+                self.assertEqual(self.build_and_package(root, 111), 2)
+
+            # uncommitted changes: always built, never cached
+            with open(os.path.join(root, "VERSION.txt"), "w") as f:
+                f.write("1.1\n")
+            self.assertEqual(self.build_and_package(root, 333), 3)
+            self.assertFalse(os.path.exists(os.path.join(stage, artifact_cache.KEY_FILE)))
+
+    def test_restore_other_format(self):
+        with git_repo() as root, temp_dir() as cache, envvar(artifact_cache.ARTIFACT_CACHE_ENV, cache):
+            self.write_config(root)
+            stage = os.path.join(root, "stage")
+            self.assertEqual(self.build_and_package(root, 111), 1)
+            os.remove(os.path.join(stage, "lib", "out.txt"))
+
+            # the restored stage directory holds nothing to package as zip
+            with self.assertRaises(package_tool.PackageError):
+                self.build_and_package(root, 111, '--archive-format=zip')
+            self.assertFalse([name for name in os.listdir(root) if name.endswith(".zip")])
+            # and the cached tgz package is still there to restore
+            self.assertEqual(self.build_and_package(root, 111), 1)
+            self.assertTrue([name for name in os.listdir(root) if name.endswith(".tar.gz")])
+
+            # as the error suggests, building without the cache packages it
+            with envvar(artifact_cache.ARTIFACT_CACHE_ENV, "false"):
+                self.assertEqual(self.build_and_package(root, 111, '--archive-format=zip'), 2)
+
+    def test_disabled(self):
+        with git_repo() as root, envvar(artifact_cache.ARTIFACT_CACHE_ENV, None):
+            self.assertIsNone(artifact_cache.get_cache_dir())
+            self.write_config(root)
+            self.assertEqual(self.build_and_package(root, 111), 1)
+            self.assertEqual(self.build_and_package(root, 111), 2)
+            self.assertFalse(os.path.exists(os.path.join(root, "stage", artifact_cache.KEY_FILE)))
+
+    def tearDown(self):
+        BaseTest.tearDown(self)
@@ -1,3 +1,7 @@
+import glob
+import importlib
+import os
+import subprocess
 import sys
 
 import autobuild.autobuild_main
@@ -88,3 +92,85 @@ class TestOptions(BaseTest):
         except EarlyExitException:
             self.assertNotEqual(-1, captured_stdout.find("Builds platform targets."))
         pass
+
+    def test_help_imports_no_tools(self):
+        """test_help_imports_no_tools: autobuild --help describes tools from the manifest"""
+        try:
+            ret = self.autobuild_fixture.main(['--help'])
+            self.fail()
+        except EarlyExitException:
+            self.assertNotEqual(-1, captured_stdout.find("Graph package dependencies."))
+        self.assertEqual([], self.autobuild_fixture.tools_list)
+
+
+class TestToolManifest(BaseTest):
+    def test_manifest_matches_tools(self):
+        tools_dir = os.path.dirname(autobuild.autobuild_main.__file__)
+        names = sorted(os.path.splitext(os.path.basename(f))[0][len('autobuild_tool_'):]
+                       for f in glob.glob(os.path.join(tools_dir, 'autobuild_tool_*.py')))
+        self.assertEqual(names, sorted(autobuild.autobuild_main.TOOLS))
+        for name, description in autobuild.autobuild_main.TOOLS.items():
+            module = importlib.import_module('autobuild.autobuild_tool_' + name)
+            details = module.AutobuildTool().get_details()
+            self.assertEqual(name, details['name'])
+            self.assertEqual(description, details['description'])
+
+
+class TestImportTime(BaseTest):
+    """
+    Startup regression tests: build scripts run autobuild many times, so
+    commands that need little should import little.
+    """
+    # modules that only some commands need
+    HEAVY = ('autobuild.configfile', 'llsd', 'multiprocessing', 'pprint',
+             'socket', 'tarfile', 'urllib.request')
+    # generous cumulative budget (microseconds) for importing autobuild's own
+    # modules: the point is to catch a heavy import creeping back in, not to
+    # fail on a slow machine
+    BUDGET = 250000
+
+    def import_times(self, code):
+        """
+        Run code in a fresh interpreter with -X importtime, returning a dict
+        of module name: (cumulative import time in microseconds, nesting
+        depth).
+        """
+        output = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                universal_newlines=True, check=True).stderr
+        times = {}
+        for line in output.splitlines():
+            if not line.startswith('import time:'):
+                continue
+            fields = line[len('import time:'):].split('|')
+            try:
+                name = fields[2].rstrip()
+                times[name.strip()] = (int(fields[1]), (len(name) - len(name.lstrip()) - 1) // 2)
+            except (IndexError, ValueError):
+                # the header line
+                pass
+        return times
+
+    def check(self, code):
+        times = self.import_times(code)
+        for module in self.HEAVY:
+            self.assertNotIn(module, times)
+        # autobuild modules imported at top level: their cumulative times
+        # include everything they import
+        total = sum(time for name, (time, depth) in times.items()
+                    if depth == 0 and name.split('.')[0] == 'autobuild')
+        self.assertLess(total, self.BUDGET)
+
+    def test_main(self):
+        self.check("import autobuild.autobuild_main")
+
+    def test_help(self):
+        self.check("import sys\n"
+                   "from autobuild.autobuild_main import Autobuild\n"
+                   "try:\n"
+                   "    Autobuild().main(['--help'])\n"
+                   "except SystemExit:\n"
+                   "    pass\n")
+
+    def test_source_environment(self):
+        self.check("import autobuild.autobuild_main, autobuild.autobuild_tool_source_environment")
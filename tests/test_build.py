@@ -1,14 +1,16 @@
 import logging
 import os
 import pprint
+import sys
 import tempfile
 
 import autobuild.common as common
 import autobuild.configfile as configfile
 from autobuild import autobuild_tool_build as build
-from autobuild.autobuild_tool_build import AutobuildTool, BuildError
+from autobuild.autobuild_tool_build import AutobuildTool, BuildError, _split_cpu_count
 from autobuild.common import cmd
 from autobuild.configfile import PACKAGE_METADATA_FILE, MetadataDescription
+from autobuild.executable import Executable
 from tests.baseline_compare import AutobuildBaselineCompare
 from tests.basetest import BaseTest, clean_dir, envvar, exc, needs_git
 from tests.executables import echo, envtest, noop
@@ -108,6 +110,70 @@ class TestBuild(LocalBase):
     def test_autobuild_build_release(self):
         self.autobuild('build', '--config-file=' + self.tmp_file, '-c', 'Release', '--id=123456')
 
+class TestParallelConfigurations(LocalBase):
+    def get_config(self):
+        config = super(TestParallelConfigurations, self).get_config()
+        configurations = config.package_description.platforms[common.get_current_platform()].configurations
+        configurations['Release'].build = echo("cpus$AUTOBUILD_CPU_COUNT")
+        debug = configfile.BuildConfigurationDescription()
+        debug.build = echo("cpus$AUTOBUILD_CPU_COUNT")
+        debug.default = True
+        debug.name = 'Debug'
+        debug.build_directory = os.path.join(self.tmp_build_dir, "debug")
+        configurations['Debug'] = debug
+        return config
+
+    def test_split_cpu_count(self):
+        self.assertEqual(_split_cpu_count(8, 2), [4, 4])
+        self.assertEqual(_split_cpu_count(7, 3), [3, 2, 2])
+        self.assertEqual(_split_cpu_count(2, 5), [1, 1])
+        self.assertEqual(_split_cpu_count(1, 1), [1])
+
+    def test_parallel(self):
+        with envvar("AUTOBUILD_CPU_COUNT", "4"):
+            output = self.autobuild('build', '--config-file=' + self.tmp_file, '--id=123456',
+                                    '--parallel-configurations')
+        self.assertIn("[Release] cpus2", output)
+        self.assertIn("[Debug] cpus2", output)
+        for build_directory, name in ((self.tmp_build_dir, 'Release'),
+                                      (os.path.join(self.tmp_build_dir, "debug"), 'Debug')):
+            metadata = MetadataDescription(os.path.join(build_directory, PACKAGE_METADATA_FILE))
+            self.assertEqual(metadata.configuration, name)
+            self.assertEqual(metadata.package_description.version, "1.0")
+
+    def test_parallel_failure(self):
+        self.config.package_description.platforms[common.get_current_platform()] \
+            .configurations['Debug'].build = Executable(command=sys.executable, options=['-c', 'raise SystemExit(3)'])
+        self.config.save()
+        with exc(BuildError, "Debug returned 3"):
+            build('--config-file=' + self.tmp_file, '--id=123456', '--parallel-configurations')
+        # the configuration that succeeded still gets its metadata
+        self.assertEqual(MetadataDescription(os.path.join(self.tmp_build_dir, PACKAGE_METADATA_FILE))
+                         .configuration, 'Release')
+
+    def test_parallel_configure_failure(self):
+        self.config.package_description.platforms[common.get_current_platform()] \
+            .configurations['Debug'].configure = Executable(command=sys.executable,
+                                                            options=['-c', 'raise SystemExit(4)'])
+        self.config.save()
+        with exc(BuildError, "configuring configuration Debug returned 4"):
+            build('--config-file=' + self.tmp_file, '--id=123456', '--parallel-configurations')
+        self.assertEqual(MetadataDescription(os.path.join(self.tmp_build_dir, PACKAGE_METADATA_FILE))
+                         .configuration, 'Release')
+
+    def test_parallel_shared_build_directory(self):
+        # Debug builds in the platform's build directory too: they must not
+        # build at once
+        self.config.package_description.platforms[common.get_current_platform()] \
+            .configurations['Debug'].build_directory = None
+        self.config.save()
+        with envvar("AUTOBUILD_CPU_COUNT", "4"):
+            output = self.autobuild('build', '--config-file=' + self.tmp_file, '--id=123456',
+                                    '--parallel-configurations')
+        self.assertNotIn("[Debug]", output)
+        self.assertNotIn("[Release]", output)
+        self.assertIn("cpus4", output)
+
 class TestEnvironment(LocalBase):
     def get_config(self):
         config = super(TestEnvironment, self).get_config()
@@ -1,5 +1,9 @@
+import os
+import unittest
+from unittest.mock import patch
+
 from autobuild import common
-from tests.basetest import BaseTest
+from tests.basetest import BaseTest, temp_dir
 
 
 class TestCommon(BaseTest):
@@ -14,5 +18,23 @@ class TestCommon(BaseTest):
         exe_path = common.find_executable(shell)
         assert exe_path != None
 
+    @unittest.skipIf(common.is_system_windows(), "the temporary directory is per-user on Windows")
+    def test_private_temp_dir(self):
+        with temp_dir() as parent:
+            os.chmod(parent, 0o777)
+            private = os.path.join(parent, "private")
+            os.mkdir(private, 0o755)
+            with patch.object(common, "get_temp_dir", return_value=private):
+                self.assertEqual(common.get_private_temp_dir("private"), private)
+            self.assertEqual(os.stat(private).st_mode & 0o777, 0o700)
+            self.assertEqual(os.stat(parent).st_mode & 0o777, 0o755)
+
+            # someone else's directory in its place
+            link = os.path.join(parent, "link")
+            os.symlink(private, link)
+            with patch.object(common, "get_temp_dir", return_value=link):
+                with self.assertRaises(common.AutobuildError):
+                    common.get_private_temp_dir("link")
+
     def tearDown(self):
         BaseTest.tearDown(self)
@@ -1,7 +1,13 @@
-from autobuild import configfile
+import os
+import pickle
+import tempfile
+
+import llsd
+
+from autobuild import config_cache, configfile
 from autobuild.executable import Executable
 from tests.baseline_compare import AutobuildBaselineCompare
-from tests.basetest import BaseTest
+from tests.basetest import BaseTest, clean_dir, envvar, temp_dir
 
 
 class TestConfigFile(BaseTest, AutobuildBaselineCompare):
@@ -71,6 +77,118 @@ class TestConfigFile(BaseTest, AutobuildBaselineCompare):
             # whose $variables have been expanded!
             config.save()
 
+    def test_configuration_cache(self):
+        config = self.fake_config()
+        config.save()
+        config_cache.invalidate(config.path)
+
+        # first load populates the cache, second load is served from it
+        first = configfile.ConfigurationDescription(config.path)
+        with open(config.path, 'rb') as f:
+            contents = f.read()
+        self.assertIsNotNone(config_cache.load(config.path, contents))
+        second = configfile.ConfigurationDescription(config.path)
+        self.assertEqual(configfile.compact_to_dict(first), configfile.compact_to_dict(second))
+        self.assertIsInstance(second.package_description, configfile.PackageDescription)
+        self.assertEqual(second.get_build_configuration('common', 'common').build.get_command(), 'gcc')
+
+        # any change to the file invalidates the entry
+        second.package_description.platforms['common'].build_directory = 'elsewhere'
+        second.save()
+        reloaded = configfile.ConfigurationDescription(config.path)
+        self.assertEqual(reloaded.package_description.platforms['common'].build_directory, 'elsewhere')
+
+    def test_configuration_cache_plain_data(self):
+        config = self.fake_config()
+        config.save()
+        config_cache.invalidate(config.path)
+        configfile.ConfigurationDescription(config.path)
+        cache_file = config_cache._cache_file(config.path)
+        with open(cache_file, 'rb') as f:
+            self.assertIsInstance(llsd.parse_binary(f.read())['data']['package_description'], dict)
+
+        # whatever is planted there is never unpickled
+        class Planted(object):
+            def __reduce__(self):
+                return (exec, ("import os; os.environ['AUTOBUILD_PLANTED'] = '1'",))
+        config_cache.entries.clear()
+        with open(cache_file, 'wb') as f:
+            f.write(pickle.dumps(Planted()))
+        with envvar('AUTOBUILD_PLANTED', None):
+            with open(config.path, 'rb') as f:
+                self.assertIsNone(config_cache.load(config.path, f.read()))
+            self.assertNotIn('AUTOBUILD_PLANTED', os.environ)
+        config_cache.invalidate(config.path)
+
+    def test_configuration_cache_disabled(self):
+        config = self.fake_config()
+        config.save()
+        config_cache.invalidate(config.path)
+        with envvar(config_cache.CONFIG_CACHE_ENV, 'false'):
+            configfile.ConfigurationDescription(config.path)
+            with open(config.path, 'rb') as f:
+                self.assertIsNone(config_cache.load(config.path, f.read()))
+        self.assertFalse(os.path.exists(config_cache._cache_file(config.path)))
+
+    def test_configuration_copy(self):
+        config = self.fake_config()
+        config.save()
+        config = configfile.ConfigurationDescription(config.path)
+        copy = config.copy()
+        self.assertIsInstance(copy, configfile.ConfigurationDescription)
+        self.assertEqual(copy.path, config.path)
+        self.assertNotIn('path', copy)
+        self.assertEqual(configfile.compact_to_dict(copy), configfile.compact_to_dict(config))
+        self.assertEqual(llsd.format_pretty_xml(configfile.compact_to_dict(copy)),
+                         llsd.format_pretty_xml(configfile.compact_to_dict(config)))
+
+        # the copy is independent of the original
+        build = copy.get_build_configuration('common', 'common').build
+        self.assertIsInstance(build, Executable)
+        build.command = 'clang'
+        copy.package_description.platforms['common'].build_directory = 'elsewhere'
+        copy.package_description.platforms['darwin'] = configfile.PlatformDescription()
+        self.assertEqual(config.get_build_configuration('common', 'common').build.get_command(), 'gcc')
+        self.assertEqual(config.package_description.platforms['common'].build_directory, '.')
+        self.assertNotIn('darwin', config.package_description.platforms)
+
+    def test_configuration_copy_on_write(self):
+        config = self.fake_config()
+        config.package_description.platforms['common'].build_directory = 'build-$CONFIG'
+        config.package_description.platforms['windows'] = configfile.PlatformDescription()
+        config.installables['other'] = configfile.PackageDescription('other')
+        view = config.copy_on_write()
+        self.assertEqual(view.path, config.path)
+        self.assertIs(view.installables, config.installables)
+
+        view.expand_platform_vars(dict(CONFIG='Release'), platform='common')
+        self.assertEqual(view.get_platform('common').build_directory, 'build-Release')
+        self.assertEqual(config.get_platform('common').build_directory, 'build-$CONFIG')
+        # subtrees expansion didn't touch are still shared
+        self.assertIs(view.package_description.platforms['windows'],
+                      config.package_description.platforms['windows'])
+        self.assertIs(view.get_platform('common').configurations['common'],
+                      config.get_platform('common').configurations['common'])
+
+        with self.assertRaises(configfile.ConfigurationError):
+            view.save()
+        # the original is not marked expanded
+        config.save()
+
+    def test_field_attributes(self):
+        package = configfile.PackageDescription('test')
+        self.assertEqual(package.name, 'test')
+        package.name = 'renamed'
+        self.assertEqual(package['name'], 'renamed')
+        del package['license']
+        self.assertFalse(hasattr(package, 'license'))
+        self.assertIsNone(getattr(package, 'license', None))
+        # keys not listed in fields still read as attributes
+        package['extra'] = 1
+        self.assertEqual(package.extra, 1)
+        with self.assertRaises(AttributeError):
+            package.missing
+
     def tearDown(self):
         self.cleanup_tmp_file()
         BaseTest.tearDown(self)
@@ -151,3 +269,263 @@ class TestExpandVars(BaseTest):
                    "four" : {"four": "4"},
                   },
             ))
+
+    def package(self):
+        package = configfile.PackageDescription("test")
+        for name in ("common", "linux", "linux64", "windows64"):
+            platform = configfile.PlatformDescription()
+            platform.build_directory = "build-%s-${CONFIG|none}" % name
+            configuration = configfile.BuildConfigurationDescription()
+            configuration.build = Executable(command="make", options=["-j$JOBS", "plain"])
+            platform.configurations["Release"] = configuration
+            package.platforms[name] = platform
+        package.platforms["windows64"].build_directory = "$UNDEFINED"
+        return package
+
+    def test_expand_platform_vars_selected_platform(self):
+        package = self.package()
+        copy = package.copy()
+        # only linux64, its base platform and common are expanded: windows64
+        # would raise ConfigurationError
+        copy.expand_platform_vars(dict(CONFIG="Release", JOBS="4"), platform="linux64")
+        for name in ("common", "linux", "linux64"):
+            platform = copy.platforms[name]
+            self.assertEqual(platform.build_directory, "build-%s-Release" % name)
+            self.assertEqual(platform.configurations["Release"].build.options, ["-j4", "plain"])
+        self.assertEqual(copy.platforms["windows64"].build_directory, "$UNDEFINED")
+        # the original is untouched, down to the shared options lists
+        self.assertEqual(package.platforms["linux64"].build_directory, "build-linux64-${CONFIG|none}")
+        self.assertEqual(package.platforms["linux64"].configurations["Release"].build.options,
+                         ["-j$JOBS", "plain"])
+
+        with self.assertRaises(configfile.ConfigurationError):
+            package.copy().expand_platform_vars(dict(JOBS="4"))
+
+    def test_expand_platform_vars_memoized(self):
+        package = self.package()
+        package.copy().expand_platform_vars(dict(CONFIG="Debug", JOBS="2", OTHER="x"), platform="linux")
+        plan = package._expansion_plans["linux"]
+        self.assertEqual(plan.names, ("CONFIG", "JOBS"))
+        self.assertEqual(len(plan.memo), 1)
+        # an unrelated variable doesn't change the snapshot
+        copy = package.copy()
+        copy.expand_platform_vars(dict(CONFIG="Debug", JOBS="2", OTHER="y"), platform="linux")
+        self.assertEqual(len(plan.memo), 1)
+        self.assertIs(package._expansion_plans["linux"], plan)
+        self.assertEqual(copy.platforms["linux"].build_directory, "build-linux-Debug")
+        # a variable it references does
+        copy = package.copy()
+        copy.expand_platform_vars(dict(JOBS="2"), platform="linux")
+        self.assertEqual(len(plan.memo), 2)
+        self.assertEqual(copy.platforms["linux"].build_directory, "build-linux-none")
+
+    def test_expansion_plan_recompiled_after_edit(self):
+        package = self.package()
+        package.copy().expand_platform_vars(dict(CONFIG="Debug", JOBS="2"), platform="linux")
+        plan = package._expansion_plans["linux"]
+        # a new string containing '$', where the plan recorded none
+        package.platforms["linux"].configurations["Release"].configure = Executable(
+            command="cmake", options=["-DCONFIG=$CONFIG"])
+        copy = package.copy()
+        copy.expand_platform_vars(dict(CONFIG="Debug", JOBS="2"), platform="linux")
+        self.assertIsNot(package._expansion_plans["linux"], plan)
+        self.assertEqual(copy.platforms["linux"].configurations["Release"].configure.options,
+                         ["-DCONFIG=Debug"])
+
+    def test_expansion_plan_not_memoized(self):
+        package = configfile.PackageDescription("test")
+        package.platforms["common"] = configfile.PlatformDescription(dict(build_directory="${A|$B}"))
+        for b in ("one", "two"):
+            copy = package.copy()
+            copy.expand_platform_vars(dict(B=b), platform="common")
+            self.assertEqual(copy.platforms["common"].build_directory, b)
+        self.assertEqual(package._expansion_plans["common"].memo, {})
+
+
+class TestDependenciesJournal(BaseTest):
+    def setUp(self):
+        BaseTest.setUp(self)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.installed_file = os.path.join(self.tmp_dir, configfile.INSTALLED_CONFIG_FILE)
+
+    def metadata(self, name):
+        metadata = configfile.MetadataDescription(create_quietly=True)
+        metadata.package_description = configfile.PackageDescription(dict(name=name, version="1.0"))
+        metadata.install_dir = "packages"
+        metadata.manifest = ["include/%s.h" % name]
+        return metadata
+
+    def test_replay_and_compact(self):
+        installed = configfile.Dependencies(self.installed_file)
+        installed.journal_install("one", self.metadata("one"))
+        installed.journal_install("two", self.metadata("two"))
+        installed.save()
+        self.assertFalse(os.path.exists(installed.journal_path()))
+
+        # journaled changes, then "crash" without saving
+        installed.journal_uninstall("one")
+        installed.journal_install("three", self.metadata("three"))
+        self.assertTrue(os.path.exists(installed.journal_path()))
+
+        replayed = configfile.Dependencies(self.installed_file)
+        self.assertEqual(sorted(replayed.dependencies), ["three", "two"])
+        self.assertEqual(replayed.dependencies["three"]["manifest"], ["include/three.h"])
+        replayed.save()
+        self.assertFalse(os.path.exists(replayed.journal_path()))
+        self.assertEqual(sorted(configfile.Dependencies(self.installed_file).dependencies),
+                         ["three", "two"])
+
+    def test_incomplete_record_ignored(self):
+        installed = configfile.Dependencies(self.installed_file)
+        installed.journal_install("one", self.metadata("one"))
+        installed.journal_install("two", self.metadata("two"))
+        with open(installed.journal_path(), 'rb+') as f:
+            f.truncate(os.path.getsize(installed.journal_path()) - 5)
+        self.assertEqual(list(configfile.Dependencies(self.installed_file).dependencies), ["one"])
+
+    def tearDown(self):
+        clean_dir(self.tmp_dir)
+        BaseTest.tearDown(self)
+
+
+class TestCompactManifest(BaseTest):
+    paths = ["include/", "include/zlib/", "include/zlib/zconf.h", "include/zlib/zlib.h",
+             "lib/", "lib/release/", "lib/release/libz.a", "LICENSES/zlib.txt"]
+
+    def test_sequence(self):
+        manifest = configfile.CompactManifest(self.paths)
+        self.assertEqual(len(manifest), len(self.paths))
+        self.assertEqual(list(manifest), self.paths)
+        self.assertEqual(manifest, self.paths)
+        self.assertEqual(manifest[2], "include/zlib/zconf.h")
+        self.assertEqual(manifest[-1], "LICENSES/zlib.txt")
+        self.assertIn("lib/release/libz.a", manifest)
+        self.assertNotIn("lib/release/libz.so", manifest)
+        self.assertEqual(eval(repr(manifest)), self.paths)
+        self.assertFalse(configfile.CompactManifest())
+
+    def test_llsd_round_trip(self):
+        manifest = configfile.CompactManifest(self.paths)
+        encoded = manifest.to_llsd()
+        self.assertEqual(encoded["encoding"], configfile.CompactManifest.ENCODING)
+        self.assertLess(len(encoded["paths"]), sum(len(p) for p in self.paths))
+        self.assertEqual(configfile.CompactManifest.from_llsd(encoded), self.paths)
+        # up-conversion from the original list format
+        self.assertEqual(configfile.CompactManifest.from_llsd(self.paths), self.paths)
+
+    def test_indexing_keeps_encoding(self):
+        manifest = configfile.CompactManifest.from_llsd(configfile.CompactManifest(self.paths).to_llsd())
+        self.assertEqual([manifest[i] for i in range(len(manifest))], self.paths)
+        # the decoded paths are kept for further indexing, but it is still
+        # saved front-coded
+        self.assertEqual(manifest.to_llsd()["encoding"], configfile.CompactManifest.ENCODING)
+        self.assertEqual(list(manifest), self.paths)
+
+    def test_newline_paths(self):
+        paths = ["odd\nname", "odd\nname2"]
+        manifest = configfile.CompactManifest(paths)
+        self.assertEqual(manifest, paths)
+        self.assertEqual(manifest.to_llsd(), paths)
+
+    def test_read_version_1(self):
+        with temp_dir() as tmp_dir:
+            installed_file = os.path.join(tmp_dir, configfile.INSTALLED_CONFIG_FILE)
+            with open(installed_file, 'wb') as f:
+                f.write(llsd.format_pretty_xml(dict(
+                    version="1", type=configfile.AUTOBUILD_INSTALLED_TYPE,
+                    dependencies=dict(zlib=dict(package_description=dict(name="zlib"),
+                                                install_dir="packages", manifest=self.paths)))))
+            installed = configfile.Dependencies(installed_file)
+            manifest = installed.dependencies["zlib"]["manifest"]
+            self.assertIsInstance(manifest, configfile.CompactManifest)
+            self.assertEqual(manifest, self.paths)
+            installed.save()
+            with open(installed_file, 'rb') as f:
+                saved = llsd.parse(f.read())
+            self.assertEqual(saved["version"], configfile.AUTOBUILD_INSTALLED_VERSION)
+            self.assertEqual(saved["dependencies"]["zlib"]["manifest"]["encoding"],
+                             configfile.CompactManifest.ENCODING)
+            self.assertEqual(configfile.Dependencies(installed_file).dependencies["zlib"]["manifest"],
+                             self.paths)
+
+
+class TestNormalizedMetadata(BaseTest):
+    def package(self, name, build_id, **dependencies):
+        metadata = configfile.MetadataDescription(create_quietly=True)
+        metadata.package_description = configfile.PackageDescription(dict(name=name, version="1.0"))
+        metadata.build_id = build_id
+        metadata.archive = configfile.ArchiveDescription()
+        metadata.archive.hash = "%s-hash" % name
+        metadata.dependencies = dependencies
+        return metadata
+
+    def test_diamond_round_trip(self):
+        bottom = self.package("bottom", "1")
+        left = self.package("left", "2", bottom=bottom)
+        right = self.package("right", "3", bottom=bottom)
+        with temp_dir() as tmp_dir:
+            path = os.path.join(tmp_dir, configfile.PACKAGE_METADATA_FILE)
+            top = self.package("top", "4", left=left, right=right)
+            top.path = path
+            top.save()
+
+            with open(path, 'rb') as f:
+                saved = llsd.parse(f.read())
+            self.assertEqual(saved["version"], configfile.AUTOBUILD_METADATA_VERSION)
+            self.assertEqual(saved["dependencies"], dict(left="left|2|left-hash", right="right|3|right-hash"))
+            self.assertEqual(sorted(saved["dependency_nodes"]),
+                             ["bottom|1|bottom-hash", "left|2|left-hash", "right|3|right-hash"])
+            self.assertEqual(saved["dependency_nodes"]["left|2|left-hash"]["dependencies"],
+                             dict(bottom="bottom|1|bottom-hash"))
+
+            loaded = configfile.MetadataDescription(path)
+        self.assertEqual(sorted(loaded.dependencies), ["left", "right"])
+        loaded_bottom = loaded.dependencies["left"].dependencies["bottom"]
+        self.assertIsInstance(loaded_bottom, configfile.MetadataDescription)
+        self.assertIs(loaded_bottom, loaded.dependencies["right"].dependencies["bottom"])
+        self.assertEqual(loaded_bottom.build_id, "1")
+        self.assertEqual(loaded_bottom.archive["hash"], "bottom-hash")
+        # the in-memory form is the same as the original nested layout
+        self.assertEqual(configfile.compact_to_dict(loaded.dependencies),
+                         configfile.compact_to_dict(top.dependencies))
+
+    def test_local_dependencies(self):
+        # no build_id or hash: distinct packages must stay distinct nodes
+        left_local = self.package("local", None)
+        left_local.package_description.version = "1.0"
+        right_local = self.package("local", None)
+        right_local.package_description.version = "2.0"
+        for local in left_local, right_local:
+            local.archive = configfile.ArchiveDescription()
+        with temp_dir() as tmp_dir:
+            path = os.path.join(tmp_dir, configfile.PACKAGE_METADATA_FILE)
+            top = self.package("top", "4", left=self.package("left", "2", local=left_local),
+                               right=self.package("right", "3", local=right_local))
+            top.path = path
+            top.save()
+            loaded = configfile.MetadataDescription(path)
+        self.assertEqual("1.0", loaded.dependencies["left"].dependencies["local"].package_description.version)
+        self.assertEqual("2.0", loaded.dependencies["right"].dependencies["local"].package_description.version)
+
+    def test_no_dependencies_nested_version(self):
+        # nothing to normalize: older autobuild can read it
+        with temp_dir() as tmp_dir:
+            path = os.path.join(tmp_dir, configfile.PACKAGE_METADATA_FILE)
+            top = self.package("top", "4")
+            top.path = path
+            top.save()
+            with open(path, 'rb') as f:
+                saved = llsd.parse(f.read())
+        self.assertEqual(configfile.AUTOBUILD_METADATA_NESTED_VERSION, saved["version"])
+        self.assertNotIn("dependency_nodes", saved)
+
+    def test_read_nested_layout(self):
+        nested = dict(version="1", type="metadata", build_id="4",
+                      package_description=dict(name="top"),
+                      dependencies=dict(left=dict(version="1", type="metadata", build_id="2",
+                                                  package_description=dict(name="left"),
+                                                  dependencies=dict(bottom=dict(
+                                                      version="1", type="metadata", build_id="1",
+                                                      package_description=dict(name="bottom"))))))
+        loaded = configfile.MetadataDescription(parsed_llsd=nested)
+        self.assertEqual(loaded.dependencies["left"].dependencies["bottom"].build_id, "1")
@@ -1,10 +1,12 @@
 import os
+import sys
 
 import autobuild.common as common
 import autobuild.configfile as configfile
 from autobuild import autobuild_tool_configure as configure
+from autobuild.executable import Executable
 from tests.baseline_compare import AutobuildBaselineCompare
-from tests.basetest import BaseTest
+from tests.basetest import BaseTest, temp_dir
 from tests.executables import echo, noop
 
 
@@ -53,6 +55,63 @@ class TestConfigure(BaseTest, AutobuildBaselineCompare):
         assert "foo666" in self.autobuild('configure', '--config-file=' + self.tmp_file,
                                         '-i', '666')
 
+    def test_skip_unchanged(self):
+        with temp_dir() as build_directory:
+            count_file = os.path.join(build_directory, "count")
+            build_configuration = self.config.get_build_configuration('Release')
+            build_configuration.configure = Executable(
+                command=sys.executable, options=['-c', "open(%r, 'a').write('x')" % count_file])
+            installed = os.path.join(build_directory, "packages", configfile.INSTALLED_CONFIG_FILE)
+            environment = dict(os.environ, AUTOBUILD_BUILD_ID="1")
+
+            def configure_count(**kwds):
+                kwds.setdefault('environment', environment)
+                result = configure._configure_a_configuration(self.config, build_configuration, [],
+                                                              build_directory=build_directory, **kwds)
+                self.assertEqual(result, 0)
+                with open(count_file) as f:
+                    return len(f.read())
+
+            self.assertEqual(configure_count(), 1)
+            self.assertEqual(configure_count(), 1)
+            # configure may stamp the build id into what it generates
+            environment["AUTOBUILD_BUILD_ID"] = "2"
+            self.assertEqual(configure_count(), 2)
+            self.assertEqual(configure_count(), 2)
+            # nor does the log level matter
+            self.assertEqual(configure_count(environment=dict(environment, AUTOBUILD_LOGLEVEL="--debug")), 2)
+            self.assertEqual(configure_count(reconfigure=True), 3)
+            self.assertEqual(configure_count(environment=dict(environment, CC="clang")), 4)
+            os.makedirs(os.path.dirname(installed))
+            with open(installed, 'w') as f:
+                f.write("<llsd />")
+            self.assertEqual(configure_count(), 5)
+            self.assertEqual(configure._configure_a_configuration(self.config, build_configuration, ['--new'],
+                                                                  environment=environment,
+                                                                  build_directory=build_directory), 0)
+            self.assertEqual(configure_count(), 7)
+            self.config.package_description.copyright = "changed"
+            self.config.save()
+            self.assertEqual(configure_count(), 8)
+            self.assertEqual(configure_count(), 8)
+
+    def test_no_fingerprint_in_config_directory(self):
+        # with no build_directory configured, the build directory is the
+        # directory of autobuild.xml: configure always runs there
+        with temp_dir() as config_directory, temp_dir() as scratch:
+            self.config.path = os.path.join(config_directory, configfile.AUTOBUILD_CONFIG_FILE)
+            self.config.save()
+            count_file = os.path.join(scratch, "count")
+            build_configuration = self.config.get_build_configuration('Release')
+            build_configuration.configure = Executable(
+                command=sys.executable, options=['-c', "open(%r, 'a').write('x')" % count_file])
+            for count in (1, 2):
+                self.assertEqual(configure._configure_a_configuration(self.config, build_configuration, [],
+                                                                      build_directory=config_directory), 0)
+                with open(count_file) as f:
+                    self.assertEqual(len(f.read()), count)
+            self.assertEqual(os.listdir(config_directory), [configfile.AUTOBUILD_CONFIG_FILE])
+
     def tearDown(self):
         self.cleanup_tmp_file()
         BaseTest.tearDown(self)
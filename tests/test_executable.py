@@ -1,5 +1,10 @@
-from autobuild.executable import Executable
-from tests.basetest import BaseTest, needs_nix
+import io
+import os
+import sys
+
+from autobuild import executable as executable_module
+from autobuild.executable import Executable, _OutputFilter
+from tests.basetest import BaseTest, needs_nix, temp_dir
 
 
 @needs_nix
@@ -25,5 +30,97 @@ class TestExecutable(BaseTest):
         result = parentExecutable()
         assert result == 0, "%s => %s" % (parentExecutable._get_all_arguments([]), result)
 
+    def test_prefixed_output(self):
+        executable = Executable(command='sh', options=['-c', 'pwd; printf "a\\rb\\n"; echo skip >&2'],
+                                filters=['^skip'])
+        saved = sys.stdout
+        sys.stdout = io.TextIOWrapper(io.BytesIO())
+        try:
+            with temp_dir() as d:
+                result = executable(cwd=d, output_prefix="[x] ")
+                sys.stdout.flush()
+                lines = sys.stdout.buffer.getvalue().decode().splitlines()
+        finally:
+            sys.stdout = saved
+        assert result == 0
+        assert all(line.startswith("[x] ") for line in lines), lines
+        assert lines[-3:] == ["[x] " + os.path.realpath(d), "[x] a", "[x] b"], lines
+
+    def test_filtered_output(self):
+        executable = Executable(command='sh', options=['-c', 'printf "keep\\ndrop 1\\r\\nkeep too\\rDROP 2\\n"'],
+                                filters=['^drop', '(?i)^drop 2$'])
+        saved = sys.stdout
+        sys.stdout = io.TextIOWrapper(io.BytesIO())
+        try:
+            result = executable()
+            sys.stdout.flush()
+            lines = sys.stdout.buffer.getvalue().decode().splitlines()
+        finally:
+            sys.stdout = saved
+        assert result == 0
+        assert lines[-2:] == ["keep", "keep too"], lines
+
+    def tearDown(self):
+        BaseTest.tearDown(self)
+
+
+class TestOutputFilter(BaseTest):
+    def run_filter(self, chunks, filters=None, prefix=None):
+        written = []
+        output_filter = _OutputFilter(filters, prefix)
+        saved = executable_module._write_output
+        executable_module._write_output = written.append
+        try:
+            output_filter.copy(io.BufferedReader(_Chunks(chunks)))
+        finally:
+            executable_module._write_output = saved
+        return b"".join(written)
+
+    def test_filters(self):
+        self.assertEqual(_OutputFilter(['^a', 'b$', 'x']).filter(b"abc\nxyz\nb\nc\n\n"), b"c\n\n")
+        self.assertEqual(_OutputFilter(['^$']).filter(b"a\n\nb\n"), b"a\nb\n")
+        self.assertEqual(_OutputFilter(['q']).filter(b"a\nb\n"), b"a\nb\n")
+
+    def test_consecutive_matching_lines(self):
+        # each line is judged on its own, as when filtering a line at a time
+        self.assertEqual(_OutputFilter([r'^\s*$']).filter(b"ab\n\n\n\ncd\n"), b"ab\ncd\n")
+        self.assertEqual(_OutputFilter([r'^\s*$', '^x']).filter(b"ab\n  \n\t\n\ncd\n \n"), b"ab\ncd\n")
+        self.assertEqual(_OutputFilter([r'^[ \t]*$']).filter(b"ab\n \n\t\n  \ncd\n"), b"ab\ncd\n")
+        self.assertEqual(_OutputFilter([r'\s+$']).filter(b"ab \n \n\t\ncd\n\n"), b"cd\n\n")
+        self.assertEqual(_OutputFilter(['^a']).filter(b"a1\na2\na3\nb\n"), b"b\n")
+
+    def test_filters_spanning_lines(self):
+        # a filter sees one line, without its newline
+        self.assertEqual(_OutputFilter(['^a\nb']).filter(b"a\nb\nc\n"), b"a\nb\nc\n")
+        self.assertEqual(_OutputFilter(['a\nb']).filter(b"xa\nb\nc\n"), b"xa\nb\nc\n")
+        self.assertEqual(_OutputFilter(['b\n']).filter(b"ab\nab\nc\n"), b"ab\nab\nc\n")
+        self.assertEqual(_OutputFilter([r'x\s*']).filter(b"ax\n\nb\n"), b"\nb\n")
+
+    def test_uncombinable_filters(self):
+        self.assertEqual(_OutputFilter(['(?i)^warning', 'note']).filter(b"WARNING x\nok\nnote y\n"), b"ok\n")
+
+    def test_prefix(self):
+        self.assertEqual(_OutputFilter(None, "[p] ").filter(b"a\nb\n"), b"[p] a\n[p] b\n")
+
+    def test_line_endings_across_chunks(self):
+        self.assertEqual(self.run_filter([b"one\r", b"\ntw", b"o\rthree", b"\r", b"four"], ['^two']),
+                         b"one\nthree\nfour\n")
+
     def tearDown(self):
         BaseTest.tearDown(self)
+
+
+class _Chunks(io.RawIOBase):
+    """raw stream returning the given chunks one read at a time"""
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self.chunks:
+            return 0
+        chunk = self.chunks.pop(0)
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
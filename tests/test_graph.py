@@ -1,6 +1,9 @@
 import logging
 import os
+import re
+import shutil
 import tempfile
+from io import StringIO
 
 import pytest
 
@@ -17,6 +20,7 @@ except (ImportError, FileNotFoundError):
 
 import autobuild.autobuild_tool_graph as graph
 import autobuild.common as common
+import autobuild.package_index as package_index
 from tests.basetest import *
 
 logger = logging.getLogger(__name__)
@@ -29,6 +33,11 @@ class GraphOptions(object):
         self.display=False
         self.graph_file=None
         self.dot_file=None
+        self.rebuild_from=None
+        self.archives=None
+        self.index_file=None
+        self.dependents_of=None
+        self.newest=None
         self.platform=None
         self.addrsize=common.DEFAULT_ADDRSIZE
 
@@ -134,3 +143,125 @@ class TestMermaidGraph(BaseTest):
 
     def tearDown(self):
         BaseTest.tearDown(self)
+
+
+def _package(name, *dependencies):
+    return dict(package_description=dict(name=name, version="1"), build_id="1",
+                dependencies={dep['package_description']['name']: dep for dep in dependencies})
+
+
+class TestRebuildFrom(BaseTest):
+    def setUp(self):
+        BaseTest.setUp(self)
+        # zlib is reached by three paths: each package must still be visited once
+        zlib = _package("zlib")
+        png = _package("png", zlib)
+        freetype = _package("freetype", zlib, png)
+        curl = _package("curl", zlib)
+        self.metadata = _package("viewer", freetype, curl, png, _package("fmt"))
+
+    def test_index(self):
+        index = graph.DependencyIndex(self.metadata)
+        self.assertEqual("viewer", index.root)
+        self.assertEqual(["viewer", "freetype", "zlib", "png", "curl", "fmt"], list(index.packages))
+        self.assertEqual(["freetype", "png", "curl"], index.dependents["zlib"])
+        self.assertEqual([], index.dependents["viewer"])
+
+    def test_levels(self):
+        index = graph.DependencyIndex(self.metadata)
+        self.assertEqual([["curl", "png"], ["freetype"], ["viewer"]], index.rebuild_levels("zlib"))
+        self.assertEqual([["viewer"]], index.rebuild_levels("fmt"))
+        self.assertEqual([], index.rebuild_levels("viewer"))
+
+    def test_unknown_package(self):
+        with ExpectError("not a dependency", "no error for a package not in the graph", graph.GraphError):
+            graph.DependencyIndex(self.metadata).rebuild_levels("openssl")
+
+    def test_run(self):
+        options = GraphOptions()
+        options.source_file = os.path.join(self.this_dir, "data", "bongo-0.1-common-111.tar.bz2")
+        options.rebuild_from = "bingo"
+        with CaptureStdout() as out:
+            graph.AutobuildTool().run(options)
+        self.assertEqual("1: bongo\n", out.getvalue())
+
+
+class TestPackageIndex(BaseTest):
+    archives = ("bongo-0.1-common-111.tar.bz2", "bingo-0.1-common-111.tar.bz2",
+                "bogus-0.1-common-111.tar.gz", "bogus-0.2-common-222.tar.bz2",
+                "nometa-0.1-common-111.tar.bz2")
+
+    def setUp(self):
+        BaseTest.setUp(self)
+        self.temp = temp_dir()
+        self.dir = self.temp.__enter__()
+        for archive in self.archives:
+            shutil.copy(os.path.join(self.this_dir, "data", archive), self.dir)
+        self.index = package_index.PackageIndex(self.dir)
+
+    def tearDown(self):
+        self.temp.__exit__(None, None, None)
+        BaseTest.tearDown(self)
+
+    def test_update(self):
+        self.assertEqual(5, self.index.update())
+        # bingo 0.2 is known only as what bongo was built with
+        self.assertEqual(["bingo/0.2/222", "bingo/1/111", "bogus/0.1/111", "bogus/0.2/222", "bongo/1/111"],
+                         sorted(self.index.nodes))
+        self.assertIsNone(self.index.nodes["bingo/0.2/222"]["archive"])
+        self.assertIsNone(self.index.archives["nometa-0.1-common-111.tar.bz2"]["root"])
+        # nothing changed: nothing read
+        self.assertEqual(0, self.index.update())
+        os.utime(os.path.join(self.dir, "bingo-0.1-common-111.tar.bz2"), ns=(0, 0))
+        os.remove(os.path.join(self.dir, "bongo-0.1-common-111.tar.bz2"))
+        self.assertEqual(1, self.index.update())
+        self.assertEqual(["bingo/1/111", "bogus/0.1/111", "bogus/0.2/222"], sorted(self.index.nodes))
+
+    def test_save_load(self):
+        self.index.update()
+        index_file = os.path.join(self.dir, package_index.INDEX_FILE)
+        self.index.save(index_file)
+        loaded = package_index.PackageIndex.load(index_file)
+        self.assertEqual(self.index.nodes, loaded.nodes)
+        self.assertEqual(0, loaded.update())
+
+    def test_queries(self):
+        self.index.update()
+        self.assertEqual(["bongo/1/111"], self.index.dependents_of("bingo"))
+        self.assertEqual(["bongo/1/111"], self.index.dependents_of("bingo/0.2/222"))
+        self.assertEqual([], self.index.dependents_of("bingo/1/111"))
+        self.assertEqual("bogus/0.2/222", self.index.newest("bogus"))
+        with ExpectError("no package openssl", "no error for a package not in the index",
+                         package_index.PackageIndexError):
+            self.index.newest("openssl")
+
+    def test_streams(self):
+        self.index.update()
+        mermaid = StringIO()
+        self.index.write_mermaid(mermaid)
+        lines = mermaid.getvalue().splitlines()
+        self.assertEqual("graph TB", lines[0])
+        ids = dict((match.group(2), match.group(1))
+                   for match in (re.match(r'    (n\d+)\W+"(\w+/[^/]+/\w+)', line.replace("<br />", "/"))
+                                 for line in lines[1:])
+                   if match)
+        self.assertIn("    %s-->%s" % (ids["bingo/0.2/222"], ids["bongo/1/111"]), lines)
+        dot = StringIO()
+        self.index.write_dot(dot)
+        self.assertIn('    "bingo/0.2/222" -> "bongo/1/111";', dot.getvalue().splitlines())
+        self.assertIn('    "bongo/1/111" [label="bongo\\n1\\n111"];', dot.getvalue().splitlines())
+
+    def test_run(self):
+        options = GraphOptions()
+        options.archives = self.dir
+        options.dependents_of = "bingo"
+        with CaptureStdout() as out:
+            graph.AutobuildTool().run(options)
+        self.assertEqual("bongo/1/111\n", out.getvalue())
+        # the index is kept, and can be queried on its own
+        options = GraphOptions()
+        options.index_file = os.path.join(self.dir, package_index.INDEX_FILE)
+        options.newest = "bogus"
+        with CaptureStdout() as out:
+            graph.AutobuildTool().run(options)
+        self.assertEqual("bogus/0.2/222\n", out.getvalue())
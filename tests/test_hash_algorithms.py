@@ -0,0 +1,89 @@
+import hashlib
+import os
+
+from autobuild import common, hash_algorithms
+from autobuild.common import AutobuildError
+from tests.basetest import BaseTest, temp_dir
+
+
+class TestVerifyMany(BaseTest):
+    def setUp(self):
+        BaseTest.setUp(self)
+
+    def _write(self, dirname, name, data):
+        path = os.path.join(dirname, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_compute_hash_large_file(self):
+        # exercise more than one buffer's worth of data
+        data = os.urandom(common.HASH_BUFFER_SIZE * 2 + 17)
+        with temp_dir() as d:
+            path = self._write(d, "big", data)
+            self.assertEqual(common.compute_sha256(path), hashlib.sha256(data).hexdigest())
+            self.assertEqual(common.compute_md5(path), hashlib.md5(data).hexdigest())
+
+    def test_verify_many(self):
+        with temp_dir() as d:
+            good = self._write(d, "good", b"good data")
+            bad = self._write(d, "bad", b"bad data")
+            upper = self._write(d, "upper", b"upper")
+            results = hash_algorithms.verify_many([
+                ("md5", good, hashlib.md5(b"good data").hexdigest()),
+                ("sha1", bad, hashlib.sha1(b"other data").hexdigest()),
+                (None, upper, hashlib.md5(b"upper").hexdigest().upper()),
+            ])
+        self.assertEqual(results, [True, False, True])
+
+    def test_verify_many_same_path(self):
+        # two packages whose URLs share a basename share a cache file
+        with temp_dir() as d:
+            path = self._write(d, "shared", b"shared data")
+            requests = [("md5", path, hashlib.md5(b"other data").hexdigest()),
+                        ("md5", path, hashlib.md5(b"shared data").hexdigest()),
+                        ("md5", path, hashlib.md5(b"more data").hexdigest())]
+            self.assertEqual(hash_algorithms.verify_many(requests), [False, True, False])
+            self.assertEqual(hash_algorithms.verify_many(requests, max_workers=1), [False, True, False])
+
+    def test_verify_many_empty(self):
+        self.assertEqual(hash_algorithms.verify_many([]), [])
+
+    def test_verify_many_unsupported(self):
+        with temp_dir() as d:
+            path = self._write(d, "file", b"data")
+            with self.assertRaises(AutobuildError):
+                hash_algorithms.verify_many([("bogus", path, "0123"), ("md5", path, "0123")])
+
+    def test_blake2b_tree(self):
+        saved = common.TREE_HASH_CHUNK_SIZE
+        common.TREE_HASH_CHUNK_SIZE = 1024
+        try:
+            data = os.urandom(5 * 1024 + 3)
+            with temp_dir() as d:
+                path = self._write(d, "tree", data)
+                digest = common.compute_blake2b_tree(path)
+                # independent of the number of worker threads
+                self.assertEqual(common.compute_blake2b_tree(path, max_workers=1), digest)
+                self.assertEqual(len(digest), 64)
+                self.assertTrue(hash_algorithms.verify_hash("blake2b_tree", path, digest.upper()))
+                self.assertEqual(hash_algorithms.compute_hash("blake2b_tree", path), digest)
+                other = self._write(d, "other", data[:-1] + bytes([data[-1] ^ 1]))
+                self.assertFalse(hash_algorithms.verify_hash("blake2b_tree", other, digest))
+        finally:
+            common.TREE_HASH_CHUNK_SIZE = saved
+
+    def test_blake2b_tree_small_file(self):
+        with temp_dir() as d:
+            empty = self._write(d, "empty", b"")
+            small = self._write(d, "small", b"small")
+            self.assertNotEqual(common.compute_blake2b_tree(empty), common.compute_blake2b_tree(small))
+            self.assertEqual(common.compute_blake2b_tree(small),
+                             hashlib.blake2b(b"small", digest_size=32, person=b"autobuild-leaf").hexdigest())
+
+    def test_compute_hash_unsupported(self):
+        with self.assertRaises(AutobuildError):
+            hash_algorithms.compute_hash("bogus", __file__)
+
+    def tearDown(self):
+        BaseTest.tearDown(self)
@@ -1,3 +1,4 @@
+import errno
 import logging
 import os
 import posixpath
@@ -12,7 +13,7 @@ from threading import Thread
 from unittest import TestCase
 from unittest.mock import MagicMock, patch
 
-from autobuild import autobuild_tool_install, autobuild_tool_uninstall, common
+from autobuild import autobuild_tool_install, autobuild_tool_uninstall, common, configfile
 from autobuild.autobuild_tool_install import CredentialsNotFoundError
 from tests.basetest import *
 
@@ -536,6 +537,21 @@ class TestInstallCachedBZ2Archive(BaseTest):
             autobuild_tool_install.AutobuildTool().run(self.options)
         self.assertEqual(stream.getvalue(), 'Dirty Packages: \n')
 
+    def test_verify_shared_cache_file(self):
+        # two installables whose URLs share a basename share a cache file:
+        # only the one whose hash matches it is verified
+        good_hash = common.compute_md5(self.cache_name)
+        config = configfile.ConfigurationDescription(self.options.install_filename)
+        for name, host, hash in (("good", "a.example", good_hash), ("wrong", "b.example", "0" * 32)):
+            package = configfile.PackageDescription(name)
+            platform = configfile.PlatformDescription()
+            platform.archive = configfile.ArchiveDescription(dict(
+                url="http://%s/bogus-0.1-common-111.tar.bz2" % host, hash=hash, hash_algorithm="md5"))
+            package.platforms["common"] = platform
+            config.installables[name] = package
+        self.assertEqual(autobuild_tool_install.verify_cached_packages(["wrong", "good"], config, "common"),
+                         {("md5", self.cache_name, good_hash)})
+
 # -------------------------------------  -------------------------------------
 class TestInstallCachedGZArchive(BaseTest):
     def setup_method(self, method):
@@ -628,6 +644,17 @@ class TestInstallCachedZIPArchive(BaseTest):
             autobuild_tool_install.AutobuildTool().run(self.options)
         self.assertEqual(stream.getvalue(), 'Dirty Packages: \n')
 
+# -------------------------------------  -------------------------------------
+class TestExtractZIPPackage(BaseTest):
+    def test_extract(self):
+        archive = os.path.join(mydir, "data", "bogus-0.1-common-111.zip")
+        with temp_dir() as install_dir:
+            results = autobuild_tool_install.extract_package(archive, install_dir)
+            self.assertEqual(["include/bogus.h", "LICENSES/bogus.txt", "lib/bogus.lib"], results.files)
+            self.assertEqual("bogus", results.metadata.package_description.name)
+            assert os.path.exists(os.path.join(install_dir, "lib", "bogus.lib"))
+        self.assertEqual("bogus", autobuild_tool_install.get_metadata_from_package(archive).package_description.name)
+
 # -------------------------------------  -------------------------------------
 class TestInstallLocalArchive(BaseTest):
     def setup_method(self, method):
@@ -784,6 +811,96 @@ class TestDownloadPackage(unittest.TestCase):
             with self.assertRaises(CredentialsNotFoundError):
                 autobuild_tool_install.download_package("https://example.org/foo.tar.bz2", creds="github")
 
+# -------------------------------------  -------------------------------------
+class TestRemoveFiles(unittest.TestCase):
+    def make_tree(self, install_dir, files):
+        for filename in files:
+            path = os.path.join(install_dir, filename)
+            if filename.endswith('/'):
+                os.makedirs(path, exist_ok=True)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w') as f:
+                    f.write(filename)
+
+    def test_remove_files(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            one = os.path.join(tmp, "one")
+            two = os.path.join(tmp, "two")
+            one_files = ["include/", "include/one/", "include/one/a.h", "include/one/deep/b.h", "lib/one.a"]
+            two_files = ["include/", "include/two.h", "lib/", "lib/sub"]
+            self.make_tree(one, one_files + ["include/keep.h"])
+            self.make_tree(two, ["include/two.h"])
+            # a directory listed without its trailing slash
+            os.makedirs(os.path.join(two, "lib", "sub"))
+            saved = autobuild_tool_install.PARALLEL_REMOVE_THRESHOLD
+            autobuild_tool_install.PARALLEL_REMOVE_THRESHOLD = 1
+            try:
+                errors = autobuild_tool_install.remove_files(
+                    [(one, one_files + ["missing.h"]), (two, two_files)], max_workers=4)
+            finally:
+                autobuild_tool_install.PARALLEL_REMOVE_THRESHOLD = saved
+            self.assertEqual(errors, [[], []])
+            # a file not in any manifest keeps its directories
+            self.assertEqual(os.listdir(one), ["include"])
+            self.assertEqual(os.listdir(os.path.join(one, "include")), ["keep.h"])
+            # an emptied install directory goes too
+            self.assertFalse(os.path.exists(two))
+
+    def test_clean_files_error(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.make_tree(tmp, ["dir/file"])
+            with patch("os.remove", side_effect=PermissionError(errno.EACCES, "denied")):
+                with self.assertRaises(common.AutobuildError):
+                    autobuild_tool_install.clean_files(tmp, ["dir/file"])
+            self.assertTrue(os.path.exists(os.path.join(tmp, "dir", "file")))
+
+# -------------------------------------  -------------------------------------
+class TestConflictIndex(unittest.TestCase):
+    def package(self, name, version="1.0", build_id="1", dependencies=None):
+        return dict(package_description=dict(name=name, version=version),
+                    configuration="Release", build_id=build_id,
+                    archive=dict(url="https://example.com/%s-%s.tar.bz2" % (name, version), hash="0" * 32),
+                    dependencies=dependencies or {})
+
+    def test_indirect_conflict_report(self):
+        zlib = self.package("zlib", "1.2")
+        png = self.package("png", dependencies=dict(zlib=zlib))
+        installed = dict(dependencies=dict(
+            other=self.package("other"),
+            image=self.package("image", build_id="7", dependencies=dict(png=png))))
+        new_zlib = self.package("zlib", "1.3")
+        self.assertEqual(autobuild_tool_install.package_in_installed(new_zlib, installed),
+                         "zlib\n"
+                         "  installed url  https://example.com/zlib-1.2.tar.bz2\n"
+                         "             vs  https://example.com/zlib-1.3.tar.bz2\n"
+                         "  installed version 1.2\n"
+                         "                vs  1.3\n"
+                         "used by png version 1.0 build 1\n"
+                         "used by image version 1.0 build 7\n")
+        self.assertEqual(autobuild_tool_install.package_in_installed(self.package("zlib", "1.2"), installed), "")
+
+        new_package = self.package("viewer", dependencies=dict(zlib=new_zlib, png=self.package("png")))
+        conflicts = autobuild_tool_install.transitive_search(new_package, installed)
+        self.assertTrue(conflicts.startswith("dependency zlib with installed package zlib\n"), conflicts)
+        self.assertNotIn("dependency png", conflicts)
+
+    def test_no_search_beneath_same_name(self):
+        # an installed zlib's own (bogus) zlib dependency is never reported
+        inner = self.package("zlib", "0.1")
+        installed = dict(dependencies=dict(zlib=self.package("zlib", dependencies=dict(zlib=inner))))
+        self.assertEqual(autobuild_tool_install.package_in_installed(self.package("zlib"), installed), "")
+
+    def test_cached_on_dependencies(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            installed = configfile.Dependencies(os.path.join(tmp, configfile.INSTALLED_CONFIG_FILE))
+            installed.dependencies["zlib"] = self.package("zlib")
+            index = autobuild_tool_install.InstalledIndex.of(installed)
+            self.assertIs(autobuild_tool_install.InstalledIndex.of(installed), index)
+            self.assertNotIn("conflict_index", installed)
+            installed.dependencies["png"] = self.package("png")
+            self.assertIsNot(autobuild_tool_install.InstalledIndex.of(installed), index)
+
 # -------------------------------------  -------------------------------------
 class TestInstallCacheOnly(BaseTest):
     def setup_method(self, module):
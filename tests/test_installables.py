@@ -1,9 +1,9 @@
 import os
 
 import autobuild.autobuild_tool_installables as installables
-from autobuild import configfile
+from autobuild import common, configfile
 from tests.baseline_compare import AutobuildBaselineCompare
-from tests.basetest import BaseTest, assert_in
+from tests.basetest import BaseTest, assert_in, temp_dir
 
 
 class TestInstallables(BaseTest, AutobuildBaselineCompare):
@@ -37,6 +37,53 @@ class TestInstallables(BaseTest, AutobuildBaselineCompare):
         installables.remove(self.config, 'bogus')
         self.assertEqual(len(self.config.installables), 0)
 
+    def test_add_computes_requested_hash(self):
+        local_archive=os.path.join(self.datadir,'bogus-0.1-common-111.tar.bz2')
+        data = ('license=tut', 'license_file=LICENSES/bogus.txt', 'platform=darwin',
+            'url='+local_archive, 'hash_algorithm=blake2b_tree')
+        installables.add(self.config, 'bogus', None, data)
+        archive = self.config.installables['bogus'].platforms['darwin'].archive
+        self.assertEqual(archive.hash_algorithm, 'blake2b_tree')
+        self.assertEqual(archive.hash, common.compute_blake2b_tree(local_archive))
+
+    def test_bulk(self):
+        installables.add(self.config, 'bogus', None,
+                         ('platform=common', 'url='+os.path.join(self.datadir, 'bogus-0.1-common-111.tar.bz2')))
+        bogus = os.path.join(self.datadir, 'bogus-0.2-common-222.tar.bz2')
+        bingo = os.path.join(self.datadir, 'bingo-0.1-common-111.tar.bz2')
+        installables.bulk(self.config, [bogus, bingo], ['hash_algorithm=sha1'])
+        self.assertEqual(['bingo', 'bogus'], sorted(self.config.installables))
+        # bogus is edited in place, bingo added
+        self.assertEqual('0.2', self.config.installables['bogus'].version)
+        archive = self.config.installables['bogus'].platforms['common'].archive
+        self.assertTrue(archive.url.endswith(bogus))
+        self.assertEqual('sha1', archive.hash_algorithm)
+        self.assertEqual(common.compute_sha1(bogus), archive.hash)
+        archive = self.config.installables['bingo'].platforms['common'].archive
+        self.assertEqual(common.compute_sha1(bingo), archive.hash)
+
+    def test_bulk_all_or_nothing(self):
+        archives = [os.path.join(self.datadir, name) for name in
+                    ('bingo-0.1-common-111.tar.bz2', 'nometa-0.1-common-111.tar.bz2',
+                     'bogus-0.1-common-111.tar.bz2', 'bogus-0.2-common-222.tar.bz2')]
+        with self.assertRaises(installables.InstallablesError) as caught:
+            installables.bulk(self.config, archives, [])
+        self.assertIn('nometa-0.1-common-111.tar.bz2: archive has no package metadata', str(caught.exception))
+        self.assertIn('are both bogus for platform common', str(caught.exception))
+        self.assertEqual(0, len(self.config.installables))
+
+    def test_bulk_corrupt_archive(self):
+        with temp_dir() as directory:
+            corrupt = os.path.join(directory, 'corrupt-0.1-common-111.tar.bz2')
+            with open(corrupt, 'wb') as f:
+                f.write(b'not an archive')
+            archives = [corrupt, os.path.join(self.datadir, 'nometa-0.1-common-111.tar.bz2')]
+            with self.assertRaises(installables.InstallablesError) as caught:
+                installables.bulk(self.config, archives, [])
+        self.assertIn('corrupt-0.1-common-111.tar.bz2: ', str(caught.exception))
+        self.assertIn('nometa-0.1-common-111.tar.bz2: archive has no package metadata', str(caught.exception))
+        self.assertEqual(0, len(self.config.installables))
+
     def tearDown(self):
         self.cleanup_tmp_file()
         BaseTest.tearDown(self)
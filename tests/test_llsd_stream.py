@@ -0,0 +1,82 @@
+import datetime
+import os
+import uuid
+
+import llsd
+
+from autobuild import configfile, llsd_stream
+from tests.basetest import BaseTest
+
+
+class TestLLSDStream(BaseTest):
+    def setUp(self):
+        BaseTest.setUp(self)
+        self.data_dir = os.path.join(os.path.dirname(__file__), "data")
+
+    def check_same(self, value):
+        for formatted in (llsd.format_xml(value), llsd.format_pretty_xml(value)):
+            self.assertEqual(llsd_stream.parse(formatted), llsd.parse(formatted))
+
+    def test_matches_llsd(self):
+        self.check_same(dict(
+            name="zlib", empty="", count=3, ratio=1.5, dirty=False, clean=True, nothing=None,
+            nested=dict(list=["a", "b & <c>", [], {}], deeper=dict(x=[1, 2.0, None])),
+            id=uuid.UUID("01234567-89ab-cdef-0123-456789abcdef"),
+            url=llsd.uri("http://example.com/?a=1&b=2"),
+            when=datetime.datetime(2020, 1, 2, 3, 4, 5),
+            blob=llsd.binary(b"\x00\x01binary"),
+            unicode="été"))
+        self.check_same([])
+        self.check_same("just a string")
+
+    def test_config_files(self):
+        for name in os.listdir(self.data_dir):
+            if name.endswith(".xml"):
+                with open(os.path.join(self.data_dir, name), 'rb') as f:
+                    contents = f.read()
+                self.assertEqual(llsd_stream.parse(contents), llsd.parse(contents), name)
+
+    def test_lazy(self):
+        document = dict(dependencies=dict(
+            one=dict(name="one", manifest=["a/", "a/b.h"]),
+            two=dict(name="two", manifest=[]),
+            three=dict(name="three", manifest=dict(encoding="front-coded", count=1, paths="0:x"))))
+        raw = []
+        parsed = llsd_stream.parse(llsd.format_pretty_xml(document),
+                                   lazy=dict(manifest=lambda xml: raw.append(xml) or len(raw) - 1))
+        self.assertEqual(parsed["dependencies"]["one"]["name"], "one")
+        for name, package in document["dependencies"].items():
+            index = parsed["dependencies"][name]["manifest"]
+            self.assertEqual(llsd_stream.parse_value(raw[index]), package["manifest"])
+
+    def test_lazy_manifest(self):
+        document = dict(version=configfile.AUTOBUILD_INSTALLED_VERSION, manifest=["a/", "a/b.h"])
+        parsed = llsd_stream.parse(llsd.format_xml(document), lazy=configfile._LAZY_MANIFESTS)
+        manifest = parsed["manifest"]
+        self.assertIsInstance(manifest, configfile.LazyManifest)
+        self.assertIsNotNone(manifest._raw)
+        self.assertIn("a/b.h", manifest)
+        self.assertIsNone(manifest._raw)
+        self.assertEqual(manifest, ["a/", "a/b.h"])
+
+    def test_lazy_empty_element(self):
+        # an empty manifest may be written as a self-closing element, followed
+        # directly by the next tag
+        for empty in (b"<array/>", b"<array />", b"<undef/>", b"<undef />", b"<array></array>"):
+            for following in (b"", b"<key>name</key><string>x</string>"):
+                document = (b"<llsd><map><key>version</key><string>%s</string><key>manifest</key>%s%s</map></llsd>"
+                            % (configfile.AUTOBUILD_INSTALLED_VERSION.encode(), empty, following))
+                parsed = llsd_stream.parse(document, lazy=configfile._LAZY_MANIFESTS)
+                self.assertEqual(parsed["manifest"]._raw, empty)
+                self.assertEqual(list(parsed["manifest"]), [])
+                if following:
+                    self.assertEqual(parsed["name"], "x")
+
+    def test_invalid(self):
+        with self.assertRaises(llsd.LLSDParseError):
+            llsd_stream.parse(b"<llsd><map><key>a</key><string>b</map></llsd>")
+        with self.assertRaises(llsd.LLSDParseError):
+            llsd_stream.parse(b"<notllsd/>")
+
+    def tearDown(self):
+        BaseTest.tearDown(self)
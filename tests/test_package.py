@@ -113,8 +113,9 @@ autobuild_package_md5="%s"
 autobuild_package_blake2b="%s"
 autobuild_package_sha1="%s"
 autobuild_package_sha256="%s"
+autobuild_package_blake2b_tree="%s"
 $''' % ('test1', '1.0', re.escape(os.path.join(self.data_dir, "package-test", "autobuild-package.xml")),
-        "common", re.escape(self.tar_name), "[0-9a-f]{32}", "[0-9a-f]{128}", "[0-9a-f]{40}", "[0-9a-f]{64}")
+        "common", re.escape(self.tar_name), "[0-9a-f]{32}", "[0-9a-f]{128}", "[0-9a-f]{40}", "[0-9a-f]{64}", "[0-9a-f]{64}")
         expected=re.compile(expected_results_regex, flags=re.MULTILINE)
         assert os.path.exists(results_output), "results file not found: %s" % results_output
         actual_results = open(results_output,'r').read()
@@ -139,6 +140,7 @@ $''' % ('test1', '1.0', re.escape(os.path.join(self.data_dir, "package-test", "a
             self.assertEqual(len(results["autobuild_package_blake2b"]), 128)
             self.assertEqual(len(results["autobuild_package_sha1"]), 40)
             self.assertEqual(len(results["autobuild_package_sha256"]), 64)
+            self.assertEqual(len(results["autobuild_package_blake2b_tree"]), 64)
 
     def test_package_other_version(self):
         # read the existing metadata file and update stored package version
@@ -1,11 +1,13 @@
 import os
 from unittest import TestCase
+from unittest.mock import patch
 
 import pytest
 
+import autobuild.scm.git
 from autobuild.common import cmd
 from autobuild.scm.base import date
-from autobuild.scm.git import get_version
+from autobuild.scm.git import get_version, new_client
 from tests.basetest import chdir, git_repo, needs_git
 
 
@@ -113,3 +115,65 @@ class GitTests(TestCase):
         cmd("git", "add", "file")
         version = get_version(self.repo)
         self.assertRegex(version, fr"^1\.0\.1\-dev1\.g[a-z0-9]{{7}}.d{date()}$")
+
+
+@needs_git
+class GitQueryTests(TestCase):
+    repo: str
+
+    @pytest.fixture(autouse=True)
+    def init(self):
+        with git_repo() as repo:
+            self.repo = repo
+            yield
+
+    def git_calls(self):
+        """Patch the git module's cmd() to record the git commands run"""
+        calls = []
+
+        def recording_cmd(*args, **kwds):
+            calls.append(args)
+            return cmd(*args, **kwds)
+        return calls, patch.object(autobuild.scm.git, "cmd", recording_cmd)
+
+    def test_shared_client(self):
+        client = new_client(self.repo)
+        self.assertIs(client, new_client(os.path.join(self.repo, "dir")))
+
+    def test_head_from_files(self):
+        client = new_client(self.repo)
+        calls, patcher = self.git_calls()
+        with patcher:
+            revision, branch, url = client.revision, client.branch, client.url
+        self.assertEqual([], calls)
+        self.assertEqual(cmd("git", "rev-parse", "HEAD").stdout, revision)
+        self.assertEqual(cmd("git", "rev-parse", "--abbrev-ref", "HEAD").stdout, branch)
+        self.assertEqual("https://example.com/foo.git", url)
+
+    def test_packed_refs(self):
+        cmd("git", "pack-refs", "--all")
+        client = new_client(self.repo)
+        self.assertEqual(cmd("git", "rev-parse", "HEAD").stdout, client.revision)
+
+    def test_detached_head(self):
+        cmd("git", "checkout", "--detach")
+        client = new_client(self.repo)
+        self.assertEqual(cmd("git", "rev-parse", "HEAD").stdout, client.revision)
+        self.assertEqual("HEAD", client.branch)
+
+    def test_version_remembered(self):
+        client = new_client(self.repo)
+        self.assertEqual("1.0.0", client.version)
+        calls, patcher = self.git_calls()
+        with patcher:
+            self.assertEqual("1.0.0", client.version)
+        self.assertEqual([], calls)
+        # until HEAD moves
+        with open(os.path.join(self.repo, "file"), "w") as f:
+            f.write("+1")
+        cmd("git", "add", "file")
+        cmd("git", "commit", "-m", "distance")
+        self.assertRegex(client.version, r"^1\.0\.1\-dev1\.g[a-z0-9]{7}$")
+        # or the tags change
+        cmd("git", "tag", "v1.1.0")
+        self.assertEqual("1.1.0", client.version)
@@ -0,0 +1,78 @@
+import os
+import re
+import subprocess
+import sys
+import time
+import unittest
+
+from autobuild import server
+from tests.basetest import BaseTest, temp_dir
+
+
+@unittest.skipUnless(server.is_supported(), "autobuild server needs Unix domain sockets")
+class TestServer(BaseTest):
+    def setUp(self):
+        BaseTest.setUp(self)
+        self.temp = temp_dir()
+        self.dir = self.temp.__enter__()
+        self.socket = os.path.join(self.dir, "autobuild.sock")
+        self.log = open(os.path.join(self.dir, "server.log"), "w+")
+        self.server = subprocess.Popen(self.command("server", "--verbose", "--socket", self.socket),
+                                       stdout=self.log, stderr=subprocess.STDOUT)
+        for _ in range(200):
+            if os.path.exists(self.socket):
+                break
+            time.sleep(0.05)
+        else:
+            self.fail("autobuild server did not start")
+
+    def tearDown(self):
+        subprocess.call(self.command("server", "--stop", "--socket", self.socket))
+        self.server.wait(timeout=30)
+        self.log.close()
+        self.temp.__exit__(None, None, None)
+        BaseTest.tearDown(self)
+
+    def command(self, *args):
+        return [sys.executable, "-m", "autobuild.autobuild_main"] + list(args)
+
+    def run_autobuild(self, *args, **environment):
+        env = dict(os.environ, **environment)
+        env.setdefault(server.SERVER_ENV, self.socket)
+        return subprocess.run(self.command(*args), cwd=self.dir, env=env,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              universal_newlines=True)
+
+    def server_log(self):
+        self.log.seek(0)
+        return self.log.read()
+
+    def test_caller_context(self):
+        # the command sees the caller's cwd and environment, and writes to
+        # the caller's streams
+        result = self.run_autobuild("print", AUTOBUILD_CONFIG_FILE="other.xml")
+        self.assertEqual(0, result.returncode, result.stderr)
+        missing = re.search(r"Configuration file '(.*)' not found", result.stderr)
+        self.assertIsNotNone(missing, result.stderr)
+        self.assertEqual(os.path.realpath(os.path.join(self.dir, "other.xml")),
+                         os.path.realpath(missing.group(1)))
+        self.assertIn("serving print in", self.server_log())
+
+    def test_exit_status(self):
+        result = self.run_autobuild("install", "--no-such-option")
+        self.assertEqual(2, result.returncode)
+        self.assertIn("unrecognized arguments", result.stderr)
+
+    def test_no_server(self):
+        # without a server, commands run locally
+        result = self.run_autobuild("print", AUTOBUILD_SERVER=os.path.join(self.dir, "nothing.sock"))
+        self.assertEqual(0, result.returncode, result.stderr)
+        self.assertNotIn("serving", self.server_log())
+
+    def test_stop(self):
+        subprocess.check_call(self.command("server", "--stop", "--socket", self.socket))
+        self.assertEqual(0, self.server.wait(timeout=30))
+        self.assertFalse(os.path.exists(self.socket))
+        # and commands carry on without it
+        result = self.run_autobuild("print")
+        self.assertEqual(0, result.returncode, result.stderr)
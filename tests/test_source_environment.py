@@ -326,3 +326,75 @@ replace_switch def xyz $switches""").split()),
         with envvar("AUTOBUILD_VSVER", "170"):
             vars = self.read_variables(self.find_data("empty"))
         self.assertEqual(vars["AUTOBUILD_WIN_VSTOOLSET"], "v143")
+
+
+class TestEnvironmentCache(BaseTest):
+    def setUp(self):
+        BaseTest.setUp(self)
+        self.calls = []
+        self.saved_vsver = os.environ.get("AUTOBUILD_VSVER")
+        self.tempdir = tempfile.mkdtemp()
+        self.varsfile = os.path.join(self.tempdir, "variables")
+        with open(self.varsfile, "w") as f:
+            f.write('LL_BUILD="one"\n')
+
+    def runner(self, configurations, varsfile):
+        self.calls.append((configurations, varsfile))
+        with open(varsfile) as f:
+            contents = f.read()
+        return dict(AUTOBUILD_VSVER="170"), dict(CONTENTS=contents), dict(PATH="vs")
+
+    def test_memory_cache(self):
+        cache = atse.EnvironmentCache(runner=self.runner)
+        with envvar("AUTOBUILD_VSVER", None), envvar(atse.ENVIRONMENT_CACHE_ENV, None):
+            exports, vars, vsvars = cache.get(["Release"], self.varsfile)
+            self.assertEqual(os.environ["AUTOBUILD_VSVER"], "170")
+            # a returned dict can be modified without affecting the cache
+            vars["CONTENTS"] = "changed"
+            self.assertEqual(cache.get(["Release"], self.varsfile)[1], dict(CONTENTS='LL_BUILD="one"\n'))
+            self.assertEqual(len(self.calls), 1)
+            cache.get(["Debug"], self.varsfile)
+            self.assertEqual(len(self.calls), 2)
+            with envvar("AUTOBUILD_ADDRSIZE", "32"):
+                cache.get(["Release"], self.varsfile)
+            self.assertEqual(len(self.calls), 3)
+            # vcvarsall.bat might read any variable...
+            with envvar("UNRELATED_VARIABLE", "x"):
+                cache.get(["Release"], self.varsfile)
+            self.assertEqual(len(self.calls), 4)
+            # ...but not the shell's or autobuild's bookkeeping
+            with envvar("SHLVL", "7"), envvar("AUTOBUILD_BUILD_ID", "12345"):
+                cache.get(["Release"], self.varsfile)
+            self.assertEqual(len(self.calls), 4)
+            with open(self.varsfile, "w") as f:
+                f.write('LL_BUILD="two"\n')
+            self.assertEqual(cache.get(["Release"], self.varsfile)[1], dict(CONTENTS='LL_BUILD="two"\n'))
+            self.assertEqual(len(self.calls), 5)
+
+    def test_disk_cache(self):
+        cache_dir = os.path.join(self.tempdir, "cache")
+        os.mkdir(cache_dir)
+        with envvar("AUTOBUILD_VSVER", None):
+            first = atse.EnvironmentCache(runner=self.runner, cache_dir=cache_dir).get([], self.varsfile)
+        # a new process, in effect
+        with envvar("AUTOBUILD_VSVER", None):
+            second = atse.EnvironmentCache(runner=self.runner, cache_dir=cache_dir).get([], self.varsfile)
+            self.assertEqual(os.environ["AUTOBUILD_VSVER"], "170")
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_unreadable_varsfile(self):
+        cache = atse.EnvironmentCache(runner=lambda configurations, varsfile: self.calls.append(varsfile))
+        missing = os.path.join(self.tempdir, "missing")
+        cache.get([], missing)
+        cache.get([], missing)
+        self.assertEqual(self.calls, [missing, missing])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+        # set by EnvironmentCache.get(), as by internal_source_environment()
+        if self.saved_vsver is None:
+            os.environ.pop("AUTOBUILD_VSVER", None)
+        else:
+            os.environ["AUTOBUILD_VSVER"] = self.saved_vsver
+        BaseTest.tearDown(self)
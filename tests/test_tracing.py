@@ -0,0 +1,77 @@
+import json
+import os
+import sys
+
+from autobuild import tracing
+from autobuild.executable import Executable
+from tests.basetest import BaseTest, envvar, temp_dir
+
+NESTED = """
+import os
+from autobuild import tracing
+with tracing.session(os.environ[tracing.TRACE_ENV], "nested"):
+    with tracing.span("inner"):
+        pass
+"""
+
+
+@tracing.traced()
+def _traced_function(value):
+    return value * 2
+
+
+class TestTracing(BaseTest):
+    def setUp(self):
+        BaseTest.setUp(self)
+
+    def read_trace(self, path):
+        with open(path) as f:
+            return json.load(f)["traceEvents"]
+
+    def test_disabled(self):
+        self.assertFalse(tracing.is_enabled())
+        self.assertEqual(_traced_function(2), 4)
+        with tracing.span("nothing"):
+            pass
+        environment = dict(PATH="/bin")
+        self.assertIs(tracing.child_environment(environment), environment)
+        with temp_dir() as d:
+            with tracing.session("", "untraced"):
+                self.assertFalse(tracing.is_enabled())
+            self.assertEqual(os.listdir(d), [])
+
+    def test_session(self):
+        with temp_dir() as d, envvar(tracing.TRACE_ID_ENV, None):
+            path = os.path.join(d, "trace.json")
+            with tracing.session(path, "autobuild test"):
+                self.assertTrue(tracing.is_enabled())
+                with tracing.span("outer", detail="x"):
+                    self.assertEqual(_traced_function(3), 6)
+            self.assertFalse(tracing.is_enabled())
+            events = self.read_trace(path)
+        spans = {event["name"]: event for event in events if event["ph"] == "X"}
+        self.assertEqual(set(spans), {"autobuild test", "outer", "test_tracing._traced_function"})
+        outer, inner = spans["outer"], spans["test_tracing._traced_function"]
+        self.assertEqual(outer["args"]["detail"], "x")
+        self.assertLessEqual(outer["ts"], inner["ts"])
+        self.assertGreaterEqual(outer["ts"] + outer["dur"], inner["ts"] + inner["dur"])
+
+    def test_nested_invocation(self):
+        with temp_dir() as d, envvar(tracing.TRACE_ID_ENV, None):
+            path = os.path.join(d, "trace.json")
+            with tracing.session(path, "outer"):
+                result = Executable(command=sys.executable, options=["-c", NESTED])()
+                self.assertEqual(result, 0)
+            events = self.read_trace(path)
+            # the nested invocation's fragment was merged and removed
+            self.assertEqual(os.listdir(d), ["trace.json"])
+        names = {event["name"] for event in events if event["ph"] == "X"}
+        self.assertTrue({"outer", "Executable", "nested", "inner"} <= names, names)
+        self.assertEqual(len({event["pid"] for event in events}), 2)
+        start = [event for event in events if event["ph"] == "s"]
+        finish = [event for event in events if event["ph"] == "f"]
+        self.assertEqual(len(start), 1)
+        self.assertEqual([event["id"] for event in finish], [start[0]["id"]])
+
+    def tearDown(self):
+        BaseTest.tearDown(self)